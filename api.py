@@ -1,98 +1,310 @@
+import asyncio
 import os
-from typing import Any, Coroutine
+from typing import Any, Coroutine, Mapping
 
-import requests
-from dotenv import load_dotenv
+import aiohttp
 import logging
+import re
+from time import perf_counter
+from types import SimpleNamespace
+from yarl import URL
 
-load_dotenv()
-API_URL = os.getenv("API_URL")
+from settings import API_URL
+from metrics import BACKEND_LATENCY, BACKEND_COALESCED, BACKEND_RETRIES, BACKEND_HEDGES, BACKEND_CIRCUIT_OPEN
+from resilience import CircuitBreaker, backoff
+
+
+# Параметры пула соединений и таймаутов для запросов к DRF
+API_POOL_SIZE = int(os.getenv("API_POOL_SIZE", 100))
+API_POOL_PER_HOST = int(os.getenv("API_POOL_PER_HOST", 30))
+API_KEEPALIVE = float(os.getenv("API_KEEPALIVE", 30))
+API_CONNECT_TIMEOUT = float(os.getenv("API_CONNECT_TIMEOUT", 5))
+API_READ_TIMEOUT = float(os.getenv("API_READ_TIMEOUT", 15))
+# Дедлайн на весь вызов вместе с повторами, по шаблону эндпоинта
+API_DEADLINE = float(os.getenv("API_DEADLINE", 10))
+ENDPOINT_DEADLINES = {
+    "/me/": 3.0,
+    "/users/{id}/": 3.0,
+    "/group/": 5.0,
+    "/api/token/refresh/": 5.0,
+}
+# Повторы идемпотентных GET при сетевых ошибках и 5xx
+API_RETRIES = int(os.getenv("API_RETRIES", 2))
+API_BACKOFF_BASE = float(os.getenv("API_BACKOFF_BASE", 0.1))
+API_BACKOFF_CAP = 1.0
+# Через сколько секунд без ответа дублировать чтение, от которого ждёт пользователь (0 — не дублировать)
+API_HEDGE_DELAY = float(os.getenv("API_HEDGE_DELAY", 0.5))
+HEDGED_ENDPOINTS = {"/me/", "/users/{id}/", "/group/"}
+# Предохранитель: ошибок подряд до размыкания и пауза до пробного запроса
+CIRCUIT_FAILURES = int(os.getenv("CIRCUIT_FAILURES", 5))
+CIRCUIT_RESET = float(os.getenv("CIRCUIT_RESET", 30))
+# Имя query-параметра "изменено после" в /event/, если бэкенд его поддерживает (пусто — только полные выгрузки)
+EVENTS_SINCE_PARAM = os.getenv("EVENTS_SINCE_PARAM", "")
 
 logger = logging.getLogger(__name__)
 
-async def authenticate_user(username: str, password: str) -> dict | None:
-    """Аутентификация пользователя и получение токенов."""
-    try:
-        response = requests.post(
-            f"{API_URL}/api/token/",
-            json={"username": username, "password": password}
+_session: aiohttp.ClientSession | None = None
+_breakers: dict[str, CircuitBreaker] = {}
+# (URL, токен) -> идущий GET; одинаковые одновременные чтения получают один ответ
+_inflight_reads: dict[tuple[str, str], asyncio.Task] = {}
+
+_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+# Шаблоны эндпоинтов DRF, которые бот вызывает; прочие пути (фото из /media/ и т.п.) сводятся
+# к одной метке, иначе каждый файл заводил бы свою серию гистограммы
+REST_ENDPOINTS = {"/api/token/", "/api/token/refresh/", "/user/link_telegram/", "/users/{id}/", "/me/",
+                  "/group/", "/event/", "/event/{id}/"}
+
+
+class BackendError(Exception):
+    """Ошибка обращения к DRF API."""
+
+
+class BackendUnavailable(BackendError):
+    """DRF не ответил вовремя, ответил 5xx или предохранитель эндпоинта разомкнут."""
+
+
+class Unauthorized(BackendError):
+    """DRF отклонил access_token (401); ``access_token`` — токен, с которым ушёл запрос."""
+
+    def __init__(self, url: str, access_token: str | None = None):
+        super().__init__(url)
+        self.access_token = access_token
+
+
+def _endpoint(url: URL) -> str:
+    """Шаблон эндпоинта для метрик: /users/123/ -> /users/{id}/."""
+    if API_URL is None or not str(url).startswith(API_URL):
+        return "external"
+    path = str(url)[len(API_URL):].split("?", 1)[0]
+    endpoint = _ID_SEGMENT.sub("/{id}", path)
+    if endpoint in REST_ENDPOINTS:
+        return endpoint
+    return "media" if path.startswith("/media/") else "other"
+
+
+async def _on_request_start(session, context: SimpleNamespace, params) -> None:
+    context.start = perf_counter()
+
+
+async def _on_request_end(session, context: SimpleNamespace, params) -> None:
+    BACKEND_LATENCY.observe(perf_counter() - context.start, method=params.method,
+                            endpoint=_endpoint(params.url), status=params.response.status)
+
+
+async def _on_request_exception(session, context: SimpleNamespace, params) -> None:
+    BACKEND_LATENCY.observe(perf_counter() - context.start, method=params.method,
+                            endpoint=_endpoint(params.url), status="error")
+
+
+def _trace_config() -> aiohttp.TraceConfig:
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(_on_request_start)
+    trace_config.on_request_end.append(_on_request_end)
+    trace_config.on_request_exception.append(_on_request_exception)
+    return trace_config
+
+
+def get_session() -> aiohttp.ClientSession:
+    """Общая HTTP-сессия с пулом keep-alive соединений (создаётся лениво внутри event loop)."""
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=API_POOL_SIZE,
+            limit_per_host=API_POOL_PER_HOST,
+            keepalive_timeout=API_KEEPALIVE,
+            ttl_dns_cache=300
         )
-        return response.json() if response.status_code == 200 else None
-    except Exception as e:
-        logger.error(f"Auth Error: {e}")
-        return None
+        timeout = aiohttp.ClientTimeout(
+            total=None,
+            connect=API_CONNECT_TIMEOUT,
+            sock_read=API_READ_TIMEOUT
+        )
+        _session = aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                         trace_configs=[_trace_config()])
+    return _session
 
-async def refresh_access_token(refresh_token: str) -> dict | None:
-    """Обновление access_token через refresh_token."""
+
+async def close_session() -> None:
+    """Закрывает HTTP-сессию и все соединения пула (хук на shutdown диспетчера)."""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+async def _send(method: str, url: str, kwargs: dict) -> tuple[int, Any, Mapping[str, str]]:
+    async with get_session().request(method, url, **kwargs) as response:
+        payload = await response.json(content_type=None) if response.status == 200 else None
+        return response.status, payload, response.headers
+
+
+async def _hedged_send(method: str, url: str, endpoint: str, kwargs: dict) -> tuple[int, Any, Mapping[str, str]]:
+    """Если ответа нет за API_HEDGE_DELAY, отправляет второй такой же запрос и берёт первый ответ."""
+    pending = {asyncio.create_task(_send(method, url, kwargs))}
     try:
-        response = requests.post(
-            f"{API_URL}/api/token/refresh/",
-            json={"refresh": refresh_token}
-        )
-        return response.json() if response.status_code == 200 else None
-    except Exception as e:
-        logger.error("Refresh Error: {e}")
-        return None
+        done, pending = await asyncio.wait(pending, timeout=API_HEDGE_DELAY)
+        if not done:
+            BACKEND_HEDGES.inc(endpoint=endpoint)
+            pending.add(asyncio.create_task(_send(method, url, kwargs)))
+        error = None
+        while True:
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+            if not pending:
+                raise error
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def _request(method: str, url: str, *, retry: bool = False, hedge: bool = False,
+                   **kwargs) -> tuple[int, Any, Mapping[str, str]]:
+    """Запрос к DRF: (статус, JSON при статусе 200, заголовки).
+
+    Укладывается в дедлайн эндпоинта; при ``retry`` повторяет сетевые ошибки
+    и 5xx с экспоненциальной паузой. Если ответа так и нет — BackendUnavailable.
+    """
+    endpoint = _endpoint(URL(url))
+    breaker = _breakers.get(endpoint)
+    if breaker is None:
+        breaker = _breakers[endpoint] = CircuitBreaker(CIRCUIT_FAILURES, CIRCUIT_RESET)
+    if not breaker.allow():
+        raise BackendUnavailable(f"{method} {endpoint}: circuit open")
+
+    deadline = ENDPOINT_DEADLINES.get(endpoint, API_DEADLINE)
+    attempts = 1 + API_RETRIES if retry else 1
+    hedge = hedge and API_HEDGE_DELAY > 0 and breaker.closed
+    error: Any = None
+    try:
+        async with asyncio.timeout(deadline):
+            for attempt in range(attempts):
+                if attempt:
+                    BACKEND_RETRIES.inc(endpoint=endpoint)
+                    await asyncio.sleep(backoff(attempt, API_BACKOFF_BASE, API_BACKOFF_CAP))
+                try:
+                    if hedge:
+                        result = await _hedged_send(method, url, endpoint, kwargs)
+                    else:
+                        result = await _send(method, url, kwargs)
+                except (aiohttp.ClientError, ValueError, TimeoutError) as e:
+                    error = e
+                    continue
+                if result[0] < 500:
+                    breaker.success()
+                    BACKEND_CIRCUIT_OPEN.set(0, endpoint=endpoint)
+                    return result
+                error = f"HTTP {result[0]}"
+    except TimeoutError:
+        error = f"no response in {deadline}s"
+
+    breaker.failure()
+    BACKEND_CIRCUIT_OPEN.set(0 if breaker.closed else 1, endpoint=endpoint)
+    raise BackendUnavailable(f"{method} {endpoint}: {error}")
+
+
+def _forget_read(key: tuple[str, str], task: asyncio.Task) -> None:
+    if _inflight_reads.get(key) is task:
+        del _inflight_reads[key]
+    if not task.cancelled():
+        # Ошибку логируют ожидающие; здесь только помечаем её полученной
+        task.exception()
+
+
+async def get_json(url: str, access_token: str) -> tuple[int, Any]:
+    """GET к DRF: (статус, JSON при статусе 200); 401 — Unauthorized.
+
+    Пока запрос того же URL с тем же токеном не завершился, повторный не
+    уходит в сеть, а ждёт его ответ (объект общий — не изменять).
+    """
+    key = (url, access_token)
+    task = _inflight_reads.get(key)
+    if task is None:
+        task = asyncio.create_task(_request("GET", url, retry=True,
+                                            hedge=_endpoint(URL(url)) in HEDGED_ENDPOINTS,
+                                            headers={"Authorization": f"Bearer {access_token}"}))
+        _inflight_reads[key] = task
+        task.add_done_callback(lambda t: _forget_read(key, t))
+    else:
+        BACKEND_COALESCED.inc(endpoint=_endpoint(URL(url)))
+    status, payload, _ = await asyncio.shield(task)
+    if status == 401:
+        raise Unauthorized(url, access_token)
+    return status, payload
+
+
+async def authenticate_user(username: str, password: str) -> dict | None:
+    """Аутентификация пользователя и получение токенов (None — неверные данные)."""
+    status, tokens, _ = await _request("POST", f"{API_URL}/api/token/",
+                                       json={"username": username, "password": password})
+    return tokens if status == 200 else None
+
+async def refresh_access_token(refresh_token: str) -> dict | None:
+    """Обновление access_token через refresh_token (None — refresh_token больше не действует)."""
+    status, tokens, _ = await _request("POST", f"{API_URL}/api/token/refresh/",
+                                       json={"refresh": refresh_token})
+    return tokens if status == 200 else None
 
 async def link_telegram_id(access_token: str, tg_id: int) -> bool:
     """Привязывает tg_id к пользователю в DRF."""
-    headers = {"Authorization": f"Bearer {access_token}"}
-    try:
-        response = requests.patch(
-            f"{API_URL}/user/link_telegram/",
-            json={"tg_id": tg_id},
-            headers=headers
-        )
-        return response.status_code == 200
-    except Exception as e:
-        logger.error(f"link_telegram_id Error: {e}")
-        return False
+    status, _, _ = await _request("PATCH", f"{API_URL}/user/link_telegram/", json={"tg_id": tg_id},
+                                  headers={"Authorization": f"Bearer {access_token}"})
+    return status == 200
 
 async def check_user_role(access_token: str, tg_id: int) -> Any | None:
     """Проверка, есть ли пользователь с таким tg_id в БД."""
-    headers = {"Authorization": f"Bearer {access_token}"}
-    try:
-        response = requests.get(f"{API_URL}/users/{tg_id}/", headers=headers)
-        return response.json() if response.status_code == 200 else None
-    except Exception as e:
-        logger.error(f"check_user_role Error: {e}")
-        return None
+    _, user = await get_json(f"{API_URL}/users/{tg_id}/", access_token)
+    return user
 
 async def get_profile(access_token: str) -> dict | None:
     """ Полечение информации об аккаунте"""
-    headers = {"Authorization": f"Bearer {access_token}"}
-    try:
-        response = requests.get(f"{API_URL}/me/", headers=headers)
-        return response.json() if response.status_code == 200 else None
-    except Exception as e:
-        logger.error(f"get_profile Error: {e}")
-        return None
+    _, profile = await get_json(f"{API_URL}/me/", access_token)
+    return profile
 
 async def get_groups_list(access_token: str) -> list | None:
-    headers = {"Authorization": f"Bearer {access_token}"}
-    try:
-        response = requests.get(f"{API_URL}/group/", headers=headers)
-        return response.json() if response.status_code == 200 else None
-    except Exception as e:
-        logger.error(f"get_groups_list Error: {e}")
-        return None
+    _, groups = await get_json(f"{API_URL}/group/", access_token)
+    return groups
 
-async def post_event(access_token: str, json: dict) -> bool | None:
-    """Получение всех мероприятий. """
+async def post_event(access_token: str, json: dict, idempotency_key: str | None = None) -> int:
+    """Создание мероприятия; возвращает HTTP-статус (DRF отвечает 201 Created).
+
+    ``idempotency_key`` уходит в заголовке Idempotency-Key: повтор того же
+    создания после обрыва связи бэкенд может распознать и не дублировать.
+    """
     headers = {"Authorization": f"Bearer {access_token}"}
-    try:
-        response = requests.post(f"{API_URL}/event/", headers=headers, json=json)
-        return response.status_code == 200
-    except Exception as e:
-        logger.error(f"post_event Error: {e}")
-        return None
+    if idempotency_key:
+        headers["Idempotency-Key"] = idempotency_key
+    status, _, _ = await _request("POST", f"{API_URL}/event/", json=json, headers=headers)
+    if status == 401:
+        raise Unauthorized(f"{API_URL}/event/", access_token)
+    return status
 
 async def get_events(access_token: str) -> list | None:
     """Получение всех мероприятий. """
+    _, events = await get_json(f"{API_URL}/event/", access_token)
+    return events
+
+async def event_exists(access_token: str, event_id) -> bool:
+    """Есть ли мероприятие в DRF: False только на 404."""
+    url = f"{API_URL}/event/{event_id}/"
+    status, _, _ = await _request("GET", url, retry=True, headers={"Authorization": f"Bearer {access_token}"})
+    if status == 401:
+        raise Unauthorized(url, access_token)
+    return status != 404
+
+async def fetch_events(access_token: str, etag: str | None = None, last_modified: str | None = None,
+                       since: str | None = None) -> tuple[int, list | None, Mapping[str, str]]:
+    """Условный запрос мероприятий: (статус, список, заголовки ответа).
+
+    304 — список не изменился с ``etag``/``last_modified``; при ``since``
+    бэкенд отдаёт только изменённые мероприятия.
+    """
     headers = {"Authorization": f"Bearer {access_token}"}
-    try:
-        response = requests.get(f"{API_URL}/event/", headers=headers)
-        return response.json() if response.status_code == 200 else None
-    except Exception as e:
-        logger.error(f"get_events Error: {e}")
-        return None
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    params = {EVENTS_SINCE_PARAM: since} if since and EVENTS_SINCE_PARAM else None
+    return await _request("GET", f"{API_URL}/event/", retry=True, headers=headers, params=params)
@@ -0,0 +1,302 @@
+"""Нагрузочный бенчмарк бота без Telegram и без настоящего DRF.
+
+Поднимает локальный фейковый DRF API (token, refresh, /me/, /users/<id>/,
+/event/, /group/ с настраиваемой задержкой), подменяет Redis на fakeredis
+в памяти процесса, а Bot API — сессией-заглушкой. Синтетические апдейты
+проходят через настоящий ``dp`` из main.py (dp_router и auth_router)
+через ``Dispatcher.feed_update``.
+
+Запуск (нужны fakeredis и lupa: ``pip install fakeredis lupa``)::
+
+    python -m benchmarks.bench --users 200 --api-latency 0.02
+"""
+import argparse
+import asyncio
+import datetime
+import itertools
+import os
+import sys
+import tempfile
+import time
+from statistics import quantiles
+
+API_HOST = "127.0.0.1"
+
+# Окружение должно быть готово до импорта модулей бота
+os.environ.setdefault("TG_TOKEN", "42:BENCHMARK")
+os.environ.setdefault("REDIS_HOST", "localhost")
+os.environ.setdefault("REDIS_PORT", "6379")
+os.environ.setdefault("REDIS_DB", "0")
+os.environ["METRICS_PORT"] = "0"
+os.environ["LOG_FILE"] = os.path.join(tempfile.gettempdir(), "bot-benchmark.log")
+
+try:
+    import fakeredis
+    import fakeredis.aioredis
+except ImportError:
+    sys.exit("benchmarks требуют fakeredis: pip install fakeredis lupa")
+
+import jwt
+import redis.asyncio
+from aiohttp import web
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import TelegramMethod
+from aiogram.types import CallbackQuery, Chat, Message, PhotoSize, Update, User
+
+_fake_server = fakeredis.FakeServer()
+
+
+class _InProcessRedis(fakeredis.aioredis.FakeRedis):
+    """Redis в памяти процесса: все клиенты бота видят одни и те же данные."""
+
+    def __init__(self, *args, **kwargs):
+        for option in ("host", "port", "db"):
+            kwargs.pop(option, None)
+        super().__init__(*args, server=_fake_server, **kwargs)
+
+
+redis.asyncio.Redis = _InProcessRedis
+
+
+def _token(lifetime: int) -> str:
+    return jwt.encode({"exp": int(time.time()) + lifetime}, "benchmark-secret-key-0123456789abcdef")
+
+
+class FakeDRF:
+    """Фейковый DRF API с задержкой ``latency`` секунд на каждый ответ."""
+
+    def __init__(self, latency: float, events: int, groups: int, port: int):
+        self.latency = latency
+        self.port = port
+        self.url = f"http://{API_HOST}:{port}"
+        self.events = [{
+            "id": i,
+            "title": f"Мероприятие {i}",
+            "event_date": f"2025-06-{i % 28 + 1:02d}T14:30:00+03:00",
+            "group": {"id": i % groups + 1, "name": f"Группа {i % groups + 1}"},
+            "author": {"username": "teacher"},
+            "description": "описание",
+            "type": "семинар",
+            "first_photo": {"photo": f"{self.url}/media/{i}.jpg"} if i % 3 == 0 else None,
+        } for i in range(events)]
+        self.groups = [{"id": i, "name": f"Группа {i}"} for i in range(1, groups + 1)]
+        self._runner: web.AppRunner | None = None
+
+    async def _reply(self, payload, status: int = 200) -> web.Response:
+        await asyncio.sleep(self.latency)
+        return web.json_response(payload, status=status)
+
+    async def token(self, request: web.Request) -> web.Response:
+        return await self._reply({"access": _token(300), "refresh": _token(24 * 60 * 60)})
+
+    async def refresh(self, request: web.Request) -> web.Response:
+        return await self._reply({"access": _token(300)})
+
+    async def link(self, request: web.Request) -> web.Response:
+        return await self._reply({})
+
+    async def profile(self, request: web.Request) -> web.Response:
+        return await self._reply({"username": "teacher", "email": "t@example.com", "first_name": "",
+                                  "last_name": "", "role": "teacher"})
+
+    async def get_events(self, request: web.Request) -> web.Response:
+        etag = f'"events-{len(self.events)}"'
+        if request.headers.get("If-None-Match") == etag:
+            await asyncio.sleep(self.latency)
+            return web.Response(status=304, headers={"ETag": etag})
+        response = await self._reply(self.events)
+        response.headers["ETag"] = etag
+        return response
+
+    async def post_event(self, request: web.Request) -> web.Response:
+        return await self._reply(await request.json(), status=201)
+
+    async def get_groups(self, request: web.Request) -> web.Response:
+        return await self._reply(self.groups)
+
+    async def photo(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(self.latency)
+        return web.Response(body=b"\xff\xd8benchmark", content_type="image/jpeg",
+                            headers={"ETag": f'"{request.match_info["name"]}"'})
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_post("/api/token/", self.token)
+        app.router.add_post("/api/token/refresh/", self.refresh)
+        app.router.add_patch("/user/link_telegram/", self.link)
+        app.router.add_get("/me/", self.profile)
+        app.router.add_get("/users/{tg_id}/", self.profile)
+        app.router.add_get("/event/", self.get_events)
+        app.router.add_post("/event/", self.post_event)
+        app.router.add_get("/group/", self.get_groups)
+        app.router.add_get("/media/{name}", self.photo)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, API_HOST, self.port).start()
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+class SinkSession(BaseSession):
+    """Сессия Bot API, которая ничего не отправляет и отвечает правдоподобными объектами."""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.requests = 0
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: int | None = None):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        returning = method.__returning__
+        chat = Chat(id=getattr(method, "chat_id", None) or 1, type="private")
+        if returning is Message or "Message" in str(returning):
+            if "Photo" in type(method).__name__ or "Media" in type(method).__name__:
+                return self._message(chat, photo=[PhotoSize(file_id=f"file-{next(self._message_ids)}",
+                                                            file_unique_id="u", width=1, height=1)])
+            return self._message(chat, text=getattr(method, "text", None) or "ok")
+        return True
+
+    def _message(self, chat: Chat, **kwargs) -> Message:
+        return Message(message_id=next(self._message_ids), date=datetime.datetime.now(), chat=chat, **kwargs)
+
+    async def close(self) -> None:
+        pass
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1_000_000)
+
+
+def _user(tg_id: int) -> User:
+    return User(id=tg_id, is_bot=False, first_name="bench")
+
+
+def text_update(tg_id: int, text: str) -> Update:
+    message = Message(message_id=next(_message_ids), date=datetime.datetime.now(),
+                      chat=Chat(id=tg_id, type="private"), from_user=_user(tg_id), text=text)
+    return Update(update_id=next(_update_ids), message=message)
+
+
+def callback_update(tg_id: int, data: str) -> Update:
+    message = Message(message_id=next(_message_ids), date=datetime.datetime.now(),
+                      chat=Chat(id=tg_id, type="private"), text="...")
+    callback = CallbackQuery(id=str(next(_update_ids)), from_user=_user(tg_id), chat_instance="bench",
+                             data=data, message=message)
+    return Update(update_id=next(_update_ids), callback_query=callback)
+
+
+def login_flow(tg_id: int) -> list[Update]:
+    return [text_update(tg_id, "/start"), text_update(tg_id, "teacher"), text_update(tg_id, "password")]
+
+
+def browse_flow(tg_id: int) -> list[Update]:
+    return [text_update(tg_id, "Просмотреть мероприятия"),
+            callback_update(tg_id, "events_page:1"),
+            callback_update(tg_id, "events_page:2"),
+            callback_update(tg_id, "events_page:1"),
+            text_update(tg_id, "Профиль")]
+
+
+def create_event_flow(tg_id: int) -> list[Update]:
+    return [text_update(tg_id, "Создать мероприятие"),
+            text_update(tg_id, "Нагрузочный семинар"),
+            callback_update(tg_id, "location_plehanovskaya"),
+            callback_update(tg_id, "type_seminar"),
+            callback_update(tg_id, "group_pick:1"),
+            text_update(tg_id, "2030-01-01 10:00")]
+
+
+SCENARIOS = {
+    "login": (login_flow, False),
+    "browse": (browse_flow, True),
+    "create_event": (create_event_flow, True),
+}
+
+
+async def run_user(dp, bot: Bot, updates: list[Update], latencies: list[float]) -> None:
+    # Апдейты одного пользователя идут по очереди, как в реальном чате
+    for update in updates:
+        start = time.perf_counter()
+        await dp.feed_update(bot, update)
+        latencies.append(time.perf_counter() - start)
+
+
+async def run_scenario(dp, bot: Bot, name: str, users: int, first_tg_id: int) -> dict:
+    flow, needs_login = SCENARIOS[name]
+    tg_ids = range(first_tg_id, first_tg_id + users)
+    if needs_login:
+        await asyncio.gather(*(run_user(dp, bot, login_flow(tg_id), []) for tg_id in tg_ids))
+
+    latencies: list[float] = []
+    start = time.perf_counter()
+    await asyncio.gather(*(run_user(dp, bot, flow(tg_id), latencies) for tg_id in tg_ids))
+    elapsed = time.perf_counter() - start
+
+    p50, p95, p99 = (0.0, 0.0, 0.0)
+    if len(latencies) > 1:
+        cuts = quantiles(latencies, n=100, method="inclusive")
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    return {"scenario": name, "updates": len(latencies), "seconds": elapsed,
+            "rate": len(latencies) / elapsed if elapsed else 0.0, "p50": p50, "p95": p95, "p99": p99}
+
+
+def print_report(results: list[dict]) -> None:
+    print(f"{'scenario':<14}{'updates':>9}{'upd/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for r in results:
+        print(f"{r['scenario']:<14}{r['updates']:>9}{r['rate']:>10.1f}"
+              f"{r['p50'] * 1000:>10.1f}{r['p95'] * 1000:>10.1f}{r['p99'] * 1000:>10.1f}")
+
+
+async def main(args: argparse.Namespace) -> None:
+    api = FakeDRF(args.api_latency, args.events, args.groups, args.api_port)
+    os.environ["API_URL"] = api.url
+    await api.start()
+
+    import api as api_module
+    api_module.API_URL = api.url
+    import main as bot_main
+
+    session = SinkSession(args.bot_latency)
+    if args.telegram_limits:
+        session.middleware(bot_main.outbound_scheduler)
+    bot = Bot(token=os.environ["TG_TOKEN"], session=session)
+    dp = bot_main.dp
+
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    try:
+        results = []
+        for index, name in enumerate(args.scenarios):
+            results.append(await run_scenario(dp, bot, name, args.users, first_tg_id=(index + 1) * 1_000_000))
+        print_report(results)
+        print(f"Bot API requests: {session.requests}")
+    finally:
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await api.stop()
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100, help="одновременных пользователей в сценарии")
+    parser.add_argument("--api-latency", type=float, default=0.01, help="задержка ответа DRF, с")
+    parser.add_argument("--bot-latency", type=float, default=0.0, help="задержка ответа Bot API, с")
+    parser.add_argument("--events", type=int, default=200, help="мероприятий в /event/")
+    parser.add_argument("--groups", type=int, default=50, help="групп в /group/")
+    parser.add_argument("--api-port", type=int, default=8765)
+    parser.add_argument("--telegram-limits", action="store_true",
+                        help="пропускать отправки через лимиты Telegram (sender.OutboundScheduler)")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -1,36 +1,231 @@
 import redis.asyncio as redis
+import asyncio
 import json
 import os
-from dotenv import load_dotenv
+import logging
+from collections import OrderedDict
+from time import time, monotonic
 
-load_dotenv()
+import jwt
 
+from settings import REDIS_HOST, REDIS_PORT, REDIS_DB
+from metrics import REDIS_LATENCY, CACHE_REQUESTS
+
+# Клиент не подключается при создании: пул открывается и прогревается на startup (lifecycle)
 redis_client = redis.Redis(
-    host=os.getenv("REDIS_HOST"),
-    port=int(os.getenv("REDIS_PORT")),
-    db=int(os.getenv("REDIS_DB")),
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    db=REDIS_DB,
     decode_responses=True
 )
 
+logger = logging.getLogger(__name__)
 
-async def save_tokens_redis(tg_id: int, tokens: dict) -> bool:
-    """Сохраняет токены в Redis (асинхронно)."""
+TOKEN_KEY_PREFIX = "user:"
+# Скользящий TTL сессии: каждое чтение продлевает его (0 — без продления)
+TOKEN_IDLE_TTL = int(os.getenv("TOKEN_IDLE_TTL", 60 * 60))
+# Локальный L1-кэш токенов (0 — выключен)
+TOKEN_L1_SIZE = int(os.getenv("TOKEN_L1_SIZE", 10_000))
+TOKEN_L1_TTL = float(os.getenv("TOKEN_L1_TTL", 60))
+INVALIDATE_CHANNEL = "__redis__:invalidate"
+
+
+def _encode_tokens(tokens: dict) -> str:
+    # JWT не содержит пробелов, поэтому пара токенов хранится одной строкой
+    return f"{tokens['access']} {tokens['refresh']}"
+
+
+def _decode_tokens(value: str) -> dict:
+    if value.startswith("{"):
+        # Старый формат (JSON), записанный до перехода на компактную строку
+        return json.loads(value)
+    access, refresh = value.split(" ", 1)
+    return {'access': access, 'refresh': refresh}
+
+
+def _token_exp(token: str) -> float | None:
     try:
-        await redis_client.set(f"user:{tg_id}", json.dumps(tokens), ex=60 * 60)
+        exp = jwt.decode(token, options={"verify_signature": False}).get("exp")
+    except jwt.DecodeError:
+        return None
+    return float(exp) if exp else None
+
+
+class TokenStore:
+    """Хранилище токенов: одна строка на пользователя в Redis и L1-кэш в процессе.
+
+    L1 используется только пока активна подписка на инвалидацию
+    (CLIENT TRACKING в режиме BCAST), иначе каждое чтение идёт в Redis.
+    """
+
+    def __init__(self, client: redis.Redis, idle_ttl: int = TOKEN_IDLE_TTL,
+                 l1_size: int = TOKEN_L1_SIZE, l1_ttl: float = TOKEN_L1_TTL):
+        self._client = client
+        self.idle_ttl = idle_ttl
+        self.l1_size = l1_size
+        self.l1_ttl = l1_ttl
+        # tg_id -> (токены, момент устаревания записи в L1)
+        self._l1: OrderedDict[int, tuple[dict, float]] = OrderedDict()
+        # tg_id -> [чтений из Redis в процессе, поколение]; инвалидация во время чтения
+        # сдвигает поколение, и прочитанное значение в L1 не попадает
+        self._reads: dict[int, list[int]] = {}
+        self._tracking = False
+        self._listener: asyncio.Task | None = None
+
+    @staticmethod
+    def key(tg_id: int) -> str:
+        return f"{TOKEN_KEY_PREFIX}{tg_id}"
+
+    def _ttl(self, tokens: dict) -> int:
+        """TTL ключа: до истечения refresh_token, но не дольше скользящего окна."""
+        ttl = self.idle_ttl or 60 * 60
+        refresh_exp = _token_exp(tokens["refresh"])
+        if refresh_exp is not None:
+            remaining = int(refresh_exp - time())
+            ttl = min(ttl, remaining) if self.idle_ttl else remaining
+        return max(ttl, 1)
+
+    async def save(self, tg_id: int, tokens: dict) -> bool:
+        try:
+            with REDIS_LATENCY.time(op="tokens_set"):
+                await self._client.set(self.key(tg_id), _encode_tokens(tokens), ex=self._ttl(tokens))
+        except Exception as e:
+            logger.error(f"Redis Save Error: {e}")
+            return False
+        self._forget(tg_id)
         return True
-    except Exception as e:
-        print(f"Redis Save Error: {e}")
-        return False
+
+    async def get(self, tg_id: int) -> dict | None:
+        tracking = self._tracking
+        if tracking:
+            entry = self._l1.get(tg_id)
+            if entry is not None and entry[1] > monotonic():
+                self._l1.move_to_end(tg_id)
+                CACHE_REQUESTS.inc(cache="tokens_l1", result="hit")
+                return entry[0]
+            CACHE_REQUESTS.inc(cache="tokens_l1", result="miss")
+
+        read = self._reads.setdefault(tg_id, [0, 0])
+        read[0] += 1
+        generation = read[1]
+        try:
+            # Одна команда: чтение и продление скользящего TTL
+            with REDIS_LATENCY.time(op="tokens_get"):
+                if self.idle_ttl:
+                    value = await self._client.getex(self.key(tg_id), ex=self.idle_ttl)
+                else:
+                    value = await self._client.get(self.key(tg_id))
+        finally:
+            read[0] -= 1
+            if not read[0]:
+                del self._reads[tg_id]
+        if not value:
+            return None
+
+        tokens = _decode_tokens(value)
+        refresh_exp = _token_exp(tokens["refresh"])
+        if refresh_exp is not None and refresh_exp <= time():
+            # Сессию продлить уже нельзя — считаем её отсутствующей
+            await self.delete(tg_id)
+            return None
+
+        if tracking and self._tracking and self.l1_size and read[1] == generation:
+            expires = monotonic() + self.l1_ttl
+            if refresh_exp is not None:
+                expires = min(expires, monotonic() + refresh_exp - time())
+            self._l1[tg_id] = (tokens, expires)
+            self._l1.move_to_end(tg_id)
+            if len(self._l1) > self.l1_size:
+                self._l1.popitem(last=False)
+        return tokens
+
+    async def delete(self, tg_id: int) -> bool:
+        self._forget(tg_id)
+        with REDIS_LATENCY.time(op="tokens_delete"):
+            await self._client.delete(self.key(tg_id))
+        return True
+
+    async def start(self) -> None:
+        """Запускает фоновую подписку на инвалидацию, включающую L1-кэш."""
+        if self.l1_size and self._listener is None:
+            self._listener = asyncio.create_task(self._track_invalidations())
+
+    async def close(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+    def _forget(self, tg_id: int) -> None:
+        self._l1.pop(tg_id, None)
+        read = self._reads.get(tg_id)
+        if read is not None:
+            read[1] += 1
+
+    def _forget_all(self) -> None:
+        self._l1.clear()
+        for read in self._reads.values():
+            read[1] += 1
+
+    def _disable_l1(self, *args) -> None:
+        self._tracking = False
+        self._forget_all()
+
+    def _invalidate(self, keys) -> None:
+        if keys is None:
+            # FLUSHDB/FLUSHALL на сервере
+            self._forget_all()
+            return
+        for key in keys:
+            tg_id = key[len(TOKEN_KEY_PREFIX):]
+            if tg_id.isdigit():
+                self._forget(int(tg_id))
+
+    async def _track_invalidations(self) -> None:
+        while True:
+            pubsub = self._client.pubsub()
+            try:
+                await pubsub.connect()
+                conn = pubsub.connection
+                await conn.send_command("CLIENT", "ID")
+                client_id = await conn.read_response()
+                await conn.send_command("CLIENT", "TRACKING", "ON", "REDIRECT", client_id,
+                                        "BCAST", "PREFIX", TOKEN_KEY_PREFIX)
+                await conn.read_response()
+                # После переподключения отслеживание на сервере теряется — L1 выключаем
+                conn.register_connect_callback(self._disable_l1)
+                await pubsub.subscribe(INVALIDATE_CHANNEL)
+                self._tracking = True
+
+                while self._tracking:
+                    message = await pubsub.get_message(timeout=1.0)
+                    if message and message["type"] == "message":
+                        self._invalidate(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Redis tracking Error: {e}")
+            finally:
+                self._disable_l1()
+                await pubsub.aclose()
+            await asyncio.sleep(5)
+
+
+token_store = TokenStore(redis_client)
+
+
+async def save_tokens_redis(tg_id: int, tokens: dict) -> bool:
+    """Сохраняет токены в Redis (асинхронно)."""
+    return await token_store.save(tg_id, tokens)
 
 async def get_tokens_redis(tg_id: int) -> dict | None:
-    """Получает токены из Redis (асинхронно) с атомарным обновлением TTL."""
-    async with redis_client.pipeline() as pipe:
-        data, _ = await (pipe.get(f"user:{tg_id}")
-                         .expire(f"user:{tg_id}", 60 * 60)
-                         .execute())
-        return json.loads(data) if data else None
+    """Получает токены (L1 или Redis) с продлением скользящего TTL одной командой."""
+    return await token_store.get(tg_id)
 
 async def delete_tokens_redis(tg_id: int) -> None | bool:
     """Удаляет токены из Redis (асинхронно)."""
-    await redis_client.delete(f"user:{tg_id}")
-    return True
\ No newline at end of file
+    return await token_store.delete(tg_id)
+
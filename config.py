@@ -1,17 +1,30 @@
 from typing import Union
+import html
 import jwt
-from time import time
 from functools import wraps
-from dateutil.parser import parse
+from collections import OrderedDict
 
-from aiogram.types import Message, ReplyKeyboardRemove, CallbackQuery
+from aiogram.types import Message, ReplyKeyboardRemove, CallbackQuery, InlineQuery, InlineQueryResultsButton
 from datetime import datetime
-from api import refresh_access_token
-from cache import save_tokens_redis, get_tokens_redis, delete_tokens_redis
+from api import BackendUnavailable, Unauthorized
+from cache import get_tokens_redis, delete_tokens_redis
+from token_manager import token_manager
 import logging
 
 logger = logging.getLogger(__name__)
 
+BACKEND_UNAVAILABLE_TEXT = "⚠️ Сервер мероприятий временно недоступен. Попробуйте позже."
+RETRY_TEXT = "⚠️ Не удалось загрузить данные. Повторите запрос."
+
+
+async def _deny(event, text: str, login: bool = True, **kwargs):
+    if isinstance(event, InlineQuery):
+        # В inline-режиме отвечаем не сообщением, а кнопкой перехода в чат с ботом
+        button = InlineQueryResultsButton(text="🔐 Авторизуйтесь в боте", start_parameter="login") if login else None
+        await event.answer([], cache_time=0, is_personal=True, button=button)
+        return
+    await event.answer(text, **kwargs)
+
 
 def auth_required(func):
     @wraps(func)
@@ -21,69 +34,186 @@ def auth_required(func):
         tokens = await get_tokens_redis(tg_id)
 
         if not tokens:
-            await message.answer("❌ Требуется авторизация! /start",
-                                 reply_markup=ReplyKeyboardRemove())
+            await _deny(message, "❌ Требуется авторизация! /start",
+                        reply_markup=ReplyKeyboardRemove())
             return
 
-        # Проверяем срок действия access_token
+        # Получаем действующий access_token (при необходимости он обновится один раз)
         try:
-            decoded = jwt.decode(tokens["access"], options={"verify_signature": False})
-            if decoded.get("exp", 0) < time():
-                # Обновляем токен, если истек
-                new_tokens = await refresh_access_token(tokens["refresh"])
-                if new_tokens:
-                    await save_tokens_redis(tg_id, {
-                        'access': new_tokens["access"],
-                        'refresh': tokens["refresh"]
-                    })
-                    return await func(message, new_tokens["access"], *args, **kwargs)
-                else:
-                    await message.answer("❌ Сессия истекла. Авторизуйтесь снова /start")
-                    return
+            access_token = await token_manager.get_access_token(tg_id, tokens)
         except jwt.DecodeError:
-            await message.answer("❌ Ошибка токена. Авторизуйтесь снова /start")
+            await _deny(message, "❌ Ошибка токена. Авторизуйтесь снова /start")
+            return
+        except BackendUnavailable as e:
+            logger.warning(f"Backend unavailable for {tg_id}: {e}")
+            await _deny(message, BACKEND_UNAVAILABLE_TEXT, login=False)
+            return
+
+        if not access_token:
+            await _deny(message, "❌ Сессия истекла. Авторизуйтесь снова /start")
             return
 
-        # Выполняем запрос с текущим токеном
-        return await func(message, tokens["access"], *args, **kwargs)
+        # Выполняем запрос с действующим токеном; сбои бэкенда обрабатываются здесь, а не в каждом хендлере
+        try:
+            return await func(message, access_token, *args, **kwargs)
+        except BackendUnavailable as e:
+            logger.warning(f"Backend unavailable for {tg_id}: {e}")
+            await _deny(message, BACKEND_UNAVAILABLE_TEXT, login=False)
+        except Unauthorized as e:
+            if e.access_token != access_token:
+                # Общая загрузка (список групп, снимок мероприятий) ушла с чужим истёкшим токеном;
+                # токены этого пользователя действуют, повтор загрузит данные уже с ними
+                logger.warning(f"Shared load rejected another user's token for {tg_id}: {e}")
+                await _deny(message, RETRY_TEXT, login=False)
+                return
+            # Бэкенд больше не принимает токены пользователя — без повторного входа не обойтись
+            await delete_tokens_redis(tg_id)
+            await _deny(message, "❌ Сессия истекла. Авторизуйтесь снова /start")
 
     return wrapper
 
 
+PROFILE_TEMPLATE = (
+    "👤 <b>Ваш профиль</b>\n",
+    "🔹 <b>Логин:</b> <code>{username}</code>",
+    "📧 <b>Email:</b> {email}",
+    "✖️ <b>Имя:</b> {first_name}",
+    "✖️ <b>Фамилия:</b> {last_name}",
+    "🎓 <b>Роль:</b> {role}"
+)
+
+EVENT_TEMPLATE = (
+    "🎯 <b>{title}</b>\n\n"
+    "⏳ <i>Дата проведения:</i> <b>{date}</b>\n"
+    "🏛 <i>Группа:</i> {group}\n"
+    "👤 <i>Организатор:</i> {author}\n"
+    "📝 <i>Описание:</i> {description}\n"
+    "👥 <i>Участников:</i> {attendees}\n"
+    "🔖 <i>Тип:</i> {type}"
+)
+
+RENDER_CACHE_SIZE = 2_000
+
+_profile_cache: OrderedDict[tuple, list] = OrderedDict()
+_event_cache: OrderedDict[tuple, dict] = OrderedDict()
+
+
+def _cache_put(cache: OrderedDict, key, value) -> None:
+    cache[key] = value
+    if len(cache) > RENDER_CACHE_SIZE:
+        cache.popitem(last=False)
+
+
 def format_profile(profile):
-    return [
-        f"👤 <b>Ваш профиль</b>\n",
-        f"🔹 <b>Логин:</b> <code>{profile['username']}</code>",
-        f"📧 <b>Email:</b> {profile['email']}",
-        f"✖️ <b>Имя:</b> {profile['first_name'] or 'не указано'}",
-        f"✖️ <b>Фамилия:</b> {profile['last_name'] or 'не указано'}",
-        f"🎓 <b>Роль:</b> {'преподаватель' if profile['role'] == 'teacher' else 'студент'}"
-    ]
+    key = (profile['username'], profile['email'], profile['first_name'],
+           profile['last_name'], profile['role'])
+    lines = _profile_cache.get(key)
+    if lines is None:
+        values = {
+            'username': profile['username'],
+            'email': profile['email'],
+            'first_name': profile['first_name'] or 'не указано',
+            'last_name': profile['last_name'] or 'не указано',
+            'role': 'преподаватель' if profile['role'] == 'teacher' else 'студент'
+        }
+        lines = [line.format_map(values) for line in PROFILE_TEMPLATE]
+        _cache_put(_profile_cache, key, lines)
+    else:
+        _profile_cache.move_to_end(key)
+    return list(lines)
+
+
+def parse_event_date(value: str) -> datetime:
+    """Разбор даты: быстрый путь для ISO-8601, dateutil — только для прочих форматов."""
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        from dateutil.parser import parse
+        return parse(value)
+
+
+def _event_marker(event) -> tuple:
+    # Если бэкенд отдаёт время изменения — достаточно его, иначе сравниваем выводимые поля
+    if event.get('updated_at'):
+        return (event['updated_at'],)
+    return (event.get('title'), event.get('event_date'), str(event.get('group')), str(event.get('author')),
+            event.get('description'), str(event.get('attendees')), event.get('type'),
+            str(event.get('first_photo')))
 
 
 def format_event(event):
+    key = (event['id'], _event_marker(event)) if event.get('id') is not None else None
+    if key is not None:
+        rendered = _event_cache.get(key)
+        if rendered is not None:
+            _event_cache.move_to_end(key)
+            return dict(rendered)
+
     try:
-        # Универсальный парсинг даты с timezone
-        event_date = parse(event['event_date'])
         # Форматируем в читаемый вид с учетом часового пояса
-        formatted_date = event_date.strftime("%d.%m.%Y в %H:%M")
-    except (ValueError, KeyError) as e:
+        formatted_date = parse_event_date(event['event_date']).strftime("%d.%m.%Y в %H:%M")
+    except (ValueError, KeyError, TypeError, OverflowError):
         formatted_date = "дата не указана"
 
-    caption = (
-        f"🎯 <b>{event.get('title', 'Без названия')}</b>\n\n"
-        f"⏳ <i>Дата проведения:</i> <b>{formatted_date}</b>\n"
-        f"🏛 <i>Группа:</i> {event.get('group', {}).get('name', 'не указана')}\n"
-        f"👤 <i>Организатор:</i> {event['author']['username']}\n"
-        f"📝 <i>Описание:</i> {event.get('description', 'нет описания')}\n"
-        f"👥 <i>Участников:</i> {event.get('attendees', 'пока нет')}\n"
-        f"🔖 <i>Тип:</i> {event.get('type', 'не указан').capitalize()}"
+    caption = EVENT_TEMPLATE.format(
+        title=event.get('title', 'Без названия'),
+        date=formatted_date,
+        group=event.get('group', {}).get('name', 'не указана'),
+        author=event['author']['username'],
+        description=event.get('description', 'нет описания'),
+        attendees=event.get('attendees', 'пока нет'),
+        type=event.get('type', 'не указан').capitalize()
     )
 
     photo_url = event.get('first_photo', {}).get('photo') if event.get('first_photo') else None
 
-    return {
+    rendered = {
         'caption': caption,
         'photo_url': photo_url
     }
+    if key is not None:
+        _cache_put(_event_cache, key, rendered)
+    return dict(rendered)
 
+
+def format_event_line(event):
+    """Краткая строка мероприятия для списков и результатов поиска."""
+    try:
+        date = parse_event_date(event['event_date']).strftime("%d.%m.%Y %H:%M")
+    except (ValueError, KeyError, TypeError, OverflowError):
+        date = "без даты"
+    group = (event.get('group') or {}).get('name', 'без группы')
+    return f"📅 {date} — <b>{event.get('title', 'Без названия')}</b> · {event.get('type', 'тип не указан')} · {group}"
+
+
+def format_event_notice(event, group_name):
+    """Уведомление участникам группы о новом мероприятии."""
+    try:
+        date = parse_event_date(event['event_date']).strftime("%d.%m.%Y в %H:%M")
+    except (ValueError, KeyError, TypeError, OverflowError):
+        date = "дата не указана"
+    return (f"🔔 <b>Новое мероприятие для группы {html.escape(str(group_name))}</b>\n\n"
+            f"📌 {html.escape(str(event.get('title', 'Без названия')))}\n"
+            f"📅 {date}\n"
+            f"📍 {html.escape(str(event.get('location', 'место не указано')))}\n"
+            f"🏷 {event.get('type', 'тип не указан')}")
+
+
+def _lead_time(seconds):
+    if seconds % 86400 == 0:
+        return f"{seconds // 86400} дн."
+    if seconds % 3600 == 0:
+        return f"{seconds // 3600} ч"
+    return f"{seconds // 60} мин"
+
+
+def format_event_reminder(event, lead):
+    """Напоминание о мероприятии за ``lead`` секунд до начала."""
+    try:
+        date = parse_event_date(event['event_date']).strftime("%d.%m.%Y в %H:%M")
+    except (ValueError, KeyError, TypeError, OverflowError):
+        date = "дата не указана"
+    return (f"⏰ <b>Через {_lead_time(lead)}: {html.escape(str(event.get('title', 'Без названия')))}</b>\n\n"
+            f"📅 {date}\n"
+            f"📍 {html.escape(str(event.get('location') or 'место не указано'))}\n"
+            f"🏷 {event.get('type', 'тип не указан')}")
@@ -0,0 +1,213 @@
+import asyncio
+import cProfile
+import io
+import os
+import logging
+import pstats
+import sys
+import threading
+import traceback
+import tracemalloc
+from contextlib import contextmanager
+from time import monotonic
+
+from metrics import LOOP_LAG, LOOP_BLOCKS
+
+logger = logging.getLogger(__name__)
+
+# Задержка event loop, после которой блокировка считается зависанием и сообщается со стеком
+LOOP_LAG_THRESHOLD = float(os.getenv("LOOP_LAG_THRESHOLD", 0.1))
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", 0.05))
+STACK_LIMIT = 20
+PROFILE_TOP = 30
+TRACEMALLOC_FRAMES = 10
+
+# Задача -> обработчик, который в ней сейчас выполняется
+_running: dict[asyncio.Task, str] = {}
+
+
+class LoopWatchdog:
+    """Замер задержки event loop и стек кода, который его держит.
+
+    Корутина на loop каждые LOOP_LAG_INTERVAL отмечается и пишет задержку
+    в гистограмму. Отдельный поток проверяет отметку: если loop молчит
+    дольше порога, он снимает стек потока loop через sys._current_frames
+    (пока блокирующий код ещё выполняется) и запоминает обработчик текущей
+    задачи. Когда loop оживает, зависание логируется с длительностью.
+    """
+
+    def __init__(self, threshold: float = LOOP_LAG_THRESHOLD, interval: float = LOOP_LAG_INTERVAL):
+        self.threshold = threshold
+        self.interval = interval
+        self._beat = monotonic()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread: int | None = None
+        self._captured: tuple[float, str, str] | None = None
+        self._task: asyncio.Task | None = None
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+
+    async def start(self) -> None:
+        """Запускает замер (хук на startup); порог 0 — выключен."""
+        if self.threshold <= 0 or self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._beat = monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+        self._stop.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await asyncio.to_thread(self._thread.join)
+        self._thread = None
+
+    async def _heartbeat(self) -> None:
+        while True:
+            start = monotonic()
+            await asyncio.sleep(self.interval)
+            now = monotonic()
+            self._beat = now
+            lag = now - start - self.interval
+            LOOP_LAG.observe(lag)
+            if lag >= self.threshold:
+                self._report(lag)
+
+    def _report(self, lag: float) -> None:
+        captured, self._captured = self._captured, None
+        handler, stack = captured[1:] if captured is not None else ("unknown", "стек не снят")
+        LOOP_BLOCKS.inc(handler=handler)
+        logger.warning(f"Event loop blocked for {lag:.3f}s in handler '{handler}':\n{stack}",
+                       extra={"handler": handler, "lag": round(lag, 3)})
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.threshold / 2):
+            beat = self._beat
+            if monotonic() - beat - self.interval < self.threshold:
+                continue
+            if self._captured is not None and self._captured[0] == beat:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            stack = "".join(traceback.format_stack(frame, limit=STACK_LIMIT))
+            task = asyncio.current_task(self._loop)
+            self._captured = (beat, _running.get(task, "unknown"), stack)
+
+
+class HandlerProfiler:
+    """Профилирование по запросу администратора: cProfile или tracemalloc на заданное время.
+
+    cProfile включён, пока выполняется хотя бы один выбранный обработчик;
+    конкурентные задачи в это время тоже попадают в профиль. tracemalloc
+    снимает разницу снимков за окно и чистый прирост памяти по обработчикам.
+    """
+
+    def __init__(self):
+        self.mode: str | None = None
+        self.target: str | None = None
+        self.started_at = 0.0
+        self._profile: cProfile.Profile | None = None
+        self._active = 0
+        self._snapshot: tracemalloc.Snapshot | None = None
+        self._allocated: dict[str, int] = {}
+        self._calls: dict[str, int] = {}
+
+    def matches(self, handler: str) -> bool:
+        return self.mode is not None and (self.target is None or self.target in handler)
+
+    def start(self, mode: str, target: str | None = None) -> None:
+        if self.mode is not None:
+            raise RuntimeError(f"уже идёт профилирование {self.mode}")
+        if mode == "mem":
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self._snapshot = tracemalloc.take_snapshot()
+        else:
+            self._profile = cProfile.Profile()
+        self.mode, self.target = mode, target
+        self.started_at = monotonic()
+        self._allocated.clear()
+        self._calls.clear()
+
+    def stop(self) -> str:
+        """Останавливает профилирование и возвращает текстовый отчёт."""
+        mode, target, duration = self.mode, self.target, monotonic() - self.started_at
+        self.mode = None
+        header = [f"Профиль {mode}, обработчики: {target or 'все'}, окно {duration:.1f}s", "",
+                  "Вызовы за окно:"]
+        header += [f"  {calls:>6}  {handler}" for handler, calls in
+                   sorted(self._calls.items(), key=lambda item: -item[1])]
+        out = io.StringIO()
+        if mode == "mem":
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            out.write("Прирост памяти по обработчикам (байт, приблизительно):\n")
+            for handler, size in sorted(self._allocated.items(), key=lambda item: -item[1]):
+                out.write(f"  {size:>12}  {handler}\n")
+            out.write(f"\nТоп-{PROFILE_TOP} строк по приросту памяти:\n")
+            for stat in snapshot.compare_to(self._snapshot, "lineno")[:PROFILE_TOP]:
+                out.write(f"  {stat}\n")
+            self._snapshot = None
+        elif self._profile is not None:
+            if self._active:
+                self._profile.disable()
+            stats = pstats.Stats(self._profile, stream=out)
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_TOP)
+            self._profile = None
+        self._active = 0
+        return "\n".join(header) + "\n\n" + out.getvalue()
+
+    @contextmanager
+    def measure(self, handler: str):
+        if not self.matches(handler):
+            yield
+            return
+        mode = self.mode
+        self._calls[handler] = self._calls.get(handler, 0) + 1
+        if mode == "mem":
+            before = tracemalloc.get_traced_memory()[0]
+            try:
+                yield
+            finally:
+                if self.mode == "mem":
+                    self._allocated[handler] = (self._allocated.get(handler, 0)
+                                                + tracemalloc.get_traced_memory()[0] - before)
+            return
+
+        profile = self._profile
+        self._active += 1
+        if self._active == 1:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if self._profile is profile:
+                self._active -= 1
+                if not self._active:
+                    profile.disable()
+
+
+@contextmanager
+def track(handler: str):
+    """Оборачивает обработчик: имя для отчётов о зависаниях и профилирование по запросу."""
+    task = asyncio.current_task()
+    _running[task] = handler
+    try:
+        with handler_profiler.measure(handler):
+            yield
+    finally:
+        _running.pop(task, None)
+
+
+loop_watchdog = LoopWatchdog()
+handler_profiler = HandlerProfiler()
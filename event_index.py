@@ -0,0 +1,158 @@
+import re
+from bisect import bisect_left
+from datetime import datetime, timedelta
+
+from config import parse_event_date
+
+# Типы мероприятий (значения type_keyboard) и их английские синонимы из callback_data
+EVENT_TYPES = {
+    "конференция": "конференция", "conference": "конференция",
+    "конкурс": "конкурс", "contest": "конкурс",
+    "экскурсия": "экскурсия", "excursion": "экскурсия",
+    "семинар": "семинар", "seminar": "семинар",
+}
+
+_WORD = re.compile(r"\w+")
+_DATE = re.compile(r"(\d{4})(?:-(\d{2}))?(?:-(\d{2}))?")
+
+
+def _words(text: str) -> list[str]:
+    return _WORD.findall(text.lower())
+
+
+def _group_keys(group) -> list[str]:
+    if isinstance(group, dict):
+        keys = [str(group.get('id'))]
+        if group.get('name'):
+            keys.append(str(group['name']).lower().replace(" ", ""))
+        return keys
+    return [str(group)] if group is not None else []
+
+
+def _date_range(token: str) -> tuple[datetime, datetime] | None:
+    """2025 / 2025-06 / 2025-06-19 -> [начало, конец) периода."""
+    match = _DATE.fullmatch(token)
+    if match is None:
+        return None
+    year, month, day = match.groups()
+    try:
+        if day:
+            start = datetime(int(year), int(month), int(day))
+            return start, start + timedelta(days=1)
+        if month:
+            start = datetime(int(year), int(month), 1)
+            return start, datetime(int(year) + int(month) // 12, int(month) % 12 + 1, 1)
+        return datetime(int(year), 1, 1), datetime(int(year) + 1, 1, 1)
+    except ValueError:
+        return None
+
+
+class EventQuery:
+    """Разобранный поисковый запрос: тип, группа, период и слова из названия."""
+
+    __slots__ = ("type", "group", "start", "end", "words")
+
+    def __init__(self, type: str | None = None, group: str | None = None,
+                 start: datetime | None = None, end: datetime | None = None,
+                 words: tuple[str, ...] = ()):
+        self.type = type
+        self.group = group
+        self.start = start
+        self.end = end
+        self.words = words
+
+    def __bool__(self) -> bool:
+        return any((self.type, self.group, self.start, self.end, self.words))
+
+
+def parse_query(text: str) -> EventQuery:
+    """Разбирает запрос вида ``семинар #ИСп-21 2025-06 python`` или ``2025-06-01..2025-06-15``.
+
+    Тип — одно из значений type_keyboard, группа — ``#id`` или ``#название``,
+    период — год, месяц, день или диапазон ``from..to``; остальное ищется в названии.
+    """
+    query = EventQuery()
+    words = []
+    for token in text.lower().split():
+        if token in EVENT_TYPES:
+            query.type = EVENT_TYPES[token]
+        elif token.startswith("#") and len(token) > 1:
+            query.group = token[1:]
+        elif ".." in token:
+            first, _, last = token.partition("..")
+            start, end = _date_range(first), _date_range(last)
+            if start or end:
+                query.start = start[0] if start else None
+                query.end = end[1] if end else None
+            else:
+                words.extend(_words(token))
+        elif (period := _date_range(token)) is not None:
+            query.start, query.end = period
+        else:
+            words.extend(_words(token))
+    query.words = tuple(words)
+    return query
+
+
+class EventIndex:
+    """Индекс снимка мероприятий для поиска без обращений к бэкенду.
+
+    Мероприятия с датой отсортированы по ней (период ищется bisect'ом),
+    без даты — лежат в конце; тип, группа и слова названия — инвертированные
+    индексы "ключ -> позиции".
+    """
+
+    def __init__(self, events: list):
+        dated, undated = [], []
+        for event in events:
+            try:
+                # Сравниваем по времени, как оно показывается пользователю (в поясе мероприятия)
+                dated.append((parse_event_date(event['event_date']).replace(tzinfo=None), event))
+            except (ValueError, KeyError, TypeError, OverflowError):
+                undated.append(event)
+        dated.sort(key=lambda pair: pair[0])
+
+        self.events: list[dict] = [event for _, event in dated] + undated
+        self._dates: list[datetime] = [date for date, _ in dated]
+        self._by_type: dict[str, set[int]] = {}
+        self._by_group: dict[str, set[int]] = {}
+        self._by_word: dict[str, set[int]] = {}
+        for position, event in enumerate(self.events):
+            if event.get('type'):
+                self._by_type.setdefault(str(event['type']).lower(), set()).add(position)
+            for key in _group_keys(event.get('group')):
+                self._by_group.setdefault(key, set()).add(position)
+            for word in _words(str(event.get('title') or "")):
+                self._by_word.setdefault(word, set()).add(position)
+
+    def _title_positions(self, fragment: str) -> set[int]:
+        # Словарь названий невелик: подстроку ищем по нему, а не по всем мероприятиям
+        positions = set()
+        for word, word_positions in self._by_word.items():
+            if fragment in word:
+                positions |= word_positions
+        return positions
+
+    def search(self, query: EventQuery, offset: int = 0, limit: int | None = None) -> tuple[list[dict], int]:
+        """Мероприятия, подходящие под запрос, по дате: (страница, всего найдено)."""
+        low, high = 0, len(self.events)
+        if query.start or query.end:
+            low = bisect_left(self._dates, query.start) if query.start else 0
+            high = bisect_left(self._dates, query.end) if query.end else len(self._dates)
+
+        sets = []
+        if query.type:
+            sets.append(self._by_type.get(query.type, set()))
+        if query.group:
+            sets.append(self._by_group.get(query.group, set()))
+        sets.extend(self._title_positions(word) for word in query.words)
+
+        if sets:
+            sets.sort(key=len)
+            matched = sets[0].intersection(*sets[1:])
+            positions = sorted(position for position in matched if low <= position < high)
+        else:
+            positions = range(low, max(low, high))
+
+        end = len(positions) if limit is None else offset + limit
+        return [self.events[position] for position in positions[offset:end]], len(positions)
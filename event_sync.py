@@ -0,0 +1,294 @@
+import asyncio
+import os
+import logging
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from time import monotonic
+from typing import Mapping
+
+from api import fetch_events, event_exists, EVENTS_SINCE_PARAM, BackendUnavailable, Unauthorized
+from event_index import EventIndex
+from metrics import EVENT_SYNCS
+from notifications import profile_group
+from read_cache import cached_profile
+from reminders import reminder_scheduler
+
+logger = logging.getLogger(__name__)
+
+# Как часто фоновая задача сверяет снимки с бэкендом
+EVENT_SYNC_INTERVAL = float(os.getenv("EVENT_SYNC_INTERVAL", 30))
+# Каждая N-я синхронизация — полная (дельта не сообщает об удалённых мероприятиях)
+EVENT_FULL_SYNC_EVERY = int(os.getenv("EVENT_FULL_SYNC_EVERY", 10))
+# Снимок, который никто не смотрел столько секунд, перестаёт обновляться и удаляется
+EVENT_SCOPE_IDLE = float(os.getenv("EVENT_SCOPE_IDLE", 30 * 60))
+# Личный снимок в фоне не обновляется (только при просмотре) и удаляется раньше
+EVENT_USER_SCOPE_IDLE = float(os.getenv("EVENT_USER_SCOPE_IDLE", 5 * 60))
+# "user" — отдельный снимок на пользователя; "profile" — общий снимок на роль и группу,
+# включать, только если бэкенд не фильтрует /event/ по пользователю
+EVENT_SYNC_SCOPE = os.getenv("EVENT_SYNC_SCOPE", "user")
+# Дельта запрашивается с запаса до начала прошлого запроса: изменения, пока бэкенд собирал ответ, не теряются
+EVENT_SYNC_OVERLAP = float(os.getenv("EVENT_SYNC_OVERLAP", 5))
+
+
+class EventSnapshot:
+    """Список мероприятий одной области видимости и валидаторы для условных запросов."""
+
+    __slots__ = ("events", "version", "etag", "last_modified", "cursor",
+                 "syncs", "synced_at", "used_at", "access_token", "group", "_index")
+
+    def __init__(self):
+        self.events: list | None = None
+        self.version = 0  # растёт при каждом изменении списка; 0 — ещё не загружен
+        self.etag: str | None = None
+        self.last_modified: str | None = None
+        self.cursor: str | None = None  # серверное время начала прошлой синхронизации для дельты
+        self.syncs = 0
+        self.synced_at = 0.0
+        self.used_at = monotonic()
+        self.access_token: str | None = None
+        self.group: str | None = None  # группа владельца токена
+        self._index: tuple[int, EventIndex] | None = None
+
+    def index(self) -> EventIndex:
+        """Поисковый индекс текущей версии снимка (строится при первом поиске после изменения)."""
+        if self._index is None or self._index[0] != self.version:
+            self._index = (self.version, EventIndex(self.events or []))
+        return self._index[1]
+
+
+def _request_start(headers: Mapping[str, str], elapsed: float) -> str:
+    """Серверное время начала запроса с запасом EVENT_SYNC_OVERLAP (Date — время ответа)."""
+    try:
+        answered = parsedate_to_datetime(headers["Date"])
+    except (KeyError, TypeError, ValueError):
+        answered = datetime.now(timezone.utc)
+    # Date с точностью до секунды — её тоже покрывает запас
+    return (answered - timedelta(seconds=elapsed + EVENT_SYNC_OVERLAP)).isoformat()
+
+
+def _merge(events: list, changed: list) -> list:
+    """Новый список с изменёнными мероприятиями на их местах и новыми в конце."""
+    positions = {event.get('id'): index for index, event in enumerate(events)}
+    merged = list(events)
+    for event in changed:
+        index = positions.get(event.get('id'))
+        if index is None:
+            merged.append(event)
+        else:
+            merged[index] = event
+    return merged
+
+
+USER_SCOPE_PREFIX = "user:"
+
+
+def _shared(scope: str) -> bool:
+    return not scope.startswith(USER_SCOPE_PREFIX)
+
+
+class EventSync:
+    """Снимки списка мероприятий в памяти процесса.
+
+    Просмотр читает снимок своей области видимости; бэкенд получает один
+    условный (If-None-Match / If-Modified-Since) или дельта-запрос на
+    снимок за интервал, а не запрос на каждое нажатие. Общие снимки
+    (роль и группа) обновляются в фоне, личные — только при просмотре,
+    если устарели: фоновый опрос каждого недавно активного пользователя
+    нагружал бы бэкенд сильнее, чем запрос на каждое нажатие.
+    """
+
+    def __init__(self, interval: float = EVENT_SYNC_INTERVAL, full_every: int = EVENT_FULL_SYNC_EVERY,
+                 idle: float = EVENT_SCOPE_IDLE, user_idle: float = EVENT_USER_SCOPE_IDLE):
+        self.interval = interval
+        self.full_every = max(full_every, 1)
+        self.idle = idle
+        self.user_idle = user_idle
+        self._snapshots: dict[str, EventSnapshot] = {}
+        self._inflight: dict[str, asyncio.Task] = {}
+        self._task: asyncio.Task | None = None
+
+    def snapshot(self, scope: str) -> EventSnapshot | None:
+        return self._snapshots.get(scope)
+
+    async def events(self, scope: str, access_token: str) -> list | None:
+        """Список мероприятий области; загружается сразу только при первом обращении."""
+        return (await self.acquire(scope, access_token)).events
+
+    async def acquire(self, scope: str, access_token: str, group: str | None = None) -> EventSnapshot:
+        """Снимок области с отметкой об использовании, токеном и группой его владельца для фоновой синхронизации."""
+        snapshot = self._snapshots.get(scope)
+        if snapshot is None:
+            snapshot = self._snapshots[scope] = EventSnapshot()
+        snapshot.access_token = access_token
+        snapshot.group = group
+        snapshot.used_at = monotonic()
+
+        if snapshot.version == 0:
+            await self.sync(scope)
+        elif not _shared(scope):
+            if monotonic() - snapshot.synced_at > self.interval:
+                # Личный снимок обновляется только здесь: условный запрос, при 304 — без тела
+                try:
+                    await self.sync(scope)
+                except BackendUnavailable as e:
+                    logger.warning(f"Event sync ({scope}) skipped, serving cached list: {e}")
+        elif monotonic() - snapshot.synced_at > 2 * self.interval and scope not in self._inflight:
+            # Фоновая синхронизация отстала (например, истёк токен) — обновляем с токеном текущего пользователя
+            self._start_sync(scope)
+        return snapshot
+
+    async def sync(self, scope: str) -> None:
+        """Синхронизирует снимок; параллельные вызовы для одной области ждут один запрос."""
+        task = self._inflight.get(scope) or self._start_sync(scope)
+        await asyncio.shield(task)
+
+    def _start_sync(self, scope: str) -> asyncio.Task:
+        task = asyncio.create_task(self._sync(scope))
+        self._inflight[scope] = task
+        task.add_done_callback(lambda t: self._on_sync_done(scope, t))
+        return task
+
+    def _on_sync_done(self, scope: str, task: asyncio.Task) -> None:
+        if self._inflight.get(scope) is task:
+            del self._inflight[scope]
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Event sync Error ({scope}): {task.exception()}")
+
+    async def _sync(self, scope: str) -> None:
+        snapshot = self._snapshots.get(scope)
+        if snapshot is None or not snapshot.access_token:
+            return
+
+        full = (not EVENTS_SINCE_PARAM or snapshot.events is None
+                or snapshot.cursor is None or snapshot.syncs % self.full_every == 0)
+        mode = "full" if full else "delta"
+        started = monotonic()
+        try:
+            if full:
+                status, events, headers = await fetch_events(snapshot.access_token, etag=snapshot.etag,
+                                                             last_modified=snapshot.last_modified)
+            else:
+                status, events, headers = await fetch_events(snapshot.access_token, since=snapshot.cursor)
+        except BackendUnavailable:
+            EVENT_SYNCS.inc(mode=mode, result="error")
+            raise
+
+        if status == 304:
+            EVENT_SYNCS.inc(mode=mode, result="not_modified")
+        elif status == 200 and isinstance(events, list):
+            if full:
+                changed = events != snapshot.events
+                snapshot.etag = headers.get("ETag")
+                snapshot.last_modified = headers.get("Last-Modified")
+                if changed:
+                    await reminder_scheduler.schedule(events)
+                    if snapshot.events:
+                        current = {event.get('id') for event in events}
+                        await self._cancel_deleted(snapshot, [event for event in snapshot.events
+                                                              if event.get('id') not in current])
+            else:
+                # Из-за запаса дельта повторяет уже известные изменения — версия растёт только при новых
+                merged = _merge(snapshot.events, events)
+                changed = merged != snapshot.events
+                if changed:
+                    await reminder_scheduler.schedule(events)
+                    events = merged
+            if changed:
+                snapshot.events = events
+                snapshot.version += 1
+            EVENT_SYNCS.inc(mode=mode, result="modified" if changed else "unchanged")
+        else:
+            EVENT_SYNCS.inc(mode=mode, result="error")
+            if status == 401:
+                # Токен истёк — ждём, пока область снова кто-нибудь откроет
+                access_token, snapshot.access_token = snapshot.access_token, None
+                raise Unauthorized(f"event sync {scope}", access_token)
+            return
+
+        snapshot.cursor = _request_start(headers, monotonic() - started)
+        snapshot.syncs += 1
+        snapshot.synced_at = monotonic()
+
+    async def _cancel_deleted(self, snapshot: EventSnapshot, missing: list) -> None:
+        """Снимает напоминания пропавших из выгрузки мероприятий, если они действительно удалены.
+
+        Пропажа из одной области — ещё не удаление: у владельца токена могла
+        смениться группа или роль, мероприятие могло переехать в другую группу.
+        Поэтому проверяются только мероприятия группы владельца, и каждое
+        сверяется с бэкендом: напоминание снимается лишь на 404.
+        """
+        candidates = [event.get('id') for event in missing
+                      if snapshot.group is not None and profile_group(event) == snapshot.group]
+        if not candidates:
+            return
+        results = await asyncio.gather(*(event_exists(snapshot.access_token, event_id) for event_id in candidates),
+                                       return_exceptions=True)
+        await reminder_scheduler.cancel([event_id for event_id, exists in zip(candidates, results)
+                                         if exists is False])
+
+    async def refresh(self, scope: str, access_token: str, group: str | None = None) -> None:
+        """Внеочередная синхронизация области (например, после создания мероприятия)."""
+        snapshot = self._snapshots.get(scope)
+        if snapshot is None or snapshot.version == 0:
+            await self.acquire(scope, access_token, group)
+            return
+        snapshot.access_token = access_token
+        snapshot.group = group
+        await self.sync(scope)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            now = monotonic()
+            for scope, snapshot in list(self._snapshots.items()):
+                shared = _shared(scope)
+                if now - snapshot.used_at > (self.idle if shared else self.user_idle):
+                    del self._snapshots[scope]
+                elif shared and snapshot.access_token and scope not in self._inflight:
+                    self._start_sync(scope)
+
+    async def start(self) -> None:
+        """Запускает фоновое обновление снимков (хук на startup диспетчера)."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._inflight:
+            await asyncio.gather(*self._inflight.values(), return_exceptions=True)
+
+
+event_sync = EventSync()
+
+
+def visibility_scope(tg_id: int, profile: dict | None) -> str:
+    """Ключ снимка: свой у каждого пользователя, при EVENT_SYNC_SCOPE=profile — общий на роль и группу."""
+    if EVENT_SYNC_SCOPE == "user" or not profile:
+        return f"{USER_SCOPE_PREFIX}{tg_id}"
+    group = profile.get('group')
+    if isinstance(group, dict):
+        group = group.get('id')
+    return f"{profile.get('role')}:{group}"
+
+
+async def user_snapshot(tg_id: int, access_token: str) -> EventSnapshot:
+    """Снимок мероприятий, видимых пользователю."""
+    profile = await cached_profile(tg_id, access_token)
+    return await event_sync.acquire(visibility_scope(tg_id, profile), access_token, profile_group(profile))
+
+
+async def user_events(tg_id: int, access_token: str) -> list | None:
+    """Список мероприятий, видимых пользователю, из его снимка."""
+    return (await user_snapshot(tg_id, access_token)).events
+
+
+async def refresh_user_events(tg_id: int, access_token: str) -> None:
+    """Обновляет снимок пользователя, не дожидаясь фоновой синхронизации."""
+    profile = await cached_profile(tg_id, access_token)
+    await event_sync.refresh(visibility_scope(tg_id, profile), access_token, profile_group(profile))
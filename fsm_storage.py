@@ -0,0 +1,155 @@
+import json
+import logging
+import os
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Mapping
+
+import redis.asyncio as redis
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.types import Update
+
+from settings import REDIS_HOST, REDIS_PORT, REDIS_DB
+from metrics import FSM_TRANSITIONS, REDIS_LATENCY
+
+logger = logging.getLogger(__name__)
+
+# Незавершённые сценарии (AuthState, EventState) удаляются через FSM_TTL без активности
+FSM_TTL = int(os.getenv("FSM_TTL", 24 * 60 * 60))
+
+# Записи FSM, прочитанные и изменённые за время обработки текущего апдейта
+_batch: ContextVar[dict[str, list] | None] = ContextVar("fsm_batch", default=None)
+
+# Первый байт записи — версия формата; запись другой версии считается пустой
+FSM_FORMAT = 1
+
+
+def _encode(state: str | None, data: Mapping[str, Any]) -> bytes:
+    payload = json.dumps([state, dict(data)], ensure_ascii=False, separators=(",", ":"))
+    return bytes((FSM_FORMAT,)) + payload.encode()
+
+
+def _decode(raw: bytes | None) -> tuple[str | None, dict]:
+    if not raw:
+        return None, {}
+    if raw[0] != FSM_FORMAT:
+        raise ValueError(f"unknown FSM record format {raw[0]}")
+    state, data = json.loads(raw[1:])
+    return state, data
+
+
+class CompactRedisStorage(BaseStorage):
+    """FSM-хранилище в Redis: state и data одного пользователя лежат в одной записи (JSON с байтом версии).
+
+    Внутри ``fsm_batch_middleware`` запись читается один раз на апдейт,
+    а все set_state/update_data копятся и уходят одной записью в конце.
+    """
+
+    def __init__(self, client: redis.Redis, state_ttl: int = FSM_TTL,
+                 key_builder: KeyBuilder | None = None):
+        self.redis = client
+        self.state_ttl = state_ttl
+        self.key_builder = key_builder or DefaultKeyBuilder(prefix="fsm")
+
+    async def _load(self, key: StorageKey) -> list:
+        redis_key = self.key_builder.build(key)
+        batch = _batch.get()
+        if batch is not None and redis_key in batch:
+            return batch[redis_key]
+
+        with REDIS_LATENCY.time(op="fsm_get"):
+            raw = await self.redis.get(redis_key)
+        try:
+            state, data = _decode(raw)
+        except (TypeError, ValueError) as e:
+            # Запись старого формата или повреждённая: сценарий начнётся заново
+            logger.warning(f"Dropping unreadable FSM record {redis_key}: {e}")
+            state, data = None, {}
+        record = [state, data, False]
+        if batch is not None:
+            batch[redis_key] = record
+        return record
+
+    async def _store(self, key: StorageKey, record: list) -> None:
+        if _batch.get() is not None:
+            record[2] = True
+            return
+        await self._write(self.redis, self.key_builder.build(key), record)
+
+    async def _write(self, client, redis_key: str, record: list) -> None:
+        state, data, _ = record
+        if state is None and not data:
+            await client.delete(redis_key)
+            return
+        try:
+            raw = _encode(state, data)
+        except (TypeError, ValueError) as e:
+            # В Redis остаётся предыдущая запись сценария
+            logger.error(f"FSM record {redis_key} not saved. Error: {e}")
+            return
+        await client.set(redis_key, raw, ex=self.state_ttl)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._load(key)
+        state = state.state if isinstance(state, State) else state
+        if state != record[0]:
+            FSM_TRANSITIONS.inc(from_state=record[0], to_state=state)
+        record[0] = state
+        await self._store(key, record)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        return (await self._load(key))[0]
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        record = await self._load(key)
+        record[1] = dict(data)
+        await self._store(key, record)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        return dict((await self._load(key))[1])
+
+    async def flush(self) -> None:
+        """Записывает изменения текущего апдейта одним обращением к Redis."""
+        batch = _batch.get()
+        if not batch:
+            return
+        dirty = [(redis_key, record) for redis_key, record in batch.items() if record[2]]
+        if not dirty:
+            return
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for redis_key, record in dirty:
+                    await self._write(pipe, redis_key, record)
+                    record[2] = False
+                with REDIS_LATENCY.time(op="fsm_flush"):
+                    await pipe.execute()
+        except redis.RedisError as e:
+            # Апдейт уже обработан; в Redis остаются записи до него
+            logger.error(f"FSM flush Error: {e}")
+
+    async def close(self) -> None:
+        await self.redis.aclose()
+
+
+fsm_redis = redis.Redis(
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    db=REDIS_DB,
+)
+fsm_storage = CompactRedisStorage(fsm_redis)
+
+
+async def fsm_batch_middleware(
+        handler: Callable[[Update, Dict[str, Any]], Any],
+        event: Update,
+        data: Dict[str, Any]
+) -> Any:
+    """Открывает пакет FSM на время обработки апдейта (регистрируется до FSM middleware)."""
+    token = _batch.set({})
+    try:
+        return await handler(event, data)
+    finally:
+        try:
+            await fsm_storage.flush()
+        finally:
+            _batch.reset(token)
@@ -0,0 +1,76 @@
+import re
+from bisect import bisect_left
+
+from read_cache import cached_groups_list, groups_cache
+
+_WORD_START = re.compile(r"\b\w")
+
+
+class GroupIndex:
+    """Группы по алфавиту и отсортированные ключи для поиска по началу любого слова названия."""
+
+    def __init__(self, groups: list):
+        self.groups = sorted(groups, key=lambda group: str(group['name']).lower())
+        self._by_id = {str(group['id']): group for group in self.groups}
+        keys = []
+        for position, group in enumerate(self.groups):
+            name = str(group['name']).lower()
+            # "Группа ИСп-21" ищется и по "груп", и по "исп", и по "21"
+            keys.extend((name[match.start():], position) for match in _WORD_START.finditer(name))
+        keys.sort()
+        self._keys = [key for key, _ in keys]
+        self._positions = [position for _, position in keys]
+
+    def get(self, group_id) -> dict | None:
+        return self._by_id.get(str(group_id))
+
+    def search(self, prefix: str = "", offset: int = 0, limit: int | None = None) -> tuple[list[dict], int]:
+        """Группы, название которых содержит слово с началом ``prefix``: (страница, всего)."""
+        prefix = prefix.strip().lower()
+        if not prefix:
+            matched = self.groups
+        else:
+            low = bisect_left(self._keys, prefix)
+            high = bisect_left(self._keys, prefix + "\uffff")
+            matched = [self.groups[position] for position in sorted(set(self._positions[low:high]))]
+            exact = self._by_id.get(prefix)
+            if exact is not None:
+                # Совпадение по ID — первым
+                matched = [exact] + [group for group in matched if group is not exact]
+
+        end = len(matched) if limit is None else offset + limit
+        return matched[offset:end], len(matched)
+
+
+class GroupDirectory:
+    """Общий для всех пользователей индекс групп поверх кэша списка групп.
+
+    Список обновляет groups_cache (stale-while-revalidate), индекс
+    перестраивается только когда список действительно изменился.
+    """
+
+    def __init__(self):
+        self._source: list | None = None
+        self._index: GroupIndex | None = None
+
+    async def get(self, access_token: str) -> GroupIndex | None:
+        groups = await cached_groups_list(access_token)
+        if not groups:
+            return self._index
+        return self._update(groups)
+
+    async def preload(self) -> None:
+        """Строит индекс из списка групп, уже лежащего в Redis (без токена и запроса к бэкенду)."""
+        groups = await groups_cache.preload("all")
+        if groups:
+            self._update(groups)
+
+    def _update(self, groups: list) -> GroupIndex:
+        if groups is not self._source:
+            if self._index is None or groups != self._source:
+                self._index = GroupIndex(groups)
+            self._source = groups
+        return self._index
+
+
+group_directory = GroupDirectory()
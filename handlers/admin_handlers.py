@@ -0,0 +1,86 @@
+import asyncio
+import logging
+
+from aiogram import Bot, F, Router
+from aiogram.filters import Command, CommandObject
+from aiogram.types import Message, BufferedInputFile
+
+from diagnostics import handler_profiler
+from settings import ADMIN_IDS
+
+logger = logging.getLogger(__name__)
+
+admin_router = Router()
+# Для остальных пользователей команды будто не существует
+admin_router.message.filter(F.from_user.id.in_(ADMIN_IDS))
+
+PROFILE_DEFAULT_SECONDS = 30
+PROFILE_MAX_SECONDS = 600
+
+PROFILE_USAGE = (
+    "<b>/profile cpu [обработчик] [секунды]</b> — cProfile выбранных обработчиков\n"
+    "<b>/profile mem [обработчик] [секунды]</b> — tracemalloc: прирост памяти\n"
+    "<b>/profile stop</b> — остановить досрочно и получить отчёт\n\n"
+    "Обработчик — часть имени, например <code>show_events</code>; по умолчанию все. "
+    "Профилируется только процесс, который обработал команду."
+)
+
+_timer: asyncio.Task | None = None
+
+
+async def send_profile_report(bot: Bot, chat_id: int) -> None:
+    report = handler_profiler.stop()
+    await bot.send_document(chat_id, BufferedInputFile(report.encode(), filename="profile.txt"),
+                            caption="📊 Отчёт профилирования")
+
+
+async def _stop_later(bot: Bot, chat_id: int, seconds: float) -> None:
+    await asyncio.sleep(seconds)
+    # Исключение фоновой задачи никто не ждёт — сообщаем о нём в лог и администратору
+    try:
+        await send_profile_report(bot, chat_id)
+    except Exception as e:
+        logger.error(f"Profile report Error: {e}")
+        try:
+            await bot.send_message(chat_id, f"❌ Не удалось отправить отчёт профилирования: {e}")
+        except Exception as e:
+            logger.error(f"Profile report notice Error for {chat_id}: {e}")
+
+
+@admin_router.message(Command("profile"))
+async def profile_command(message: Message, command: CommandObject, bot: Bot):
+    global _timer
+    args = (command.args or "").split()
+    mode = args[0] if args else None
+
+    if mode == "stop":
+        if handler_profiler.mode is None:
+            await message.answer("Профилирование не запущено.")
+            return
+        if _timer is not None:
+            _timer.cancel()
+            _timer = None
+        await send_profile_report(bot, message.chat.id)
+        return
+
+    if mode not in ("cpu", "mem"):
+        status = f"Сейчас идёт: {handler_profiler.mode}\n\n" if handler_profiler.mode else ""
+        await message.answer(status + PROFILE_USAGE, parse_mode="HTML")
+        return
+
+    target, seconds = None, PROFILE_DEFAULT_SECONDS
+    for arg in args[1:]:
+        if arg.isdigit():
+            seconds = min(int(arg), PROFILE_MAX_SECONDS)
+        else:
+            target = arg
+
+    try:
+        handler_profiler.start(mode, target)
+    except RuntimeError as e:
+        await message.answer(f"❌ {e}. /profile stop — остановить.")
+        return
+
+    _timer = asyncio.create_task(_stop_later(bot, message.chat.id, seconds))
+    await message.answer(f"▶️ Профилирование {mode} ({target or 'все обработчики'}) на {seconds} с. "
+                         "Отчёт придёт файлом.")
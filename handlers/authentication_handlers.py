@@ -1,24 +1,39 @@
+import logging
+
 from aiogram import Bot, Dispatcher, F, Router
-from aiogram.types import Message, ReplyKeyboardRemove, CallbackQuery, URLInputFile
+from aiogram.types import Message, ReplyKeyboardRemove, CallbackQuery, InputMediaPhoto
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.utils import markdown
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.enums import ParseMode
-from api import get_profile, check_user_role, get_groups_list, post_event, get_events
 from config import auth_required, format_profile, format_event
+from read_cache import cached_profile, cached_user_role
+from group_index import group_directory
+from event_sync import user_events
+from photo_cache import send_cached_photo
+from outbox import event_outbox
 from handlers.login_handlers import dp_router
-from keyboards import main_keyboard, get_location_keyboard, type_keyboard, get_date_keyboard
+from keyboards import (main_keyboard, get_location_keyboard, type_keyboard, get_date_keyboard, events_pager_keyboard,
+                       group_picker_keyboard)
 from datetime import datetime
+from uuid import uuid4
 
 
 auth_router = Router()
+logger = logging.getLogger(__name__)
+
+GROUP_PAGE_SIZE = 8
+# Отказы Telegram, после которых страницу мероприятий можно только прислать заново
+UNEDITABLE_ERRORS = ("message can't be edited", "message to edit not found",
+                     "message can't be deleted", "message to delete not found")
 
 class EventState(StatesGroup):
     title = State() # просто string
     location = State() # просто string
     type = State() # будет inline_keyboard с выбором типа
-    group = State()  # будут выводиться все группы с id - name и нужно будет ввесть id
+    group = State()  # группа выбирается кнопкой, текст сообщения — поиск по названию
     event_date = State() # дата будет по типу 2025-06-19 12:30
     # photos = State()
     # videos = State()
@@ -27,7 +42,10 @@ class EventState(StatesGroup):
 @auth_router.message(F.text == 'Профиль')
 @auth_required
 async def check_profile(message: Message, access_token: str):
-    profile = await get_profile(access_token)
+    profile = await cached_profile(message.from_user.id, access_token)
+    if not profile:
+        await message.answer("❌ Не удалось загрузить профиль. Попробуйте позже.", reply_markup=main_keyboard())
+        return
 
     response = format_profile(profile)
 
@@ -37,46 +55,92 @@ async def check_profile(message: Message, access_token: str):
 
 @auth_router.message(F.text == 'Просмотреть мероприятия')
 @auth_required
-async def check_profile(message: Message, access_token: str):
-    events = await get_events(access_token)
+async def show_events(message: Message, access_token: str):
+    events = await user_events(message.from_user.id, access_token)
 
     if not events:
         await message.answer("📭 Мероприятий пока что нет. ", reply_markup=main_keyboard())
         return
 
-    for event in events:
-        event_data = format_event(event)
+    await render_event_page(message, events[0], 0, len(events))
 
-        if event_data['photo_url']:
-            # Если есть фото, отправляем его с подписью
-            photo = URLInputFile(event_data['photo_url'])
-            await message.answer_photo(
-                photo=photo,
-                caption=event_data['caption'],
-                parse_mode="HTML",
-                reply_markup=main_keyboard()
-            )
-        else:
-            await message.answer(
-                event_data['caption'],
-                parse_mode="HTML",
-                reply_markup=main_keyboard()
-            )
 
-    for part in [event_data[i:i + 4000] for i in range(0, len(event_data), 4000)]:
-        await message.answer(part, parse_mode=ParseMode.HTML, reply_markup=main_keyboard())
+@auth_router.callback_query(F.data.startswith('events_page:'))
+@auth_required
+async def events_page_callback(callback: CallbackQuery, access_token: str):
+    page = int(callback.data.split(':')[1])
+    events = await user_events(callback.from_user.id, access_token)
+
+    if not events:
+        await callback.answer("📭 Мероприятий пока что нет.", show_alert=True)
+        return
+
+    # Снимок мог измениться с момента показа предыдущей страницы
+    page = min(page, len(events) - 1)
+    await render_event_page(callback.message, events[page], page, len(events), edit=True)
+    await callback.answer()
+
+
+@auth_router.callback_query(F.data.in_({'events_noop', 'group_noop'}))
+async def events_noop_callback(callback: CallbackQuery):
+    await callback.answer()
+
+
+async def render_event_page(message: Message, event: dict, page: int, total: int, edit: bool = False):
+    """Показывает одно мероприятие с кнопками листания, по возможности редактируя сообщение."""
+    event_data = format_event(event)
+    markup = events_pager_keyboard(page, total)
+
+    if edit:
+        try:
+            if event_data['photo_url'] and message.photo:
+                await send_cached_photo(event_data['photo_url'], lambda photo: message.edit_media(
+                    InputMediaPhoto(media=photo, caption=event_data['caption'], parse_mode="HTML"),
+                    reply_markup=markup
+                ))
+                return
+            if not event_data['photo_url'] and message.text:
+                await message.edit_text(event_data['caption'], parse_mode="HTML", reply_markup=markup)
+                return
+            # Тип сообщения меняется (фото <-> текст) — заменяем сообщение новым
+            await message.delete()
+        except TelegramBadRequest as e:
+            # Новое сообщение — только если старое больше нельзя изменить или удалить;
+            # "message is not modified" (нажата текущая страница) и прочие отказы второй страницы не шлют
+            if not any(reason in e.message for reason in UNEDITABLE_ERRORS):
+                if "message is not modified" not in e.message:
+                    logger.warning(f"Event page edit failed: {e.message}")
+                return
+
+    if event_data['photo_url']:
+        # Если есть фото, отправляем его с подписью (file_id переиспользуется)
+        await send_cached_photo(event_data['photo_url'], lambda photo: message.answer_photo(
+            photo=photo,
+            caption=event_data['caption'],
+            parse_mode="HTML",
+            reply_markup=markup
+        ))
+    else:
+        await message.answer(
+            event_data['caption'],
+            parse_mode="HTML",
+            reply_markup=markup
+        )
+
 
 @auth_router.message(F.text == 'Создать мероприятие')
 @auth_required
 async def start_create_event(message: Message, access_token: str, state: FSMContext):
-    user = await check_user_role(access_token, message.from_user.id)
+    user = await cached_user_role(message.from_user.id, access_token)
 
-    if user.get('role') != 'teacher':
+    if not user or user.get('role') != 'teacher':
         await message.answer('❌ Только преподаватель может создавать мероприятие.')
         return
 
     await message.answer("Создание мероприятия. Введите название:")
     await state.set_state(EventState.title)
+    # id сценария вместе с создателем — ключ идемпотентности при отправке на сайт
+    await state.update_data(flow_id=uuid4().hex)
 
 
 @auth_router.message(EventState.title)
@@ -138,35 +202,79 @@ async def process_type_callback(callback: CallbackQuery, access_token: str, stat
     await callback.message.answer(f"Выбран тип мероприятия: {selected_type}")
     await callback.answer()
 
-    # Запрашиваем список групп
-    groups = await get_groups_list(access_token)
-    if not groups:
+    # Показываем первую страницу групп для выбора
+    await state.update_data(group_prefix="")
+    if not await render_group_picker(callback.message, access_token, state):
         await callback.message.answer("❌ Не удалось загрузить список групп. Попробуйте позже.")
         await state.clear()
         return
-
-    groups_text = "\n".join([f"ID: <b>{g['id']}</b> | Название: <b>{g['name']}</b>" for g in groups])
-    await callback.message.answer(f"Доступные группы:\n{groups_text}\n\nВведите ID нужной группы:", parse_mode="HTML")
     await state.set_state(EventState.group)
 
 
+async def render_group_picker(message: Message, access_token: str, state: FSMContext,
+                              offset: int = 0, edit: bool = False) -> bool:
+    """Страница групп (с учётом введённого поиска); False, если список групп недоступен."""
+    index = await group_directory.get(access_token)
+    if index is None:
+        return False
+
+    prefix = (await state.get_data()).get('group_prefix', '')
+    groups, total = index.search(prefix, offset, GROUP_PAGE_SIZE)
+    if groups:
+        text = (f"Группы по запросу «{prefix}»:" if prefix else "Выберите группу:") + \
+               "\n\nЧтобы найти группу, отправьте начало её названия."
+    else:
+        text = f"Группы по запросу «{prefix}» не найдены. Отправьте другое начало названия."
+    markup = group_picker_keyboard(groups, offset, total, GROUP_PAGE_SIZE)
+
+    if edit:
+        await message.edit_text(text, reply_markup=markup)
+    else:
+        await message.answer(text, reply_markup=markup)
+    return True
+
+
 @auth_router.message(EventState.group)
 @auth_required
 async def process_group(message: Message, access_token: str, state: FSMContext):
-    try:
-        group_id = int(message.text)
-        await state.update_data(group=group_id)
+    if message.text is None or message.text.startswith('/'):
+        return
 
-        await message.answer(
-            "📅 Выберите время мероприятия или введите вручную:\n"
-            "Формат: <b>ГГГГ-ММ-ДД ЧЧ:ММ</b>\n"
-            "Пример: <code>2025-06-19 14:30</code>",
-            reply_markup=get_date_keyboard(),
-            parse_mode="HTML"
-        )
-        await state.set_state(EventState.event_date)
-    except ValueError:
-        await message.answer("Пожалуйста, введите корректный ID группы (число):")
+    # Текст в этом состоянии — поиск группы по началу названия или по ID
+    await state.update_data(group_prefix=message.text)
+    if not await render_group_picker(message, access_token, state):
+        await message.answer("❌ Не удалось загрузить список групп. Попробуйте позже.")
+
+
+@auth_router.callback_query(F.data.startswith('group_page:'), EventState.group)
+@auth_required
+async def group_page_callback(callback: CallbackQuery, access_token: str, state: FSMContext):
+    offset = int(callback.data.split(':')[1])
+    await render_group_picker(callback.message, access_token, state, offset, edit=True)
+    await callback.answer()
+
+
+@auth_router.callback_query(F.data.startswith('group_pick:'), EventState.group)
+@auth_required
+async def process_group_callback(callback: CallbackQuery, access_token: str, state: FSMContext):
+    index = await group_directory.get(access_token)
+    group = index.get(callback.data.split(':')[1]) if index else None
+    if group is None:
+        await callback.answer("Группа не найдена, выберите из списка", show_alert=True)
+        return
+
+    await state.update_data(group=group['id'])
+    await callback.message.edit_text(f"Выбрана группа: {group['name']}")
+    await callback.answer()
+
+    await callback.message.answer(
+        "📅 Выберите время мероприятия или введите вручную:\n"
+        "Формат: <b>ГГГГ-ММ-ДД ЧЧ:ММ</b>\n"
+        "Пример: <code>2025-06-19 14:30</code>",
+        reply_markup=get_date_keyboard(),
+        parse_mode="HTML"
+    )
+    await state.set_state(EventState.event_date)
 
 
 @auth_router.callback_query(lambda c: c.data.startswith('date_'), EventState.event_date)
@@ -176,7 +284,7 @@ async def process_date_callback(callback: CallbackQuery, access_token: str, stat
     try:
         await state.update_data(event_date=date_str)
         await callback.message.edit_text(f"Выбрана дата: {date_str}")
-        await complete_event_creation(callback.message, access_token, state)
+        await complete_event_creation(callback.message, callback.from_user.id, state)
     except ValueError:
         await callback.answer("Ошибка в формате даты")
 
@@ -201,7 +309,7 @@ async def process_event_date(message: Message, access_token: str, state: FSMCont
         # Если все проверки пройдены
         await state.update_data(event_date=date_str)
         await message.answer(f"Выбрана дата: {date_str}")
-        await complete_event_creation(message, access_token, state)
+        await complete_event_creation(message, message.from_user.id, state)
 
     except ValueError:
         # Если формат неверный или дата некорректная (например, 31 февраля)
@@ -214,8 +322,8 @@ async def process_event_date(message: Message, access_token: str, state: FSMCont
             parse_mode="HTML"
         )
 
-async def complete_event_creation(message: Message, access_token: str, state: FSMContext):
-    """Общая функция завершения создания мероприятия"""
+async def complete_event_creation(message: Message, creator_id: int, state: FSMContext):
+    """Общая функция завершения создания мероприятия: запись уходит в очередь, ответ — сразу."""
     data = await state.get_data()
 
     try:
@@ -225,23 +333,25 @@ async def complete_event_creation(message: Message, access_token: str, state: FS
             "type": data['type'],
             "group": data['group'],
             "event_date": data['event_date'],
-            "creator_telegram_id": message.from_user.id
+            "creator_telegram_id": creator_id
         }
+        # Сценарии, начатые до появления flow_id, получают его здесь
+        flow_id = data.get('flow_id') or uuid4().hex
 
-        await post_event(access_token, event_data)
-
-        await message.answer(
-            "✅ <b>Мероприятие успешно создано</b>\n\n"
-            "📌 <b>На сайте вы сможете улучшить мероприятие:</b>\n"
-            "• Добавить подробное описание\n"
-            "• Загрузить материалы (фото, документы)\n"
-            "• Изменить установленные данные \n\n",
-            parse_mode="HTML", reply_markup=main_keyboard()
-        )
+        if await event_outbox.submit(creator_id, message.chat.id, flow_id, event_data):
+            await message.answer(
+                "⏳ <b>Мероприятие отправлено на сайт</b>\n"
+                "Как только оно будет создано, я пришлю сообщение.",
+                parse_mode="HTML", reply_markup=main_keyboard()
+            )
+        else:
+            # Повторное нажатие: этот сценарий уже в очереди или отправлен
+            await message.answer(
+                "⏳ Мероприятие уже отправлено на сайт, ждите сообщения о результате.",
+                reply_markup=main_keyboard()
+            )
 
         await state.clear()
     except Exception as e:
+        logger.error(f"Event submit Error: {e}")
         await message.answer("⚠ Произошла ошибка при создании мероприятия")
-
-
-
@@ -5,9 +5,11 @@ from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.enums import ParseMode
-from api import authenticate_user, get_profile, get_events, link_telegram_id, check_user_role
+from api import authenticate_user, get_profile, get_events, link_telegram_id, check_user_role, BackendError, BackendUnavailable
 from cache import get_tokens_redis, save_tokens_redis, delete_tokens_redis
-from config import auth_required
+from config import auth_required, BACKEND_UNAVAILABLE_TEXT
+from read_cache import cached_profile, invalidate_user
+from notifications import group_roster
 from keyboards import main_keyboard
 
 
@@ -58,23 +60,35 @@ async def handle_password(message: Message, state: FSMContext):
     password = message.text
     tg_id = message.from_user.id
 
-    tokens = await authenticate_user(username, password)
-    if not tokens:
-        await message.answer("❌ Ошибка авторизации. Проверьте данные! /start")
-        await state.clear()
-        return
-
-    if not await save_tokens_redis(tg_id, tokens):
-        await message.answer("❌ Ошибка сохранения токенов. Попробуйте позже. /start")
+    try:
+        tokens = await authenticate_user(username, password)
+        if not tokens:
+            await message.answer("❌ Ошибка авторизации. Проверьте данные! /start")
+            await state.clear()
+            return
+
+        if not await save_tokens_redis(tg_id, tokens):
+            await message.answer("❌ Ошибка сохранения токенов. Попробуйте позже. /start")
+            await state.clear()
+            return
+
+        success = await link_telegram_id(tokens["access"], tg_id)
+    except BackendUnavailable:
+        await message.answer(f"{BACKEND_UNAVAILABLE_TEXT} /start")
         await state.clear()
         return
 
-    success = await link_telegram_id(tokens["access"], tg_id)
     if not success:
         await message.answer("❌ Ошибка привязки аккаунта. Попробуйте позже. /start")
         await state.clear()
         return
 
+    await invalidate_user(tg_id)
+    try:
+        # Профиль грузится сразу: попадает в кэш и записывает пользователя в ростер его группы
+        await cached_profile(tg_id, tokens["access"])
+    except BackendError:
+        pass
     await message.answer("✅ Успешная авторизация!\n "
                          "Выберите нужный пункт в клавиатуре. ", reply_markup=main_keyboard())
     await state.clear()
@@ -85,6 +99,8 @@ async def delete_token_handler(message: Message):
     tg_id = message.from_user.id
     try:
         success = await delete_tokens_redis(tg_id)
+        await invalidate_user(tg_id)
+        await group_roster.forget(tg_id)
         if success:
             await message.answer("✅ Вы успешно вышли из аккаунта.\n"
                                  "Для повторной авторизации используйте /start", reply_markup=ReplyKeyboardRemove())
@@ -0,0 +1,96 @@
+import os
+
+from aiogram import F, Router
+from aiogram.filters import Command, CommandObject
+from aiogram.fsm.context import FSMContext
+from aiogram.types import (Message, CallbackQuery, InlineQuery, InlineQueryResultArticle,
+                           InputTextMessageContent)
+from config import auth_required, format_event, format_event_line
+from event_index import parse_query
+from event_sync import user_snapshot
+from keyboards import find_pager_keyboard
+
+# Результатов на страницу /find и на одну порцию inline-ответа
+FIND_PAGE_SIZE = 10
+INLINE_PAGE_SIZE = 20
+# Сколько секунд Telegram может отдавать inline-ответ из своего кэша
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", 60))
+
+FIND_HELP = (
+    "🔎 <b>Поиск мероприятий</b>\n\n"
+    "<code>/find семинар 2025-06</code>\n"
+    "• тип: конференция, конкурс, экскурсия, семинар\n"
+    "• группа: <code>#id</code> или <code>#название</code>\n"
+    "• дата: <code>2025</code>, <code>2025-06</code>, <code>2025-06-19</code> "
+    "или <code>2025-06-01..2025-06-15</code>\n"
+    "• остальные слова ищутся в названии\n\n"
+    "То же работает в любом чате: <code>@бот семинар 2025-06</code>"
+)
+
+search_router = Router()
+
+
+async def render_find_page(message: Message, tg_id: int, access_token: str, query: str, offset: int,
+                           edit: bool = False):
+    snapshot = await user_snapshot(tg_id, access_token)
+    events, total = snapshot.index().search(parse_query(query), offset, FIND_PAGE_SIZE)
+
+    if not events:
+        text = "📭 Ничего не найдено."
+    else:
+        lines = [f"{offset + number}. {format_event_line(event)}" for number, event in enumerate(events, 1)]
+        text = f"🔎 Найдено: <b>{total}</b>\n\n" + "\n".join(lines)
+    markup = find_pager_keyboard(query, offset, total, FIND_PAGE_SIZE)
+
+    if edit:
+        await message.edit_text(text, parse_mode="HTML", reply_markup=markup)
+    else:
+        await message.answer(text, parse_mode="HTML", reply_markup=markup)
+
+
+@search_router.message(Command("find"))
+@auth_required
+async def find_command(message: Message, access_token: str, state: FSMContext, command: CommandObject):
+    if not command.args:
+        await message.answer(FIND_HELP, parse_mode="HTML")
+        return
+
+    # Запрос нужен для листания, а в callback_data он может не поместиться
+    await state.update_data(find_query=command.args)
+    await render_find_page(message, message.from_user.id, access_token, command.args, 0)
+
+
+@search_router.callback_query(F.data.startswith('find_page:'))
+@auth_required
+async def find_page_callback(callback: CallbackQuery, access_token: str, state: FSMContext):
+    query = (await state.get_data()).get('find_query')
+    if not query:
+        await callback.answer("Поиск устарел, повторите /find", show_alert=True)
+        return
+
+    offset = int(callback.data.split(':')[1])
+    await render_find_page(callback.message, callback.from_user.id, access_token, query, offset, edit=True)
+    await callback.answer()
+
+
+@search_router.inline_query()
+@auth_required
+async def inline_search(inline_query: InlineQuery, access_token: str):
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    snapshot = await user_snapshot(inline_query.from_user.id, access_token)
+    events, total = snapshot.index().search(parse_query(inline_query.query), offset, INLINE_PAGE_SIZE)
+
+    results = []
+    for event in events:
+        event_data = format_event(event)
+        results.append(InlineQueryResultArticle(
+            id=str(event.get('id', len(results) + offset)),
+            title=event.get('title') or 'Без названия',
+            description=format_event_line(event).replace("<b>", "").replace("</b>", ""),
+            input_message_content=InputTextMessageContent(message_text=event_data['caption'], parse_mode="HTML"),
+            thumbnail_url=event_data['photo_url']
+        ))
+
+    next_offset = str(offset + len(events)) if offset + len(events) < total else ""
+    # Ответ зависит от области видимости пользователя, поэтому кэш Telegram — персональный
+    await inline_query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=True, next_offset=next_offset)
@@ -1,8 +1,11 @@
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardRemove
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from datetime import datetime, timedelta
+from functools import cache, lru_cache
 
 
+# Клавиатуры неизменны, поэтому собираются один раз и переиспользуются
+@cache
 def main_keyboard():
     kb_buttons = [
         [KeyboardButton(text='Создать мероприятие')],
@@ -14,6 +17,7 @@ def main_keyboard():
                                    input_field_placeholder='Выбирите пункт на клавиатуре')
     return keyboard
 
+@cache
 def get_location_keyboard():
     return InlineKeyboardMarkup(inline_keyboard=[
         [
@@ -31,6 +35,7 @@ def get_location_keyboard():
     ])
 
 
+@cache
 def type_keyboard():
     return InlineKeyboardMarkup(inline_keyboard=[
     [InlineKeyboardButton(text="конференция", callback_data="type_conference")],
@@ -42,9 +47,13 @@ def type_keyboard():
 
 def get_date_keyboard():
     """Клавиатура с предложением текущей даты и вариантами"""
-    now = datetime.now()
-    today = now.strftime('%Y-%m-%d')
-    tomorrow = (now + timedelta(days=1)).strftime('%Y-%m-%d')
+    return _date_keyboard(datetime.now().date())
+
+
+@lru_cache(maxsize=2)
+def _date_keyboard(day):
+    today = day.strftime('%Y-%m-%d')
+    tomorrow = (day + timedelta(days=1)).strftime('%Y-%m-%d')
 
     builder = InlineKeyboardBuilder()
 
@@ -62,3 +71,46 @@ def get_date_keyboard():
 
     builder.adjust(2, 2, 2)
     return builder.as_markup()
+
+
+def events_pager_keyboard(page: int, total: int):
+    """Кнопки листания мероприятий: ◀️ n/total ▶️"""
+    builder = InlineKeyboardBuilder()
+    if page > 0:
+        builder.button(text="◀️", callback_data=f"events_page:{page - 1}")
+    builder.button(text=f"{page + 1}/{total}", callback_data="events_noop")
+    if page < total - 1:
+        builder.button(text="▶️", callback_data=f"events_page:{page + 1}")
+    return builder.as_markup()
+
+
+def find_pager_keyboard(query: str, offset: int, total: int, page_size: int):
+    """Кнопки листания результатов /find и переход к тому же поиску в inline-режиме."""
+    builder = InlineKeyboardBuilder()
+    if offset > 0:
+        builder.button(text="◀️", callback_data=f"find_page:{max(offset - page_size, 0)}")
+    if offset + page_size < total:
+        builder.button(text="▶️", callback_data=f"find_page:{offset + page_size}")
+    builder.button(text="🔎 Искать inline", switch_inline_query_current_chat=query)
+    builder.adjust(2 if offset > 0 and offset + page_size < total else 1, 1)
+    return builder.as_markup()
+
+
+def group_picker_keyboard(groups: list, offset: int, total: int, page_size: int):
+    """Страница групп для выбора кнопкой и листание ◀️ n/m ▶️."""
+    builder = InlineKeyboardBuilder()
+    for group in groups:
+        builder.button(text=str(group['name']), callback_data=f"group_pick:{group['id']}")
+    pages = (total + page_size - 1) // page_size
+    navigation = 0
+    if offset > 0:
+        builder.button(text="◀️", callback_data=f"group_page:{max(offset - page_size, 0)}")
+        navigation += 1
+    if pages > 1:
+        builder.button(text=f"{offset // page_size + 1}/{pages}", callback_data="group_noop")
+        navigation += 1
+    if offset + page_size < total:
+        builder.button(text="▶️", callback_data=f"group_page:{offset + page_size}")
+        navigation += 1
+    builder.adjust(*([1] * len(groups)), navigation or 1)
+    return builder.as_markup()
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+from time import perf_counter
+from typing import Awaitable
+
+from aiogram import Bot
+
+from settings import API_URL, REDIS_WARM_CONNECTIONS, API_WARM_CONNECTIONS
+from api import get_session, close_session
+from cache import redis_client, token_store
+from diagnostics import loop_watchdog
+from event_sync import event_sync
+from fsm_storage import fsm_redis
+from group_index import group_directory
+from keyboards import main_keyboard, get_location_keyboard, type_keyboard, get_date_keyboard
+from log_config import stop_logging
+from metrics import start_metrics_server, stop_metrics_server
+from notifications import notification_fanout
+from outbox import event_outbox
+from reminders import reminder_scheduler
+from sender import outbound_scheduler
+from token_manager import token_manager
+
+logger = logging.getLogger(__name__)
+
+
+async def _warm_redis(client, connections: int) -> None:
+    # Параллельные PING занимают разные соединения, поэтому пул открывает их все сразу
+    await asyncio.gather(*(client.ping() for _ in range(connections)))
+
+
+async def _warm_backend(connections: int) -> None:
+    session = get_session()
+
+    async def touch() -> None:
+        async with session.head(API_URL, allow_redirects=False) as response:
+            await response.read()
+
+    await asyncio.gather(*(touch() for _ in range(connections)))
+
+
+def _build_keyboards() -> None:
+    main_keyboard()
+    get_location_keyboard()
+    type_keyboard()
+    get_date_keyboard()
+
+
+class Lifecycle:
+    """Ресурсы процесса: на startup открываются и прогреваются, на shutdown закрываются.
+
+    Сбой прогрева не мешает запуску — соединение откроется при первом запросе.
+    """
+
+    async def _step(self, name: str, awaitable: Awaitable) -> None:
+        start = perf_counter()
+        try:
+            await awaitable
+        except Exception as e:
+            logger.error(f"Lifecycle step '{name}' Error: {e}")
+            return
+        logger.info("Lifecycle step '%s' done in %.3fs", name, perf_counter() - start)
+
+    async def startup(self, bot: Bot) -> None:
+        """Хук на startup диспетчера."""
+        start = perf_counter()
+        await self._step("watchdog", loop_watchdog.start())
+        # Соединения с Redis, DRF и Bot API открываются параллельно, до первого апдейта
+        await asyncio.gather(
+            self._step("redis", asyncio.gather(_warm_redis(redis_client, REDIS_WARM_CONNECTIONS),
+                                               _warm_redis(fsm_redis, REDIS_WARM_CONNECTIONS))),
+            self._step("backend", _warm_backend(API_WARM_CONNECTIONS)),
+            self._step("telegram", bot.me()),
+        )
+        _build_keyboards()
+        await self._step("groups", group_directory.preload())
+        await self._step("token_store", token_store.start())
+        await self._step("event_sync", event_sync.start())
+        await self._step("fanout", notification_fanout.start(bot))
+        await self._step("reminders", reminder_scheduler.start())
+        await self._step("outbox", event_outbox.start(bot))
+        await self._step("metrics", start_metrics_server())
+        logger.info("Startup finished in %.3fs", perf_counter() - start)
+
+    async def shutdown(self, bot: Bot) -> None:
+        """Хук на shutdown диспетчера: сначала фоновые задачи и отправки, затем соединения, логи — последними."""
+        await self._step("event_sync", event_sync.close())
+        await self._step("outbox", event_outbox.close())
+        await self._step("reminders", reminder_scheduler.close())
+        await self._step("fanout", notification_fanout.close())
+        await self._step("outbound", outbound_scheduler.close())
+        await self._step("token_manager", token_manager.close())
+        await self._step("token_store", token_store.close())
+        await self._step("http", close_session())
+        await self._step("redis", asyncio.gather(redis_client.aclose(), fsm_redis.aclose()))
+        await self._step("metrics", stop_metrics_server())
+        await self._step("watchdog", loop_watchdog.close())
+        await stop_logging()
+
+
+lifecycle = Lifecycle()
@@ -0,0 +1,156 @@
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+from datetime import datetime, timezone
+from time import monotonic
+
+LOG_FILE = os.getenv("LOG_FILE", "logs/info.log")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# Ротация: "size" — по размеру файла, "time" — раз в сутки
+LOG_ROTATION = os.getenv("LOG_ROTATION", "size")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", 7))
+# Рутинных записей (sample=True) в секунду без прореживания; сверх лимита пишется доля LOG_SAMPLE_RATE
+LOG_ROUTINE_PER_SEC = int(os.getenv("LOG_ROUTINE_PER_SEC", 50))
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 0.01))
+LOG_QUEUE_SIZE = 10_000
+
+# Стандартные атрибуты LogRecord; всё остальное попало в запись через extra
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "sample"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON; поля из extra выводятся как есть."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RoutineSampler(logging.Filter):
+    """Прореживает рутинные записи (extra={"sample": True}) при высоком потоке.
+
+    Предупреждения и ошибки проходят всегда.
+    """
+
+    def __init__(self, per_second: int = LOG_ROUTINE_PER_SEC, rate: float = LOG_SAMPLE_RATE):
+        super().__init__()
+        self.per_second = per_second
+        self.rate = rate
+        self._window = 0
+        self._count = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not getattr(record, "sample", False):
+            return True
+        window = int(monotonic())
+        if window != self._window:
+            self._window = window
+            self._count = 0
+        self._count += 1
+        return self._count <= self.per_second or random.random() < self.rate
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """Кладёт запись в очередь без форматирования: сообщение собирается уже в потоке записи.
+
+    Поток записи свой у каждого процесса и запускается при первой записи:
+    после fork поток родителя в дочернем процессе не существует, поэтому
+    дочерний заводит новую очередь и свой поток. Если очередь переполнена,
+    рутинные записи теряются, а предупреждения и ошибки пишутся в файл сразу.
+
+    Аргументы сообщений должны быть неизменяемыми (строки, числа), иначе
+    в файл может попасть их более позднее значение.
+    """
+
+    def __init__(self, *handlers: logging.Handler, queue_size: int = LOG_QUEUE_SIZE):
+        super().__init__(None)
+        self.handlers = handlers
+        self.queue_size = queue_size
+        self._listener: logging.handlers.QueueListener | None = None
+        self._pid: int | None = None
+
+    def _start_listener(self) -> None:
+        # Вызывается под блокировкой обработчика (Handler.handle); logging пересоздаёт её после fork
+        self.queue = queue.Queue(self.queue_size)
+        self._listener = logging.handlers.QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+        self._listener.start()
+        self._pid = os.getpid()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return copy.copy(record)
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self._pid != os.getpid():
+            self._start_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Рутинную запись лучше потерять, чем заблокировать event loop; предупреждения и ошибки — нет
+            if record.levelno >= logging.WARNING:
+                self._write(record)
+
+    def _write(self, record: logging.LogRecord) -> None:
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def stop(self) -> None:
+        """Дописывает очередь этого процесса и останавливает его поток записи."""
+        self.acquire()
+        try:
+            if self._listener is not None and self._pid == os.getpid():
+                self._listener.stop()
+            self._listener = None
+            self._pid = None
+        finally:
+            self.release()
+
+
+def _file_handler() -> logging.Handler:
+    os.makedirs(os.path.dirname(LOG_FILE) or ".", exist_ok=True)
+    if LOG_ROTATION == "time":
+        return logging.handlers.TimedRotatingFileHandler(
+            LOG_FILE, when="midnight", backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+    return logging.handlers.RotatingFileHandler(
+        LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+
+
+_queue_handler: LazyQueueHandler | None = None
+
+
+def setup_logging() -> None:
+    """Корневой логгер пишет в очередь, а файл (с ротацией) обслуживает фоновый поток процесса."""
+    global _queue_handler
+    if _queue_handler is not None:
+        return
+
+    file_handler = _file_handler()
+    file_handler.setFormatter(JsonFormatter())
+
+    _queue_handler = LazyQueueHandler(file_handler)
+    _queue_handler.addFilter(RoutineSampler())
+
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    root.handlers[:] = [_queue_handler]
+
+
+async def stop_logging() -> None:
+    """Дописывает очередь в файл и останавливает фоновый поток (хук на shutdown)."""
+    if _queue_handler is not None:
+        _queue_handler.stop()
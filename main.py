@@ -1,18 +1,262 @@
-from dotenv import load_dotenv
-from middleware import log_middleware
+import settings  # .env загружается до импорта остальных модулей бота
+from middleware import log_middleware, metrics_middleware, chat_serial_middleware
+import metrics
 from handlers.login_handlers import dp_router
 from handlers.authentication_handlers import auth_router
+from handlers.search_handlers import search_router
+from handlers.admin_handlers import admin_router
+from sender import outbound_scheduler
+from update_scheduler import update_scheduler
+from lifecycle import lifecycle
+from fsm_storage import fsm_storage, fsm_batch_middleware
+import asyncio
+import logging
 import os
+import signal
 from aiogram import Bot, Dispatcher
 
 
-load_dotenv()
-bot = Bot(token=os.getenv("TG_TOKEN"))
-dp = Dispatcher()
+# Режим получения апдейтов: polling (разработка), webhook (прод за балансировщиком),
+# sharded (фронт + SHARD_WORKERS процессов-воркеров) или shard-worker (только воркер, например на другой машине)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # публичный адрес, например https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8080))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", 40))
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", 1))
+# Сколько секунд при остановке дожидаться уже принятых апдейтов
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", 30))
+# Как фронт в режиме sharded получает апдейты: polling или webhook
+SHARD_FRONT = os.getenv("SHARD_FRONT", "polling")
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", os.cpu_count() or 1))
+
+logger = logging.getLogger(__name__)
+
+bot = Bot(token=settings.TG_TOKEN)
+bot.session.middleware(outbound_scheduler)
+# FSM middleware подключается вручную, чтобы пакет записей FSM открывался раньше него
+dp = Dispatcher(storage=fsm_storage, disable_fsm=True)
+dp.update.outer_middleware(chat_serial_middleware)
+dp.update.outer_middleware(update_scheduler)
+dp.update.outer_middleware(fsm_batch_middleware)
+dp.update.outer_middleware(dp.fsm)
 dp.update.middleware(log_middleware)
+dp.message.middleware(metrics_middleware)
+dp.callback_query.middleware(metrics_middleware)
+dp.inline_query.middleware(metrics_middleware)
+dp.include_router(admin_router)
 dp.include_router(dp_router)
 dp.include_router(auth_router)
+dp.include_router(search_router)
+dp.startup.register(lifecycle.startup)
+dp.shutdown.register(lifecycle.shutdown)
+
+
+def create_webhook_app(register_webhook: bool = True) -> "web.Application":
+    """aiohttp-приложение, принимающее апдейты от Telegram на WEBHOOK_PATH."""
+    # Серверная часть aiohttp нужна только в режиме webhook — не грузим её при polling
+    from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+    from aiohttp import web
+
+    app = web.Application()
+    handler = SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET)
+    draining = False
+
+    async def healthcheck(request: web.Request) -> web.Response:
+        # Во время остановки отвечаем 503, чтобы балансировщик снял реплику
+        return web.Response(status=503 if draining else 200, text="draining" if draining else "ok")
+
+    async def on_startup(app: web.Application) -> None:
+        if register_webhook:
+            await bot.set_webhook(
+                f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=dp.resolve_used_update_types(),
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+            )
+
+    async def drain(app: web.Application) -> None:
+        nonlocal draining
+        draining = True
+        tasks = handler._background_feed_update_tasks
+        if tasks:
+            logger.info(f"Draining {len(tasks)} updates before shutdown")
+            await asyncio.wait(set(tasks), timeout=SHUTDOWN_TIMEOUT)
+
+    # drain регистрируется первым, чтобы отработать до закрытия сессии бота и диспетчера
+    app.on_shutdown.append(drain)
+    app.on_startup.append(on_startup)
+    app.router.add_get("/healthz", healthcheck)
+    handler.register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+def run_webhook(worker: int = 0) -> None:
+    # Все воркеры слушают один порт (SO_REUSEPORT), webhook регистрирует только первый;
+    # /metrics у каждого воркера свой: METRICS_PORT + номер воркера
+    if metrics.METRICS_PORT:
+        metrics.METRICS_PORT += worker
+    from aiohttp import web
+
+    web.run_app(
+        create_webhook_app(register_webhook=worker == 0),
+        host=WEBHOOK_HOST,
+        port=WEBHOOK_PORT,
+        reuse_port=WEB_WORKERS > 1,
+        shutdown_timeout=SHUTDOWN_TIMEOUT,
+        print=None,
+    )
+
+
+def run_processes(targets: list[tuple]) -> None:
+    """Запускает (функция, аргументы) отдельными процессами и останавливает их вместе."""
+    import multiprocessing
+
+    processes = [multiprocessing.Process(target=target, args=args, name=f"{target.__name__}-{args}")
+                 for target, args in targets]
+    for process in processes:
+        process.start()
+
+    def stop(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for process in processes:
+        process.join()
+
+
+def run_webhook_workers(workers: int) -> None:
+    run_processes([(run_webhook, (i,)) for i in range(workers)])
+
+
+async def shard_front_polling() -> None:
+    """Фронт: long polling без обработки — апдейты только раскладываются по стримам слотов."""
+    from sharding import ShardRouter
+    from cache import redis_client
+
+    router = ShardRouter(redis_client)
+    allowed_updates = dp.resolve_used_update_types()
+    offset = None
+    await bot.delete_webhook()
+    try:
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=25, allowed_updates=allowed_updates)
+            except Exception as e:
+                logger.error(f"Shard front polling Error: {e}")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                payload = update.model_dump(mode="json", by_alias=True, exclude_none=True)
+                # Пока слот перегружен или Redis недоступен, следующие апдейты не забираем —
+                # Telegram держит их у себя, offset сдвигается только после записи в стрим
+                while True:
+                    try:
+                        if await router.route(payload):
+                            break
+                    except Exception as e:
+                        logger.error(f"Shard front routing Error: {e}")
+                        await asyncio.sleep(1)
+                offset = update.update_id + 1
+    finally:
+        await bot.session.close()
+
+
+def create_shard_front_app() -> "web.Application":
+    """Фронт в режиме webhook: тело апдейта уходит в стрим слота без разбора в модели aiogram."""
+    import json
+    from aiohttp import web
+    from sharding import ShardRouter
+    from cache import redis_client
+
+    router = ShardRouter(redis_client)
+    app = web.Application()
+
+    async def receive(request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+            return web.Response(status=401)
+        raw = await request.text()
+        # 503 — Telegram повторит доставку позже, пока воркеры разбирают отставание
+        return web.Response(status=200 if await router.route(json.loads(raw), raw) else 503)
+
+    async def healthcheck(request: web.Request) -> web.Response:
+        return web.Response(text="ok")
+
+    async def on_startup(app: web.Application) -> None:
+        await bot.set_webhook(
+            f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(),
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+
+    async def on_cleanup(app: web.Application) -> None:
+        await bot.session.close()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app.router.add_post(WEBHOOK_PATH, receive)
+    app.router.add_get("/healthz", healthcheck)
+    return app
+
+
+def run_shard_front() -> None:
+    if SHARD_FRONT == "webhook":
+        from aiohttp import web
+
+        web.run_app(create_shard_front_app(), host=WEBHOOK_HOST, port=WEBHOOK_PORT,
+                    shutdown_timeout=SHUTDOWN_TIMEOUT, print=None)
+    else:
+        asyncio.run(shard_front_polling())
+
+
+async def serve_shard_worker(worker_id: str) -> None:
+    from sharding import ShardWorker
+    from cache import redis_client
+
+    worker = ShardWorker(redis_client, dp, bot, worker_id)
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, worker.stop)
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    try:
+        # После stop() воркер дообрабатывает взятые апдейты и отдаёт слоты остальным
+        await worker.run()
+    finally:
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await bot.session.close()
+
+
+def run_shard_worker(index: int = 0) -> None:
+    # id постоянен между перезапусками: вернувшийся воркер сразу забирает свои слоты
+    import socket
+
+    if metrics.METRICS_PORT:
+        metrics.METRICS_PORT += index
+    worker_id = os.getenv("SHARD_WORKER_ID") or f"{socket.gethostname()}-{index}"
+    asyncio.run(serve_shard_worker(worker_id))
+
+
+def run_sharded(workers: int) -> None:
+    # Фронт не обрабатывает апдейты и не слушает /metrics; порты метрик — у воркеров
+    run_processes([(run_shard_front, ())] + [(run_shard_worker, (i,)) for i in range(workers)])
 
 
 if __name__ == "__main__":
-    dp.run_polling(bot)
\ No newline at end of file
+    if BOT_MODE == "webhook":
+        if WEB_WORKERS > 1:
+            run_webhook_workers(WEB_WORKERS)
+        else:
+            run_webhook()
+    elif BOT_MODE == "sharded":
+        run_sharded(SHARD_WORKERS)
+    elif BOT_MODE == "shard-worker":
+        run_shard_worker(int(os.getenv("SHARD_WORKER_INDEX", 0)))
+    else:
+        dp.run_polling(bot)
@@ -0,0 +1,192 @@
+import os
+import logging
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Callable, Iterator
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9100))  # 0 — не поднимать /metrics
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+logger = logging.getLogger(__name__)
+
+_registry: list["_Metric"] = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels[name] for name in self.labelnames)
+
+    def _labels(self, key: tuple, extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterator[str]:
+        for key, value in self._values.items():
+            yield f"{self.name}{self._labels(key)} {value}"
+
+
+class Gauge(_Metric):
+    """Значение задаётся через set() или вычисляется функцией в момент выдачи /metrics."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 function: Callable[[], float] | None = None):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple, float] = {}
+        self._function = function
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = value
+
+    def samples(self) -> Iterator[str]:
+        if self._function is not None:
+            yield f"{self.name} {self._function()}"
+        for key, value in self._values.items():
+            yield f"{self.name}{self._labels(key)} {value}"
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными бакетами: observe() — один bisect и два сложения."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+        # key -> [счётчики по бакетам (+Inf последним), сумма]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start, **labels)
+
+    def samples(self) -> Iterator[str]:
+        for key, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{self._labels(key, le)} {cumulative}"
+            yield f"{self.name}_sum{self._labels(key)} {total}"
+            yield f"{self.name}_count{self._labels(key)} {cumulative}"
+
+
+def render() -> str:
+    """Все метрики в текстовом формате Prometheus."""
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+# Метрики, которые пишут модули бота
+HANDLER_LATENCY = Histogram("bot_handler_seconds", "Время работы обработчика апдейта", ("handler",))
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Исключения в обработчиках", ("handler",))
+BACKEND_LATENCY = Histogram("backend_request_seconds", "Время запроса к DRF API", ("method", "endpoint", "status"))
+REDIS_LATENCY = Histogram("redis_op_seconds", "Время операций Redis", ("op",),
+                          buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0))
+TELEGRAM_LATENCY = Histogram("telegram_request_seconds", "Время запроса к Bot API", ("method",))
+TELEGRAM_WAIT = Histogram("telegram_send_wait_seconds", "Ожидание отправки в лимитах Telegram", ("priority",))
+FSM_TRANSITIONS = Counter("fsm_transitions_total", "Переходы между состояниями FSM", ("from_state", "to_state"))
+CACHE_REQUESTS = Counter("cache_requests_total", "Обращения к кэшам по результату", ("cache", "result"))
+DUPLICATE_UPDATES = Counter("bot_duplicate_updates_total", "Отброшенные повторные апдейты", ("update_type",))
+BACKEND_RETRIES = Counter("backend_retries_total", "Повторы запросов к DRF", ("endpoint",))
+BACKEND_HEDGES = Counter("backend_hedged_total", "Дублирующие (hedged) запросы к DRF", ("endpoint",))
+BACKEND_CIRCUIT_OPEN = Gauge("backend_circuit_open", "Предохранитель эндпоинта DRF разомкнут (1)", ("endpoint",))
+BACKEND_COALESCED = Counter("backend_coalesced_total", "GET к DRF, присоединённые к уже идущему запросу", ("endpoint",))
+UPDATE_ACTIVE = Gauge("bot_updates_active", "Апдейты, обрабатываемые сейчас")
+UPDATE_QUEUE_DEPTH = Gauge("bot_update_queue_depth", "Апдейты в очереди на обработку", ("priority",))
+UPDATE_WAIT = Histogram("bot_update_wait_seconds", "Ожидание апдейтом слота обработки", ("priority",))
+UPDATES_SHED = Counter("bot_updates_shed_total", "Апдейты, отклонённые из-за перегрузки", ("priority",))
+LOOP_LAG = Histogram("event_loop_lag_seconds", "Задержка event loop относительно расписания",
+                     buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+LOOP_BLOCKS = Counter("event_loop_blocks_total", "Блокировки event loop дольше порога", ("handler",))
+SHARD_ROUTED = Counter("shard_updates_routed_total", "Апдейты, разложенные фронтом по слотам", ("result",))
+SHARD_SLOTS = Gauge("shard_slots_owned", "Слоты, которыми владеет воркер")
+SHARD_INFLIGHT = Gauge("shard_updates_inflight", "Апдейты из стримов в обработке у воркера")
+OUTBOX = Counter("event_outbox_total", "Записи очереди создания мероприятий по результату", ("result",))
+REMINDERS = Counter("reminders_total", "Напоминания о мероприятиях по результату", ("result",))
+GROUP_ROSTER = Counter("group_roster_total", "Профили, учтённые в составе групп для рассылок", ("result",))
+NOTIFICATIONS_SENT = Counter("notifications_sent_total", "Уведомления рассылок по результату", ("result",))
+EVENT_SYNCS = Counter("event_sync_total", "Синхронизации списка мероприятий", ("mode", "result"))
+
+
+_runner = None  # web.AppRunner, пока /metrics поднят
+
+
+async def start_metrics_server() -> None:
+    """Поднимает локальный HTTP-эндпоинт /metrics (хук на startup диспетчера)."""
+    global _runner
+    if not METRICS_PORT or _runner is not None:
+        return
+    from aiohttp import web
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    _runner = web.AppRunner(app, access_log=None)
+    await _runner.setup()
+    try:
+        await web.TCPSite(_runner, METRICS_HOST, METRICS_PORT).start()
+    except OSError as e:
+        logger.error(f"Metrics server Error: {e}")
+        await _runner.cleanup()
+        _runner = None
+
+
+async def stop_metrics_server() -> None:
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
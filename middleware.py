@@ -1,19 +1,28 @@
+import asyncio
 import logging
+import os
 from aiogram.exceptions import TelegramNetworkError
 from typing import Callable, Dict, Any
 from aiogram.types import Update
+from log_config import setup_logging
+from metrics import HANDLER_LATENCY, HANDLER_ERRORS, DUPLICATE_UPDATES
+from diagnostics import track
+from update_scheduler import update_scheduler, update_priority, MENU_TEXTS, BULK_TEXTS
+from time import perf_counter, monotonic
 
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler("logs/info.log", encoding="utf-8"),
-    ]
-)
+setup_logging()
 
 logger = logging.getLogger(__name__)
 
+# Сколько секунд после завершения апдейта та же команда/нажатие того же пользователя в чате считается повтором
+DUPLICATE_WINDOW = float(os.getenv("DUPLICATE_WINDOW", 1.0))
+
+# chat_id -> [блокировка, сколько апдейтов держат или ждут её]
+_chat_locks: dict[int, list] = {}
+# Ключ апдейта -> до какого момента повтор отбрасывается (inf — первый ещё обрабатывается)
+_recent_updates: dict[tuple, float] = {}
+
 
 async def log_middleware(
         handler: Callable[[Update, Dict[str, Any]], Any],
@@ -23,42 +32,134 @@ async def log_middleware(
     """Middleware для логирования обработчиков """
     handler_name = handler.__qualname__ if hasattr(handler, "__qualname__") else handler.__name__
     update_type = event.event_type if hasattr(event, "event_type") else type(event).__name__
-    user_id = event.from_user.id if hasattr(event, "from_user") else "N/A"
+    user = data.get("event_from_user")
+    user_id = user.id if user else "N/A"
+    context = {"handler": handler_name, "update_type": update_type, "user_id": user_id}
 
-    logger.info(
-        f"Handler '{handler_name}' started for {update_type} (user: {user_id})"
-    )
+    logger.info("Handler '%s' started for %s (user: %s)", handler_name, update_type, user_id,
+                extra={**context, "sample": True})
 
     try:
         result = await handler(event, data)
-        logger.info(
-            f"Handler '{handler_name}' finished successfully for user {user_id}"
-        )
+        logger.info("Handler '%s' finished successfully for user %s", handler_name, user_id,
+                    extra={**context, "sample": True})
         return result
 
     except TelegramNetworkError as e:
-        logger.warning(
-            f"Network error in handler '{handler_name}': {str(e)}",
-            exc_info=True
-        )
+        logger.warning("Network error in handler '%s': %s", handler_name, e,
+                       extra=context, exc_info=True)
         raise
 
     except KeyError as e:
         if str(e) == "'refresh'":
-            logger.warning(
-                f"Refresh token error in handler '{handler_name}'",
-                exc_info=True
-            )
+            logger.warning("Refresh token error in handler '%s'", handler_name,
+                           extra=context, exc_info=True)
             raise
-        logger.error(
-            f"KeyError in handler '{handler_name}': {str(e)}",
-            exc_info=True
-        )
+        logger.error("KeyError in handler '%s': %s", handler_name, e,
+                     extra=context, exc_info=True)
         raise
 
     except Exception as e:
-        logger.error(
-            f"Unexpected error in handler '{handler_name}': {str(e)}",
-            exc_info=True
-        )
-        raise
\ No newline at end of file
+        logger.error("Unexpected error in handler '%s': %s", handler_name, e,
+                     extra=context, exc_info=True)
+        raise
+
+
+async def metrics_middleware(
+        handler: Callable[[Update, Dict[str, Any]], Any],
+        event: Update,
+        data: Dict[str, Any]
+) -> Any:
+    """Middleware для замера времени обработчиков (регистрируется на message/callback_query)"""
+    handler_object = data.get("handler")
+    handler_name = handler_object.callback.__qualname__ if handler_object else "unknown"
+    start = perf_counter()
+    try:
+        # Имя обработчика — для отчётов о блокировках loop; профилирование — если включено админом
+        with track(handler_name):
+            return await handler(event, data)
+    except Exception:
+        HANDLER_ERRORS.inc(handler=handler_name)
+        raise
+    finally:
+        HANDLER_LATENCY.observe(perf_counter() - start, handler=handler_name)
+
+
+def _duplicate_key(event: Update, chat_id: int, user_id: int | None) -> tuple | None:
+    # Прочий текст — ответ на шаг сценария: его законно повторяют, такие сообщения не отбрасываются
+    if event.message is not None and event.message.text:
+        text = event.message.text
+        if text.startswith("/") or text in MENU_TEXTS or text in BULK_TEXTS:
+            return chat_id, "message", user_id, text
+        return None
+    if event.callback_query is not None and event.callback_query.data:
+        message = event.callback_query.message
+        return (chat_id, "callback", user_id, event.callback_query.data,
+                message.message_id if message else None)
+    return None
+
+
+def _forget_update(key: tuple, expires: float) -> None:
+    if _recent_updates.get(key) == expires:
+        del _recent_updates[key]
+
+
+async def chat_serial_middleware(
+        handler: Callable[[Update, Dict[str, Any]], Any],
+        event: Update,
+        data: Dict[str, Any]
+) -> Any:
+    """Апдейты одного чата обрабатываются по очереди, повторные нажатия отбрасываются.
+
+    Регистрируется первым outer middleware на update, чтобы очередь
+    выстраивалась до чтения FSM. Ждущие блокировку чата входят в предел
+    очереди update_scheduler: при перегрузке они получают "занято".
+    """
+    chat = data.get("event_chat")
+    user = data.get("event_from_user")
+    chat_id = chat.id if chat else user.id if user else None
+    if chat_id is None:
+        return await handler(event, data)
+
+    key = _duplicate_key(event, chat_id, user.id if user else None)
+    if key is not None and _recent_updates.get(key, 0) > monotonic():
+        DUPLICATE_UPDATES.inc(update_type=key[1])
+        if event.callback_query is not None:
+            # Убираем "часики" на кнопке, результат покажет первое нажатие
+            await event.callback_query.answer()
+        return None
+
+    entry = _chat_locks.get(chat_id)
+    waiting = entry is not None
+    if waiting:
+        priority = update_priority(event)
+        if update_scheduler.overloaded(priority):
+            await update_scheduler.reject(event, priority)
+            return None
+    if key is not None:
+        _recent_updates[key] = float("inf")
+
+    if entry is None:
+        entry = _chat_locks[chat_id] = [asyncio.Lock(), 0]
+    entry[1] += 1
+    try:
+        if waiting:
+            update_scheduler.wait_chat(1)
+            try:
+                await entry[0].acquire()
+            finally:
+                update_scheduler.wait_chat(-1)
+        else:
+            await entry[0].acquire()
+        try:
+            return await handler(event, data)
+        finally:
+            entry[0].release()
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del _chat_locks[chat_id]
+        if key is not None:
+            expires = monotonic() + DUPLICATE_WINDOW
+            _recent_updates[key] = expires
+            asyncio.get_running_loop().call_later(DUPLICATE_WINDOW, _forget_update, key, expires)
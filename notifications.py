@@ -0,0 +1,285 @@
+import asyncio
+import os
+import logging
+from collections import OrderedDict
+from time import time, monotonic
+from uuid import uuid4
+
+import redis.asyncio as redis
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
+
+from cache import redis_client
+from metrics import NOTIFICATIONS_SENT, GROUP_ROSTER, REDIS_LATENCY
+from sender import send_priority, BULK
+
+logger = logging.getLogger(__name__)
+
+# Сколько получателей отправляется между чекпоинтами (~секунда общего лимита Telegram)
+FANOUT_BATCH = int(os.getenv("FANOUT_BATCH", 30))
+# Аренда задачи: если процесс не продлил её столько секунд, задачу продолжает другой
+FANOUT_LEASE = float(os.getenv("FANOUT_LEASE", 60))
+FANOUT_POLL = float(os.getenv("FANOUT_POLL", 1))
+FANOUT_JOB_TTL = 7 * 24 * 60 * 60
+# Сколько ждать завершения текущей пачки при остановке
+FANOUT_STOP_TIMEOUT = 5.0
+ROSTER_MEMO_SIZE = 10_000
+
+MEMBERS_KEY = "fanout:members:{group}"
+MEMBER_GROUP_KEY = "fanout:member_group"
+JOB_KEY = "fanout:job:{job}"
+RECIPIENTS_KEY = "fanout:job:{job}:to"
+PENDING_KEY = "fanout:pending"
+LEASES_KEY = "fanout:leases"
+
+# Переносит пользователя в множество участников новой группы
+_REMEMBER_SCRIPT = """
+local old = redis.call('HGET', KEYS[1], ARGV[1])
+if old == ARGV[2] then return 0 end
+if old then redis.call('SREM', ARGV[3] .. old, ARGV[1]) end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+redis.call('SADD', ARGV[3] .. ARGV[2], ARGV[1])
+return 1
+"""
+
+_FORGET_SCRIPT = """
+local old = redis.call('HGET', KEYS[1], ARGV[1])
+if not old then return 0 end
+redis.call('HDEL', KEYS[1], ARGV[1])
+redis.call('SREM', ARGV[2] .. old, ARGV[1])
+return 1
+"""
+
+# Сначала задачи с истёкшей арендой (процесс упал посреди рассылки), затем новые
+_CLAIM_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, 1)
+local job = expired[1] or redis.call('RPOP', KEYS[1])
+if job then redis.call('ZADD', KEYS[2], tonumber(ARGV[1]) + tonumber(ARGV[2]), job) end
+return job
+"""
+
+
+def profile_group(profile: dict | None) -> str | None:
+    """Группа из профиля /me/ (или мероприятия): id или объект {"id": ...}; None — группы нет."""
+    group = (profile or {}).get('group')
+    if isinstance(group, dict):
+        group = group.get('id')
+    return None if group is None else str(group)
+
+
+class GroupRoster:
+    """Участники групп, привязавшие Telegram: group -> множество tg_id в Redis.
+
+    Бэкенд не отдаёт состав группы, поэтому ростер пополняется при каждой
+    загрузке профиля (вход, истечение кэша профиля) и чистится при выходе.
+    """
+
+    def __init__(self, client: redis.Redis):
+        self._client = client
+        self._remember = client.register_script(_REMEMBER_SCRIPT)
+        self._forget = client.register_script(_FORGET_SCRIPT)
+        # tg_id -> группа, уже записанная в Redis этим процессом
+        self._known: OrderedDict[int, str] = OrderedDict()
+        # Предупреждение о профиле без поля group пишется один раз за процесс
+        self._warned = False
+
+    @staticmethod
+    def key(group) -> str:
+        return MEMBERS_KEY.format(group=group)
+
+    async def remember(self, tg_id: int, profile: dict | None) -> None:
+        if profile is None:
+            return
+        group = profile_group(profile)
+        if group is None:
+            # Без группы пользователь не получит ни уведомлений, ни напоминаний — это должно быть видно
+            if 'group' not in profile:
+                GROUP_ROSTER.inc(result="no_group_field")
+                if not self._warned:
+                    self._warned = True
+                    logger.warning(f"Profile of {tg_id} has no 'group' field: group notifications "
+                                   f"and reminders cannot reach users (fields: {sorted(profile)})")
+            else:
+                GROUP_ROSTER.inc(result="no_group")
+            return
+        if self._known.get(tg_id) == group:
+            return
+        try:
+            with REDIS_LATENCY.time(op="roster_remember"):
+                await self._remember(keys=[MEMBER_GROUP_KEY], args=[tg_id, group, self.key("")])
+        except Exception as e:
+            logger.error(f"Roster update Error for {tg_id}: {e}")
+            return
+        GROUP_ROSTER.inc(result="remembered")
+        self._known[tg_id] = group
+        self._known.move_to_end(tg_id)
+        if len(self._known) > ROSTER_MEMO_SIZE:
+            self._known.popitem(last=False)
+
+    async def forget(self, tg_id: int) -> None:
+        self._known.pop(tg_id, None)
+        try:
+            with REDIS_LATENCY.time(op="roster_forget"):
+                await self._forget(keys=[MEMBER_GROUP_KEY], args=[tg_id, self.key("")])
+        except Exception as e:
+            logger.error(f"Roster update Error for {tg_id}: {e}")
+
+
+class NotificationFanout:
+    """Рассылка уведомления всем участникам группы через очередь задач в Redis.
+
+    Задача — хэш с текстом и чекпоинтом плюс список получателей, снятый
+    с ростера в момент постановки. Процесс берёт задачу в аренду, шлёт
+    получателей пачками с приоритетом BULK (лимиты держит OutboundScheduler)
+    и после каждой пачки сохраняет смещение и продлевает аренду. После
+    падения задачу продолжают с последнего чекпоинта — повторно могут
+    получить уведомление не больше FANOUT_BATCH человек.
+    """
+
+    def __init__(self, client: redis.Redis, roster: GroupRoster, batch: int = FANOUT_BATCH,
+                 lease: float = FANOUT_LEASE):
+        self._client = client
+        self._roster = roster
+        self.batch = batch
+        self.lease = lease
+        self._claim = client.register_script(_CLAIM_SCRIPT)
+        self._bot: Bot | None = None
+        self._task: asyncio.Task | None = None
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._current: str | None = None
+
+    async def enqueue(self, group, text: str, exclude: int | None = None) -> str:
+        """Ставит рассылку ``text`` участникам группы ``group`` (кроме ``exclude``), возвращает id задачи."""
+        job = uuid4().hex
+        job_key = JOB_KEY.format(job=job)
+        recipients_key = RECIPIENTS_KEY.format(job=job)
+        with REDIS_LATENCY.time(op="fanout_enqueue"):
+            async with self._client.pipeline(transaction=True) as pipe:
+                # SORT ... STORE копирует множество в список на стороне Redis: смещение в нём и есть чекпоинт
+                pipe.sort(self._roster.key(group), store=recipients_key)
+                pipe.hset(job_key, mapping={
+                    "group": str(group), "text": text, "exclude": exclude or "",
+                    "offset": 0, "sent": 0, "failed": 0, "created_at": time(),
+                })
+                pipe.expire(job_key, FANOUT_JOB_TTL)
+                pipe.expire(recipients_key, FANOUT_JOB_TTL)
+                pipe.lpush(PENDING_KEY, job)
+                total, *_ = await pipe.execute()
+        logger.info(f"Fan-out job {job} queued for group {group}: {total} recipients")
+        self._wakeup.set()
+        return job
+
+    def wakeup(self) -> None:
+        """Будит обработчик очереди этого процесса: задачи поставлены в обход enqueue."""
+        self._wakeup.set()
+
+    async def start(self, bot: Bot) -> None:
+        """Запускает обработку очереди (хук на startup)."""
+        self._bot = bot
+        self._stopping = False
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Дожидается текущей пачки и возвращает незаконченную задачу в очередь (хук на shutdown)."""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(self._task, FANOUT_STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+        except Exception as e:
+            logger.error(f"Fan-out worker Error: {e}")
+        self._task = None
+        if self._current is not None:
+            # Аренда истекает сразу — следующий процесс продолжит с чекпоинта без ожидания
+            await self._client.zadd(LEASES_KEY, {self._current: 0})
+            self._current = None
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                job = await self._claim(keys=[PENDING_KEY, LEASES_KEY], args=[time(), self.lease])
+            except Exception as e:
+                logger.error(f"Fan-out claim Error: {e}")
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), FANOUT_POLL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._current = job
+            try:
+                if await self._process(job):
+                    self._current = None
+            except Exception as e:
+                # Аренда истечёт, и задачу подхватят заново с последнего чекпоинта
+                logger.error(f"Fan-out job {job} Error: {e}")
+                self._current = None
+                await asyncio.sleep(FANOUT_POLL)
+
+    async def _process(self, job: str) -> bool:
+        """Рассылает задачу до конца или до остановки; True — задача завершена."""
+        job_key = JOB_KEY.format(job=job)
+        recipients_key = RECIPIENTS_KEY.format(job=job)
+        state = await self._client.hgetall(job_key)
+        if not state:
+            # Задача истекла по TTL
+            await self._client.zrem(LEASES_KEY, job)
+            return True
+
+        text = state["text"]
+        exclude = state.get("exclude", "")
+        offset, sent, failed = int(state["offset"]), int(state["sent"]), int(state["failed"])
+        start = monotonic()
+        while True:
+            if self._stopping:
+                return False
+            chunk = await self._client.lrange(recipients_key, offset, offset + self.batch - 1)
+            if not chunk:
+                break
+            results = await asyncio.gather(*(self._send(int(tg_id), text)
+                                             for tg_id in chunk if tg_id != exclude))
+            sent += sum(results)
+            failed += len(results) - sum(results)
+            offset += len(chunk)
+            async with self._client.pipeline(transaction=True) as pipe:
+                pipe.hset(job_key, mapping={"offset": offset, "sent": sent, "failed": failed})
+                pipe.zadd(LEASES_KEY, {job: time() + self.lease})
+                await pipe.execute()
+
+        await self._client.zrem(LEASES_KEY, job)
+        await self._client.delete(job_key, recipients_key)
+        logger.info(f"Fan-out job {job} for group {state['group']} done: "
+                    f"sent {sent}, failed {failed} in {monotonic() - start:.1f}s")
+        return True
+
+    async def _send(self, tg_id: int, text: str) -> bool:
+        token = send_priority.set(BULK)
+        try:
+            await self._bot.send_message(tg_id, text, parse_mode="HTML")
+            NOTIFICATIONS_SENT.inc(result="sent")
+            return True
+        except TelegramForbiddenError:
+            # Бот заблокирован — больше этому пользователю не пишем
+            NOTIFICATIONS_SENT.inc(result="blocked")
+            await self._roster.forget(tg_id)
+        except TelegramBadRequest as e:
+            NOTIFICATIONS_SENT.inc(result="rejected")
+            logger.warning(f"Notification to {tg_id} rejected: {e}")
+        except Exception as e:
+            NOTIFICATIONS_SENT.inc(result="error")
+            logger.error(f"Notification send Error for {tg_id}: {e}")
+        finally:
+            send_priority.reset(token)
+        return False
+
+
+group_roster = GroupRoster(redis_client)
+notification_fanout = NotificationFanout(redis_client, group_roster)
@@ -0,0 +1,248 @@
+import asyncio
+import html
+import json
+import os
+import logging
+from time import time
+
+import jwt
+import redis.asyncio as redis
+from aiogram import Bot
+
+from api import post_event, BackendUnavailable, Unauthorized
+from cache import redis_client, get_tokens_redis, delete_tokens_redis
+from config import format_event_notice
+from event_sync import refresh_user_events
+from group_index import group_directory
+from keyboards import main_keyboard
+from metrics import OUTBOX, REDIS_LATENCY
+from notifications import notification_fanout
+from resilience import backoff
+from token_manager import token_manager
+
+logger = logging.getLogger(__name__)
+
+# Сколько раз пытаться отправить мероприятие и паузы между попытками
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 8))
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", 5))
+OUTBOX_BACKOFF_CAP = float(os.getenv("OUTBOX_BACKOFF_CAP", 5 * 60))
+OUTBOX_POLL = float(os.getenv("OUTBOX_POLL", 1))
+OUTBOX_BATCH = int(os.getenv("OUTBOX_BATCH", 20))
+# Аренда записи на время отправки: упавший процесс не держит её дольше
+OUTBOX_LEASE = 60
+# Сколько хранить доставленную запись: повтор того же сценария не создаст второе мероприятие
+OUTBOX_DONE_TTL = 24 * 60 * 60
+
+ITEM_KEY = "outbox:event:{key}"
+DUE_KEY = "outbox:due"
+
+CREATED_TEXT = (
+    "✅ <b>Мероприятие «{title}» создано</b>\n\n"
+    "📌 <b>На сайте вы сможете улучшить мероприятие:</b>\n"
+    "• Добавить подробное описание\n"
+    "• Загрузить материалы (фото, документы)\n"
+    "• Изменить установленные данные \n\n"
+)
+REJECTED_TEXT = "❌ Сайт не принял мероприятие «{title}» (ошибка {status}). Проверьте данные и создайте его заново."
+FAILED_TEXT = "⚠ Не удалось создать мероприятие «{title}»: сайт недоступен. Попробуйте позже."
+SESSION_TEXT = "❌ Мероприятие «{title}» не создано: сессия истекла. Авторизуйтесь снова /start и повторите."
+
+# Запись создаётся один раз на ключ идемпотентности
+_SUBMIT_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then return 0 end
+redis.call('HSET', KEYS[1], 'payload', ARGV[1], 'tg_id', ARGV[2], 'chat_id', ARGV[3],
+           'attempts', 0, 'status', 'pending', 'created_at', ARGV[4])
+redis.call('ZADD', KEYS[2], ARGV[4], ARGV[5])
+return 1
+"""
+
+# Забирает записи, чья очередь подошла, продлевая их на время аренды
+_CLAIM_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, key in ipairs(due) do
+  redis.call('ZADD', KEYS[1], tonumber(ARGV[1]) + tonumber(ARGV[3]), key)
+end
+return due
+"""
+
+
+class EventOutbox:
+    """Отложенная запись мероприятий: сценарий кладёт мероприятие в Redis и сразу отвечает.
+
+    Фоновый обработчик отправляет записи в DRF с ключом идемпотентности
+    (заголовок Idempotency-Key: создатель и id сценария FSM), повторяет
+    при недоступности бэкенда с экспоненциальной паузой и сообщает
+    преподавателю итог. Запись удаляется из очереди только после
+    окончательного ответа, поэтому перезапуск бота её не теряет.
+    """
+
+    def __init__(self, client: redis.Redis, batch: int = OUTBOX_BATCH):
+        self._client = client
+        self.batch = batch
+        self._submit = client.register_script(_SUBMIT_SCRIPT)
+        self._claim = client.register_script(_CLAIM_SCRIPT)
+        self._bot: Bot | None = None
+        self._task: asyncio.Task | None = None
+        self._wakeup = asyncio.Event()
+
+    @staticmethod
+    def idempotency_key(creator_id: int, flow_id: str) -> str:
+        return f"{creator_id}:{flow_id}"
+
+    async def submit(self, creator_id: int, chat_id: int, flow_id: str, event: dict) -> bool:
+        """Кладёт мероприятие в очередь; False — этот сценарий уже был отправлен."""
+        key = self.idempotency_key(creator_id, flow_id)
+        with REDIS_LATENCY.time(op="outbox_submit"):
+            created = await self._submit(keys=[ITEM_KEY.format(key=key), DUE_KEY],
+                                         args=[json.dumps(event), creator_id, chat_id, time(), key])
+        OUTBOX.inc(result="submitted" if created else "duplicate")
+        if created:
+            self._wakeup.set()
+        return bool(created)
+
+    async def start(self, bot: Bot) -> None:
+        """Запускает доставку (хук на startup)."""
+        self._bot = bot
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        # Недоставленные записи остаются в Redis — их отправит следующий запуск
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                keys = await self._claim(keys=[DUE_KEY], args=[time(), self.batch, OUTBOX_LEASE])
+            except Exception as e:
+                logger.error(f"Outbox claim Error: {e}")
+                keys = []
+            if keys:
+                await asyncio.gather(*(self._deliver(key) for key in keys))
+            if len(keys) < self.batch:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), OUTBOX_POLL)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _deliver(self, key: str) -> None:
+        item_key = ITEM_KEY.format(key=key)
+        event = finished = None
+        try:
+            item = await self._client.hgetall(item_key)
+            if not item or item.get("status") != "pending":
+                await self._client.zrem(DUE_KEY, key)
+                return
+            event = json.loads(item["payload"])
+            tg_id, chat_id = int(item["tg_id"]), int(item["chat_id"])
+            attempts = int(item["attempts"]) + 1
+
+            try:
+                access_token = await self._access_token(tg_id)
+                status = await post_event(access_token, event, idempotency_key=key) if access_token else 401
+            except Unauthorized:
+                status = 401
+            except BackendUnavailable as e:
+                if attempts < OUTBOX_MAX_ATTEMPTS:
+                    delay = OUTBOX_BACKOFF_BASE + backoff(attempts, OUTBOX_BACKOFF_BASE, OUTBOX_BACKOFF_CAP)
+                    async with self._client.pipeline(transaction=True) as pipe:
+                        pipe.hset(item_key, "attempts", attempts)
+                        pipe.zadd(DUE_KEY, {key: time() + delay})
+                        await pipe.execute()
+                    OUTBOX.inc(result="retry")
+                    logger.warning(f"Outbox {key}: backend unavailable ({e}), retry {attempts} in {delay:.0f}s")
+                    return
+                status = None
+
+            if status == 401:
+                # Как и auth_required: бэкенд не принимает токены — без повторного входа не обойтись
+                await delete_tokens_redis(tg_id)
+            await self._finish(key, item_key, attempts, status)
+            finished = True
+            await self._report(tg_id, chat_id, event, status, access_token if status in (200, 201) else None)
+        except Exception as e:
+            logger.error(f"Outbox {key} Error: {e}")
+            if not finished:
+                await self._retry_broken(key, item_key, event)
+
+    async def _retry_broken(self, key: str, item_key: str, event: dict | None) -> None:
+        """Неожиданный сбой считается попыткой: битая запись не повторяется бесконечно."""
+        try:
+            attempts = await self._client.hincrby(item_key, "attempts", 1)
+            if attempts < OUTBOX_MAX_ATTEMPTS:
+                delay = OUTBOX_BACKOFF_BASE + backoff(attempts, OUTBOX_BACKOFF_BASE, OUTBOX_BACKOFF_CAP)
+                await self._client.zadd(DUE_KEY, {key: time() + delay}, xx=True)
+                OUTBOX.inc(result="retry")
+                return
+            await self._finish(key, item_key, attempts, None)
+            logger.error(f"Outbox {key}: gave up after {attempts} attempts")
+            if event is not None:
+                item = await self._client.hmget(item_key, "tg_id", "chat_id")
+                await self._report(int(item[0]), int(item[1]), event, None, None)
+        except Exception as e:
+            # Redis недоступен: аренда истечёт, и запись будет взята снова
+            logger.error(f"Outbox {key} retry Error: {e}")
+
+    async def _access_token(self, tg_id: int) -> str | None:
+        tokens = await get_tokens_redis(tg_id)
+        if not tokens:
+            return None
+        try:
+            return await token_manager.get_access_token(tg_id, tokens)
+        except jwt.DecodeError:
+            return None
+
+    async def _finish(self, key: str, item_key: str, attempts: int, status: int | None) -> None:
+        if status in (200, 201):
+            result = "created"
+        elif status is None:
+            result = "failed"
+        else:
+            result = "rejected"
+        async with self._client.pipeline(transaction=True) as pipe:
+            pipe.hset(item_key, mapping={"status": result, "attempts": attempts, "http_status": status or ""})
+            pipe.expire(item_key, OUTBOX_DONE_TTL)
+            pipe.zrem(DUE_KEY, key)
+            await pipe.execute()
+        OUTBOX.inc(result=result)
+
+    async def _report(self, tg_id: int, chat_id: int, event: dict, status: int | None,
+                      access_token: str | None) -> None:
+        title = html.escape(str(event.get('title', '')))
+        if status in (200, 201):
+            text = CREATED_TEXT.format(title=title)
+        elif status == 401:
+            text = SESSION_TEXT.format(title=title)
+        elif status is None:
+            text = FAILED_TEXT.format(title=title)
+        else:
+            text = REJECTED_TEXT.format(title=title, status=status)
+        try:
+            await self._bot.send_message(chat_id, text, parse_mode="HTML", reply_markup=main_keyboard())
+        except Exception as e:
+            logger.error(f"Outbox report Error for {chat_id}: {e}")
+
+        if access_token is not None:
+            await self._announce(tg_id, access_token, event)
+
+    async def _announce(self, tg_id: int, access_token: str, event: dict) -> None:
+        """Рассылка группе и внеочередная синхронизация: мероприятие сразу видно в списке и напоминаниях."""
+        try:
+            index = await group_directory.get(access_token)
+            group = index.get(event['group']) if index is not None else None
+            group_name = group['name'] if group is not None else event['group']
+            await notification_fanout.enqueue(event['group'], format_event_notice(event, group_name),
+                                              exclude=tg_id)
+            await refresh_user_events(tg_id, access_token)
+        except Exception as e:
+            logger.error(f"Outbox announce Error: {e}")
+
+
+event_outbox = EventOutbox(redis_client)
@@ -0,0 +1,104 @@
+import hashlib
+import os
+import logging
+from time import time
+from typing import Awaitable, Callable
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile, InputFile, Message, URLInputFile
+
+from api import get_session
+from cache import redis_client
+from metrics import CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# Как часто сверять фото с источником (If-None-Match), чтобы заметить замену файла
+PHOTO_REVALIDATE = int(os.getenv("PHOTO_REVALIDATE", 24 * 60 * 60))
+PHOTO_CACHE_TTL = 30 * 24 * 60 * 60
+
+
+def _url_key(url: str) -> str:
+    return f"photo:{hashlib.sha1(url.encode()).hexdigest()}"
+
+
+def _sha_key(digest: str) -> str:
+    return f"photo_sha:{digest}"
+
+
+async def resolve_photo(url: str) -> tuple[str | InputFile, dict | None]:
+    """Возвращает file_id уже загруженного в Telegram фото или файл для загрузки.
+
+    Вторым элементом идут данные, которые нужно передать в ``remember_photo``
+    после отправки (None, если запоминать нечего).
+    """
+    record = await redis_client.hgetall(_url_key(url))
+    if record.get("file_id") and time() - float(record.get("checked", 0)) < PHOTO_REVALIDATE:
+        return record["file_id"], None
+
+    headers = {"If-None-Match": record["etag"]} if record.get("etag") and record.get("file_id") else {}
+    try:
+        async with get_session().get(url, headers=headers) as response:
+            if response.status == 304:
+                await redis_client.hset(_url_key(url), "checked", time())
+                return record["file_id"], None
+            response.raise_for_status()
+            content = await response.read()
+            etag = response.headers.get("ETag", "")
+    except Exception as e:
+        logger.error(f"Photo download Error ({url}): {e}")
+        return URLInputFile(url), None
+
+    digest = hashlib.sha256(content).hexdigest()
+    meta = {"etag": etag, "sha": digest, "checked": time()}
+
+    # То же содержимое уже загружалось (в том числе под другим URL)
+    file_id = record.get("file_id") if record.get("sha") == digest else await redis_client.get(_sha_key(digest))
+    if file_id:
+        await _store(url, {**meta, "file_id": file_id})
+        return file_id, None
+
+    return BufferedInputFile(content, filename=url.rsplit("/", 1)[-1] or "photo.jpg"), meta
+
+
+async def remember_photo(url: str, meta: dict | None, message: Message | bool) -> None:
+    """Запоминает file_id, который Telegram выдал при первой загрузке фото."""
+    if meta is None or not isinstance(message, Message) or not message.photo:
+        return
+    file_id = message.photo[-1].file_id
+    await _store(url, {**meta, "file_id": file_id})
+    await redis_client.set(_sha_key(meta["sha"]), file_id, ex=PHOTO_CACHE_TTL)
+
+
+async def forget_photo(url: str) -> None:
+    """Удаляет устаревший file_id, чтобы фото загрузилось заново."""
+    digest = await redis_client.hget(_url_key(url), "sha")
+    keys = [_url_key(url), _sha_key(digest)] if digest else [_url_key(url)]
+    await redis_client.delete(*keys)
+
+
+async def _store(url: str, record: dict) -> None:
+    async with redis_client.pipeline(transaction=True) as pipe:
+        await (pipe.hset(_url_key(url), mapping=record)
+               .expire(_url_key(url), PHOTO_CACHE_TTL)
+               .execute())
+
+
+async def send_cached_photo(url: str,
+                            send: Callable[[str | InputFile], Awaitable[Message | bool]]) -> Message | bool:
+    """Отправляет фото через ``send``, переиспользуя file_id; при отказе Telegram загружает заново."""
+    photo, meta = await resolve_photo(url)
+    CACHE_REQUESTS.inc(cache="photo_file_id", result="hit" if isinstance(photo, str) else "upload")
+    try:
+        result = await send(photo)
+    except TelegramBadRequest as e:
+        # Повторное редактирование тем же фото — не признак устаревшего file_id
+        if not isinstance(photo, str) or "message is not modified" in e.message:
+            raise
+        logger.warning(f"Stale file_id for {url}: {e}")
+        await forget_photo(url)
+        photo, meta = await resolve_photo(url)
+        result = await send(photo)
+
+    await remember_photo(url, meta, result)
+    return result
@@ -0,0 +1,163 @@
+import asyncio
+import json
+import os
+import logging
+from collections import OrderedDict
+from time import time, monotonic
+from typing import Any, Awaitable, Callable, Hashable
+
+from api import get_profile, check_user_role, get_groups_list
+from cache import redis_client
+from metrics import CACHE_REQUESTS, REDIS_LATENCY
+from notifications import group_roster
+
+logger = logging.getLogger(__name__)
+
+# Сколько секунд запись в памяти процесса доверяет себе, не сверяясь с Redis
+LOOKUP_LOCAL_TTL = float(os.getenv("LOOKUP_LOCAL_TTL", 30))
+LOOKUP_LOCAL_SIZE = int(os.getenv("LOOKUP_LOCAL_SIZE", 5_000))
+
+
+class ReadThroughCache:
+    """Read-through кэш: LRU в памяти процесса поверх общего для всех инстансов Redis.
+
+    Запись свежая ``ttl`` секунд, ещё ``stale_ttl`` секунд она отдаётся
+    как есть, а в фоне перезапрашивается (stale-while-revalidate).
+    """
+
+    def __init__(self, namespace: str, ttl: float, stale_ttl: float,
+                 max_size: int = LOOKUP_LOCAL_SIZE, local_ttl: float = LOOKUP_LOCAL_TTL,
+                 client=redis_client):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_size = max_size
+        self.local_ttl = local_ttl
+        self._client = client
+        # key -> (значение, время записи, ttl, до какого момента верить памяти)
+        self._local: OrderedDict[Hashable, tuple[Any, float, float, float]] = OrderedDict()
+        self._inflight: dict[Hashable, asyncio.Task] = {}
+
+    def _redis_key(self, key: Hashable) -> str:
+        return f"cache:{self.namespace}:{key}"
+
+    async def get(self, key: Hashable, loader: Callable[[], Awaitable[Any]],
+                  ttl: float | None = None) -> Any:
+        """Значение из кэша; при промахе вызывает ``loader``. None не кэшируется."""
+        entry = self._local.get(key)
+        if entry is not None and entry[3] > monotonic():
+            self._local.move_to_end(key)
+            value = self._serve(key, loader, *entry[:3])
+            if value is not None:
+                return value
+
+        try:
+            with REDIS_LATENCY.time(op="lookup_get"):
+                raw = await self._client.get(self._redis_key(key))
+        except Exception as e:
+            logger.error(f"Redis Cache Error: {e}")
+            raw = None
+        if raw:
+            stored = json.loads(raw)
+            self._remember(key, stored["v"], stored["t"], stored["ttl"])
+            value = self._serve(key, loader, stored["v"], stored["t"], stored["ttl"])
+            if value is not None:
+                return value
+
+        CACHE_REQUESTS.inc(cache=self.namespace, result="miss")
+        return await self._load(key, loader, ttl or self.ttl)
+
+    def _serve(self, key: Hashable, loader, value: Any, stored_at: float, ttl: float) -> Any:
+        age = time() - stored_at
+        if age < ttl:
+            CACHE_REQUESTS.inc(cache=self.namespace, result="hit")
+            return value
+        if age < ttl + self.stale_ttl:
+            if key not in self._inflight:
+                self._start_load(key, loader, ttl)
+            CACHE_REQUESTS.inc(cache=self.namespace, result="stale")
+            return value
+        return None
+
+    async def _load(self, key: Hashable, loader, ttl: float) -> Any:
+        task = self._inflight.get(key) or self._start_load(key, loader, ttl)
+        return await asyncio.shield(task)
+
+    def _start_load(self, key: Hashable, loader, ttl: float) -> asyncio.Task:
+        task = asyncio.create_task(self._fetch(key, loader, ttl))
+        self._inflight[key] = task
+        task.add_done_callback(lambda t: self._on_load_done(key, t))
+        return task
+
+    def _on_load_done(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Cache load Error ({self.namespace}:{key}): {task.exception()}")
+
+    async def _fetch(self, key: Hashable, loader, ttl: float) -> Any:
+        value = await loader()
+        if value is None:
+            return None
+
+        stored_at = time()
+        self._remember(key, value, stored_at, ttl)
+        try:
+            await self._client.set(self._redis_key(key),
+                                   json.dumps({"v": value, "t": stored_at, "ttl": ttl}),
+                                   ex=int(ttl + self.stale_ttl))
+        except Exception as e:
+            logger.error(f"Redis Cache Error: {e}")
+        return value
+
+    def _remember(self, key: Hashable, value: Any, stored_at: float, ttl: float) -> None:
+        self._local[key] = (value, stored_at, ttl, monotonic() + min(self.local_ttl, ttl))
+        self._local.move_to_end(key)
+        if len(self._local) > self.max_size:
+            self._local.popitem(last=False)
+
+    async def preload(self, key: Hashable) -> Any | None:
+        """Переносит запись из Redis в память процесса без обращения к бэкенду (прогрев при старте)."""
+        with REDIS_LATENCY.time(op="lookup_get"):
+            raw = await self._client.get(self._redis_key(key))
+        if not raw:
+            return None
+        stored = json.loads(raw)
+        self._remember(key, stored["v"], stored["t"], stored["ttl"])
+        return stored["v"]
+
+    async def invalidate(self, key: Hashable) -> None:
+        self._local.pop(key, None)
+        await self._client.delete(self._redis_key(key))
+
+
+profile_cache = ReadThroughCache("profile", ttl=5 * 60, stale_ttl=60 * 60)
+role_cache = ReadThroughCache("role", ttl=10 * 60, stale_ttl=60 * 60)
+# Список групп один на всех пользователей
+groups_cache = ReadThroughCache("groups", ttl=10 * 60, stale_ttl=24 * 60 * 60, max_size=1)
+
+
+async def cached_profile(tg_id: int, access_token: str) -> dict | None:
+    """Профиль пользователя через кэш."""
+    async def load() -> dict | None:
+        profile = await get_profile(access_token)
+        # Каждая свежая загрузка профиля обновляет членство в группе для рассылок
+        await group_roster.remember(tg_id, profile)
+        return profile
+
+    return await profile_cache.get(tg_id, load)
+
+
+async def cached_user_role(tg_id: int, access_token: str) -> Any | None:
+    """Пользователь с ролью (ответ /users/<tg_id>/) через кэш."""
+    return await role_cache.get(tg_id, lambda: check_user_role(access_token, tg_id))
+
+
+async def cached_groups_list(access_token: str) -> list | None:
+    """Общий для всех пользователей список групп через кэш."""
+    return await groups_cache.get("all", lambda: get_groups_list(access_token))
+
+
+async def invalidate_user(tg_id: int) -> None:
+    """Сбрасывает закэшированные данные пользователя (вход/выход из аккаунта)."""
+    await asyncio.gather(profile_cache.invalidate(tg_id), role_cache.invalidate(tg_id))
@@ -0,0 +1,224 @@
+import asyncio
+import os
+import logging
+from collections import OrderedDict
+from time import time
+
+import redis.asyncio as redis
+
+from cache import redis_client
+from config import parse_event_date, format_event_reminder
+from metrics import REMINDERS, REDIS_LATENCY
+from notifications import (notification_fanout, MEMBERS_KEY, JOB_KEY, RECIPIENTS_KEY, PENDING_KEY,
+                           FANOUT_JOB_TTL)
+
+logger = logging.getLogger(__name__)
+
+# За сколько до начала напоминать: "24h,1h", суффиксы d/h/m
+REMINDER_OFFSETS = os.getenv("REMINDER_OFFSETS", "24h,1h")
+# Как часто проверять наступившие напоминания и сколько забирать за раз
+REMINDER_TICK = float(os.getenv("REMINDER_TICK", 5))
+REMINDER_BATCH = int(os.getenv("REMINDER_BATCH", 100))
+# Пропущенное напоминание (бот лежал) ещё отправляется, если опоздание не больше этого
+REMINDER_GRACE = int(os.getenv("REMINDER_GRACE", 10 * 60))
+# Сколько помнить отправленное напоминание, чтобы синхронизация не поставила его снова
+REMINDER_FIRED_TTL = 3 * 24 * 60 * 60
+REMINDER_MEMO_SIZE = 50_000
+
+DUE_KEY = "reminders:due"
+PAYLOAD_KEY = "reminders:payload"
+FIRED_KEY = "reminders:fired:{reminder}"
+
+_UNITS = {"d": 86400, "h": 3600, "m": 60}
+# Ключ получателей задачи рассылки: JOB_KEY + суффикс
+_RECIPIENTS_SUFFIX = RECIPIENTS_KEY.format(job="").removeprefix(JOB_KEY.format(job=""))
+
+# Ставит или переносит одно напоминание. ZADD с тем же участником заменяет
+# время, поэтому повтор с той же датой ничего не меняет
+_SCHEDULE_SCRIPT = """
+if redis.call('GET', ARGV[4]) == ARGV[2] then return 0 end
+if tonumber(ARGV[2]) < tonumber(ARGV[5]) then
+  redis.call('ZREM', KEYS[1], ARGV[1])
+  redis.call('HDEL', KEYS[2], ARGV[1])
+  return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[3])
+return 1
+"""
+
+# Забирает наступившие напоминания и в той же транзакции превращает их в задачи рассылки.
+# Стоимость зависит только от числа наступивших: ZRANGEBYSCORE по началу множества
+_CLAIM_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'WITHSCORES', 'LIMIT', 0, tonumber(ARGV[2]))
+local count = 0
+for i = 1, #due, 2 do
+  local reminder, score = due[i], due[i + 1]
+  local payload = redis.call('HGET', KEYS[2], reminder)
+  redis.call('ZREM', KEYS[1], reminder)
+  redis.call('HDEL', KEYS[2], reminder)
+  redis.call('SET', ARGV[3] .. reminder, score, 'EX', tonumber(ARGV[8]))
+  if payload and tonumber(score) >= tonumber(ARGV[1]) - tonumber(ARGV[9]) then
+    local group, text = string.match(payload, '^([^|]*)|(.*)$')
+    local job = 'reminder:' .. reminder .. ':' .. score
+    local job_key = ARGV[5] .. job
+    local recipients_key = ARGV[5] .. job .. ARGV[6]
+    redis.call('SORT', ARGV[4] .. group, 'STORE', recipients_key)
+    redis.call('HSET', job_key, 'group', group, 'text', text, 'exclude', '',
+               'offset', 0, 'sent', 0, 'failed', 0, 'created_at', ARGV[1])
+    redis.call('EXPIRE', job_key, tonumber(ARGV[7]))
+    redis.call('EXPIRE', recipients_key, tonumber(ARGV[7]))
+    redis.call('LPUSH', KEYS[3], job)
+    count = count + 1
+  end
+end
+return {#due / 2, count}
+"""
+
+
+def parse_offsets(value: str) -> list[int]:
+    """"24h,1h" -> [86400, 3600]."""
+    offsets = []
+    for item in value.split(","):
+        item = item.strip().lower()
+        if item:
+            offsets.append(int(item[:-1]) * _UNITS[item[-1]])
+    return offsets
+
+
+def _event_group(event: dict):
+    group = event.get('group')
+    return group.get('id') if isinstance(group, dict) else group
+
+
+class ReminderScheduler:
+    """Напоминания о мероприятиях в sorted set Redis: участник — "<id>:<за сколько>", score — время отправки.
+
+    Синхронизация списка мероприятий ставит и переносит напоминания
+    (идемпотентно: ключ напоминания не зависит от даты), а фоновый тик
+    атомарно забирает наступившие и ставит их в очередь рассылки группы.
+    Несколько экземпляров бота могут тикать одновременно — каждое
+    напоминание заберёт ровно один.
+    """
+
+    def __init__(self, client: redis.Redis, offsets: list[int] | None = None,
+                 tick: float = REMINDER_TICK, batch: int = REMINDER_BATCH):
+        self._client = client
+        self.offsets = parse_offsets(REMINDER_OFFSETS) if offsets is None else offsets
+        self.tick = tick
+        self.batch = batch
+        self._schedule = client.register_script(_SCHEDULE_SCRIPT)
+        self._claim = client.register_script(_CLAIM_SCRIPT)
+        # id мероприятия -> поля, из которых собрано напоминание, уже записанное в Redis этим процессом
+        self._known: OrderedDict = OrderedDict()
+        self._task: asyncio.Task | None = None
+
+    @staticmethod
+    def reminder_id(event_id, offset: int) -> str:
+        return f"{event_id}:{offset}"
+
+    async def schedule(self, events: list) -> None:
+        """Ставит напоминания для мероприятий; неизменившиеся пропускаются без обращения к Redis."""
+        changed = []
+        for event in events:
+            event_id, group = event.get('id'), _event_group(event)
+            if event_id is None or group is None:
+                continue
+            marker = (event.get('event_date'), group, event.get('title'), event.get('location'))
+            if self._known.get(event_id) != marker:
+                changed.append((event, marker))
+        if not changed:
+            return
+        # Отмечаем заранее: параллельные синхронизации снимков с тем же списком не повторят запись
+        for event, marker in changed:
+            self._known[event['id']] = marker
+            self._known.move_to_end(event['id'])
+
+        now = time()
+        try:
+            with REDIS_LATENCY.time(op="reminders_schedule"):
+                async with self._client.pipeline(transaction=False) as pipe:
+                    for event, _ in changed:
+                        try:
+                            starts_at = parse_event_date(event['event_date']).timestamp()
+                        except (ValueError, KeyError, TypeError, OverflowError):
+                            continue
+                        for offset in self.offsets:
+                            reminder = self.reminder_id(event['id'], offset)
+                            payload = f"{_event_group(event)}|{format_event_reminder(event, offset)}"
+                            await self._schedule(keys=[DUE_KEY, PAYLOAD_KEY],
+                                                 args=[reminder, int(starts_at - offset), payload,
+                                                       FIRED_KEY.format(reminder=reminder), int(now - REMINDER_GRACE)],
+                                                 client=pipe)
+                    results = await pipe.execute()
+        except Exception as e:
+            logger.error(f"Reminder schedule Error: {e}")
+            for event, marker in changed:
+                if self._known.get(event['id']) == marker:
+                    del self._known[event['id']]
+            return
+
+        REMINDERS.inc(sum(results), result="scheduled")
+        while len(self._known) > REMINDER_MEMO_SIZE:
+            self._known.popitem(last=False)
+
+    async def cancel(self, event_ids) -> None:
+        """Снимает напоминания удалённых мероприятий."""
+        reminders = [self.reminder_id(event_id, offset) for event_id in event_ids for offset in self.offsets]
+        if not reminders:
+            return
+        for event_id in event_ids:
+            self._known.pop(event_id, None)
+        try:
+            async with self._client.pipeline(transaction=False) as pipe:
+                pipe.zrem(DUE_KEY, *reminders)
+                pipe.hdel(PAYLOAD_KEY, *reminders)
+                removed, _ = await pipe.execute()
+        except Exception as e:
+            logger.error(f"Reminder cancel Error: {e}")
+            return
+        REMINDERS.inc(removed, result="cancelled")
+
+    async def dispatch(self) -> int:
+        """Один тик: забирает наступившие напоминания пачками, возвращает число поставленных рассылок."""
+        queued = 0
+        while True:
+            with REDIS_LATENCY.time(op="reminders_claim"):
+                claimed, jobs = await self._claim(
+                    keys=[DUE_KEY, PAYLOAD_KEY, PENDING_KEY],
+                    args=[int(time()), self.batch, FIRED_KEY.format(reminder=""), MEMBERS_KEY.format(group=""),
+                          JOB_KEY.format(job=""), _RECIPIENTS_SUFFIX, FANOUT_JOB_TTL,
+                          REMINDER_FIRED_TTL, REMINDER_GRACE])
+            queued += jobs
+            REMINDERS.inc(jobs, result="sent")
+            REMINDERS.inc(claimed - jobs, result="expired")
+            if claimed < self.batch:
+                break
+        if queued:
+            notification_fanout.wakeup()
+        return queued
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.dispatch()
+            except Exception as e:
+                logger.error(f"Reminder dispatch Error: {e}")
+            await asyncio.sleep(self.tick)
+
+    async def start(self) -> None:
+        """Запускает тик напоминаний (хук на startup)."""
+        if self._task is None and self.offsets:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+reminder_scheduler = ReminderScheduler(redis_client)
@@ -0,0 +1,47 @@
+import random
+from time import monotonic
+
+
+def backoff(attempt: int, base: float, cap: float) -> float:
+    """Пауза перед повтором ``attempt`` (с 1): экспоненциальная с полным джиттером."""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    """Предохранитель эндпоинта: после ``failure_threshold`` ошибок подряд запросы
+    сразу отклоняются, через ``reset_timeout`` секунд пропускается один пробный.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._probe_at: float | None = None
+
+    @property
+    def closed(self) -> bool:
+        return self.opened_at is None
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        now = monotonic()
+        if now - self.opened_at < self.reset_timeout:
+            return False
+        # Полуоткрыт: один пробный запрос; если он потерялся (отмена), через reset_timeout — следующий
+        if self._probe_at is not None and now - self._probe_at < self.reset_timeout:
+            return False
+        self._probe_at = now
+        return True
+
+    def success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._probe_at = None
+
+    def failure(self) -> None:
+        self.failures += 1
+        self._probe_at = None
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = monotonic()
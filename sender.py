@@ -0,0 +1,143 @@
+import asyncio
+import itertools
+import os
+import logging
+from contextvars import ContextVar
+from time import monotonic
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+from metrics import TELEGRAM_LATENCY, TELEGRAM_WAIT
+
+logger = logging.getLogger(__name__)
+
+# Ограничения Telegram: ~30 сообщений/с на бота, ~1/с в личный чат, ~20/мин в группу
+GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", 30))
+CHAT_RATE = float(os.getenv("TG_CHAT_RATE", 1))
+CHAT_BURST = int(os.getenv("TG_CHAT_BURST", 5))
+GROUP_CHAT_RATE = 20 / 60
+RETRY_AFTER_ATTEMPTS = 3
+CHAT_BUCKETS_LIMIT = 10_000
+
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = ("interactive", "bulk")
+
+# Приоритет отправок текущей задачи: ответы пользователю по умолчанию, рассылки — BULK
+send_priority: ContextVar[int] = ContextVar("send_priority", default=INTERACTIVE)
+
+
+class TokenBucket:
+    """Token bucket: ``rate`` токенов в секунду, не больше ``capacity`` про запас."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+        self.paused_until = 0.0
+
+    def reserve(self) -> float:
+        """Забирает токен и возвращает, сколько секунд нужно подождать до его появления."""
+        now = monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        delay = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+        return max(delay, self.paused_until - now)
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, monotonic() + seconds)
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """Middleware сессии бота: общий и початовый лимит, retry_after и приоритеты.
+
+    Каждый запрос с chat_id сначала ждёт токен своего чата, затем встаёт
+    в общую очередь; очередь выдаёт глобальные токены в порядке приоритета,
+    поэтому ответы пользователям обгоняют массовые рассылки.
+    """
+
+    def __init__(self, global_rate: float = GLOBAL_RATE, chat_rate: float = CHAT_RATE,
+                 chat_burst: int = CHAT_BURST):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._chats: dict[int | str, TokenBucket] = {}
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._seq = itertools.count()
+        self._pump: asyncio.Task | None = None
+
+    def _chat_bucket(self, chat_id: int | str) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= CHAT_BUCKETS_LIMIT:
+                # Забываем чаты, которые давно ничего не получали
+                idle = monotonic() - 60
+                self._chats = {k: v for k, v in self._chats.items() if v.updated > idle}
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            bucket = TokenBucket(GROUP_CHAT_RATE if is_group else self.chat_rate,
+                                 1 if is_group else self.chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def _acquire(self, chat_id: int | str) -> None:
+        delay = self._chat_bucket(chat_id).reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._run_pump())
+        granted = asyncio.get_running_loop().create_future()
+        await self._queue.put((send_priority.get(), next(self._seq), granted))
+        await granted
+
+    async def _run_pump(self) -> None:
+        while True:
+            priority, seq, granted = await self._queue.get()
+            delay = self.global_bucket.reserve()
+            if delay > 0:
+                # Пока ждём токен, в очередь мог попасть запрос важнее — он и получит токен
+                self._queue.put_nowait((priority, seq, granted))
+                await asyncio.sleep(delay)
+                priority, seq, granted = self._queue.get_nowait()
+            if not granted.done():
+                granted.set_result(None)
+
+    async def __call__(
+            self,
+            make_request: NextRequestMiddlewareType[TelegramType],
+            bot: Bot,
+            method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        method_name = type(method).__name__
+        if chat_id is None:
+            with TELEGRAM_LATENCY.time(method=method_name):
+                return await make_request(bot, method)
+
+        for attempt in range(RETRY_AFTER_ATTEMPTS):
+            with TELEGRAM_WAIT.time(priority=PRIORITY_NAMES[send_priority.get()]):
+                await self._acquire(chat_id)
+            try:
+                with TELEGRAM_LATENCY.time(method=method_name):
+                    return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                logger.warning(f"Flood control in chat {chat_id}, retry in {e.retry_after}s")
+                self.global_bucket.pause(e.retry_after)
+                self._chat_bucket(chat_id).pause(e.retry_after)
+                if attempt == RETRY_AFTER_ATTEMPTS - 1:
+                    raise
+
+    async def close(self) -> None:
+        """Останавливает очередь (хук на shutdown)."""
+        if self._pump is not None:
+            self._pump.cancel()
+            self._pump = None
+
+
+outbound_scheduler = OutboundScheduler()
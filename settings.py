@@ -0,0 +1,20 @@
+import os
+
+from dotenv import load_dotenv
+
+# .env читается один раз, при первом импорте — до того, как модули бота читают свои переменные
+load_dotenv()
+
+TG_TOKEN = os.getenv("TG_TOKEN")
+API_URL = os.getenv("API_URL")
+
+REDIS_HOST = os.getenv("REDIS_HOST")
+REDIS_PORT = int(os.getenv("REDIS_PORT"))
+REDIS_DB = int(os.getenv("REDIS_DB"))
+
+# Сколько соединений открыть заранее при старте процесса
+REDIS_WARM_CONNECTIONS = int(os.getenv("REDIS_WARM_CONNECTIONS", 4))
+API_WARM_CONNECTIONS = int(os.getenv("API_WARM_CONNECTIONS", 4))
+
+# Telegram ID администраторов через запятую: им доступна команда /profile
+ADMIN_IDS = {int(tg_id) for tg_id in os.getenv("ADMIN_IDS", "").split(",") if tg_id.strip()}
@@ -0,0 +1,302 @@
+import asyncio
+import json
+import os
+import logging
+from bisect import bisect
+from hashlib import blake2b
+from time import time
+
+import redis.asyncio as redis
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from redis.exceptions import ResponseError
+
+from metrics import SHARD_ROUTED, SHARD_SLOTS, SHARD_INFLIGHT, REDIS_LATENCY
+
+logger = logging.getLogger(__name__)
+
+# Число слотов фиксировано: чат всегда попадает в один стрим, между воркерами переезжают слоты целиком
+SHARD_SLOTS_COUNT = int(os.getenv("SHARD_SLOTS", 64))
+SHARD_VNODES = 64
+# Воркер жив, пока отмечается чаще SHARD_WORKER_TTL; слот за ним держится арендой SHARD_LEASE
+SHARD_HEARTBEAT = float(os.getenv("SHARD_HEARTBEAT", 2))
+SHARD_WORKER_TTL = float(os.getenv("SHARD_WORKER_TTL", 6))
+SHARD_LEASE = float(os.getenv("SHARD_LEASE", 10))
+# Обратное давление: сколько необработанных апдейтов слота ждать, прежде чем придержать приём
+SHARD_MAX_BACKLOG = int(os.getenv("SHARD_MAX_BACKLOG", 1_000))
+SHARD_BACKPRESSURE_TIMEOUT = float(os.getenv("SHARD_BACKPRESSURE_TIMEOUT", 10))
+# Сколько апдейтов воркер держит в обработке одновременно и читает за раз
+SHARD_INFLIGHT_LIMIT = int(os.getenv("SHARD_INFLIGHT", 256))
+SHARD_READ_COUNT = 100
+
+STREAM_KEY = "shard:stream:{slot}"
+LEASE_KEY = "shard:lease:{slot}"
+WORKERS_KEY = "shard:workers"
+GROUP = "workers"
+
+# Берёт свободный слот; свою же аренду (воркер перезапустился с тем же id) забирает сразу
+_ACQUIRE_SCRIPT = """
+local owner = redis.call('GET', KEYS[1])
+if owner and owner ~= ARGV[1] then return 0 end
+redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+return 1
+"""
+
+# Продлевает или снимает аренду, только если она принадлежит этому воркеру
+_RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('PEXPIRE', KEYS[1], ARGV[2]) end
+return 0
+"""
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+def update_chat_id(update: dict) -> int:
+    """Чат апдейта без разбора в модели aiogram: чат сообщения, иначе пользователь."""
+    for name, payload in update.items():
+        if name == "update_id" or not isinstance(payload, dict):
+            continue
+        chat = payload.get("chat") or (payload.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        user = payload.get("from") or payload.get("user")
+        if user:
+            return user["id"]
+    return 0
+
+
+def slot_for(chat_id: int, slots: int = SHARD_SLOTS_COUNT) -> int:
+    return _hash(str(chat_id)) % slots
+
+
+class HashRing:
+    """Консистентное хэширование: при входе или уходе воркера переезжает ~1/N слотов."""
+
+    def __init__(self, nodes, vnodes: int = SHARD_VNODES):
+        points = sorted((_hash(f"{node}#{i}"), node) for node in nodes for i in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def owner(self, key: str) -> str | None:
+        if not self._nodes:
+            return None
+        return self._nodes[bisect(self._hashes, _hash(key)) % len(self._nodes)]
+
+
+class ShardRouter:
+    """Фронт: кладёт апдейт в стрим слота его чата.
+
+    Порядок внутри чата сохраняет стрим, обработку — воркер, владеющий
+    слотом. Если воркер отстал и в стриме слота больше SHARD_MAX_BACKLOG
+    записей, приём ждёт (polling перестаёт забирать апдейты, webhook
+    отвечает Telegram ошибкой, и тот повторит доставку позже).
+    """
+
+    def __init__(self, client: redis.Redis, slots: int = SHARD_SLOTS_COUNT):
+        self._client = client
+        self.slots = slots
+
+    async def route(self, update: dict, raw: bytes | str | None = None) -> bool:
+        """False — слот перегружен дольше SHARD_BACKPRESSURE_TIMEOUT, апдейт не принят."""
+        slot = slot_for(update_chat_id(update), self.slots)
+        stream = STREAM_KEY.format(slot=slot)
+        waited = 0.0
+        while await self._client.xlen(stream) >= SHARD_MAX_BACKLOG:
+            if waited >= SHARD_BACKPRESSURE_TIMEOUT:
+                SHARD_ROUTED.inc(result="rejected")
+                return False
+            SHARD_ROUTED.inc(result="throttled")
+            await asyncio.sleep(0.1)
+            waited += 0.1
+        with REDIS_LATENCY.time(op="shard_route"):
+            await self._client.xadd(stream, {"u": raw if raw is not None else json.dumps(update)})
+        SHARD_ROUTED.inc(result="routed")
+        return True
+
+
+class ShardWorker:
+    """Воркер: обрабатывает апдейты слотов, которые ему достаются по кольцу живых воркеров.
+
+    Слот берётся арендой в Redis и переходит к новому владельцу только
+    после того, как старый дообработал уже взятые из него апдейты и
+    снял аренду, — так порядок апдейтов чата сохраняется и при
+    перебалансировке: пока слот дообрабатывается, аренда продлевается.
+    Апдейты, взятые упавшим воркером, новый владелец забирает из pending
+    стрима, когда они пролежали без подтверждения дольше аренды, и до
+    этого не читает из слота новые (доставка "хотя бы один раз").
+    """
+
+    def __init__(self, client: redis.Redis, dispatcher: Dispatcher, bot: Bot, worker_id: str,
+                 slots: int = SHARD_SLOTS_COUNT, inflight_limit: int = SHARD_INFLIGHT_LIMIT):
+        self._client = client
+        self._dp = dispatcher
+        self._bot = bot
+        self.worker_id = worker_id
+        self.slots = slots
+        self.inflight_limit = inflight_limit
+        self._acquire = client.register_script(_ACQUIRE_SCRIPT)
+        self._renew = client.register_script(_RENEW_SCRIPT)
+        self._release = client.register_script(_RELEASE_SCRIPT)
+        self.owned: set[int] = set()
+        self._draining: set[int] = set()
+        # Слот -> до какого момента забирать апдейты прежнего владельца, не читая новые
+        self._adopting: dict[int, float] = {}
+        self._tasks: dict[int, set[asyncio.Task]] = {}
+        # id записей стрима в обработке: XAUTOCLAIM может вернуть свою же долгую запись
+        self._entries: set[str] = set()
+        self._inflight = 0
+        self._capacity = asyncio.Event()
+        self._capacity.set()
+        self._stopping = False
+
+    async def run(self) -> None:
+        heartbeat = asyncio.create_task(self._heartbeat())
+        try:
+            while not self._stopping:
+                await self._capacity.wait()
+                readable = self.owned - self._draining - self._adopting.keys()
+                if not readable:
+                    await asyncio.sleep(0.5)
+                    continue
+                try:
+                    response = await self._client.xreadgroup(
+                        GROUP, self.worker_id, {STREAM_KEY.format(slot=slot): ">" for slot in readable},
+                        count=max(1, min(SHARD_READ_COUNT, self.inflight_limit - self._inflight)), block=1000)
+                except Exception as e:
+                    logger.error(f"Shard read Error: {e}")
+                    await asyncio.sleep(1)
+                    continue
+                for stream, entries in response or []:
+                    self._dispatch(int(stream.rsplit(":", 1)[1]), entries)
+        finally:
+            heartbeat.cancel()
+            await self._release_all()
+
+    def stop(self) -> None:
+        self._stopping = True
+
+    def _dispatch(self, slot: int, entries) -> None:
+        # Задачи создаются в порядке стрима: chat_serial_middleware выстроит апдейты чата в том же порядке
+        for entry_id, fields in entries:
+            if entry_id in self._entries:
+                continue
+            self._entries.add(entry_id)
+            task = asyncio.create_task(self._process(slot, entry_id, fields["u"]))
+            self._tasks.setdefault(slot, set()).add(task)
+            task.add_done_callback(lambda t, s=slot: self._tasks[s].discard(t))
+            self._inflight += 1
+        SHARD_INFLIGHT.set(self._inflight)
+        if self._inflight >= self.inflight_limit:
+            self._capacity.clear()
+
+    async def _process(self, slot: int, entry_id: str, raw: str) -> None:
+        stream = STREAM_KEY.format(slot=slot)
+        try:
+            update = Update.model_validate_json(raw, context={"bot": self._bot})
+            await self._dp.feed_update(self._bot, update)
+        except Exception as e:
+            logger.error(f"Shard update Error (slot {slot}, {entry_id}): {e}")
+        finally:
+            self._inflight -= 1
+            SHARD_INFLIGHT.set(self._inflight)
+            self._capacity.set()
+            try:
+                # Удаляем обработанное: длина стрима — это отставание слота, по нему фронт держит давление
+                async with self._client.pipeline(transaction=False) as pipe:
+                    pipe.xack(stream, GROUP, entry_id)
+                    pipe.xdel(stream, entry_id)
+                    await pipe.execute()
+            except Exception as e:
+                logger.error(f"Shard ack Error (slot {slot}, {entry_id}): {e}")
+            self._entries.discard(entry_id)
+
+    async def _heartbeat(self) -> None:
+        while True:
+            try:
+                await self._rebalance()
+            except Exception as e:
+                logger.error(f"Shard rebalance Error: {e}")
+            await asyncio.sleep(SHARD_HEARTBEAT)
+
+    async def _rebalance(self) -> None:
+        now = time()
+        async with self._client.pipeline(transaction=False) as pipe:
+            pipe.zadd(WORKERS_KEY, {self.worker_id: now})
+            pipe.zremrangebyscore(WORKERS_KEY, "-inf", now - SHARD_WORKER_TTL)
+            pipe.zrange(WORKERS_KEY, 0, -1)
+            *_, workers = await pipe.execute()
+        ring = HashRing(workers)
+        wanted = {slot for slot in range(self.slots) if ring.owner(f"slot:{slot}") == self.worker_id}
+
+        lease_ms = int(SHARD_LEASE * 1000)
+        for slot in list(self.owned):
+            # Аренда продлевается и у дообрабатываемых слотов: иначе новый владелец возьмёт слот раньше
+            if not await self._renew(keys=[LEASE_KEY.format(slot=slot)], args=[self.worker_id, lease_ms]):
+                # Аренду потеряли (долгая пауза) — слот уже мог взять другой
+                logger.warning(f"Shard slot {slot} lease lost")
+                self.owned.discard(slot)
+                self._draining.discard(slot)
+                self._adopting.pop(slot, None)
+            elif slot in wanted:
+                self._draining.discard(slot)
+            else:
+                self._draining.add(slot)
+        for slot in list(self._draining):
+            if not self._tasks.get(slot):
+                await self._release(keys=[LEASE_KEY.format(slot=slot)], args=[self.worker_id])
+                self._draining.discard(slot)
+                self._adopting.pop(slot, None)
+                self.owned.discard(slot)
+        for slot in wanted - self.owned:
+            if await self._acquire(keys=[LEASE_KEY.format(slot=slot)], args=[self.worker_id, lease_ms]):
+                await self._prepare(slot)
+                self.owned.add(slot)
+        for slot, deadline in list(self._adopting.items()):
+            if await self._adopt(slot) or time() >= deadline:
+                del self._adopting[slot]
+        SHARD_SLOTS.set(len(self.owned))
+
+    async def _prepare(self, slot: int) -> None:
+        """Группа потребителей слота; при недообработанных прежним владельцем апдейтах — их приём."""
+        stream = STREAM_KEY.format(slot=slot)
+        try:
+            await self._client.xgroup_create(stream, GROUP, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        if (await self._client.xpending(stream, GROUP))["pending"]:
+            # Их простой меньше аренды, пока прежний владелец мог продлевать её после чтения
+            self._adopting[slot] = time() + SHARD_LEASE + SHARD_HEARTBEAT
+            if await self._adopt(slot):
+                del self._adopting[slot]
+
+    async def _adopt(self, slot: int) -> bool:
+        """Забирает апдейты, пролежавшие без подтверждения дольше аренды; True — других в слоте нет."""
+        stream = STREAM_KEY.format(slot=slot)
+        start = "0-0"
+        while True:
+            start, entries, *_ = await self._client.xautoclaim(stream, GROUP, self.worker_id,
+                                                               int(SHARD_LEASE * 1000), start_id=start,
+                                                               count=SHARD_READ_COUNT)
+            if entries:
+                self._dispatch(slot, entries)
+            if not entries or start in ("0-0", b"0-0"):
+                break
+        # В pending остались только свои, уже взятые в обработку
+        pending = (await self._client.xpending(stream, GROUP))["pending"]
+        return pending <= len(self._tasks.get(slot, ()))
+
+    async def _release_all(self) -> None:
+        tasks = [task for slot_tasks in self._tasks.values() for task in slot_tasks]
+        if tasks:
+            await asyncio.wait(tasks)
+        for slot in self.owned:
+            await self._release(keys=[LEASE_KEY.format(slot=slot)], args=[self.worker_id])
+        self.owned.clear()
+        await self._client.zrem(WORKERS_KEY, self.worker_id)
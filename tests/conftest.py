@@ -0,0 +1,14 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Модули бота читают настройки при импорте; Redis в тестах — fakeredis (Lua через lupa)
+os.environ.setdefault("TG_TOKEN", "42:TEST")
+os.environ.setdefault("REDIS_HOST", "localhost")
+os.environ.setdefault("REDIS_PORT", "6379")
+os.environ.setdefault("REDIS_DB", "0")
+os.environ.setdefault("API_URL", "http://backend.test")
+os.environ.setdefault("LOG_FILE", os.path.join(tempfile.mkdtemp(), "bot.log"))
+os.environ.setdefault("METRICS_PORT", "0")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
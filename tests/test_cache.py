@@ -0,0 +1,63 @@
+import asyncio
+
+import fakeredis.aioredis
+
+from cache import TokenStore
+
+TOKENS = {"access": "a.b.c", "refresh": "d.e.f"}
+
+
+def _store() -> TokenStore:
+    store = TokenStore(fakeredis.aioredis.FakeRedis(decode_responses=True))
+    store._tracking = True  # подписка на инвалидацию считается активной
+    return store
+
+
+def test_read_fills_l1():
+    async def scenario():
+        store = _store()
+        await store.save(1, TOKENS)
+        await store.get(1)
+        return 1 in store._l1, store._reads
+
+    assert asyncio.run(scenario()) == (True, {})
+
+
+def test_invalidation_during_read_skips_l1_fill():
+    async def scenario():
+        store = _store()
+        await store.save(1, TOKENS)
+        getex = store._client.getex
+
+        async def racing_getex(*args, **kwargs):
+            value = await getex(*args, **kwargs)
+            # Токены сменил другой процесс, пока ответ шёл к нам
+            store._invalidate([store.key(1)])
+            return value
+
+        store._client.getex = racing_getex
+        tokens = await store.get(1)
+        return tokens, 1 in store._l1, store._reads
+
+    tokens, cached, reads = asyncio.run(scenario())
+    assert tokens == TOKENS
+    assert not cached and reads == {}
+
+
+def test_read_started_before_tracking_is_not_cached():
+    async def scenario():
+        store = _store()
+        store._tracking = False
+        await store.save(1, TOKENS)
+        getex = store._client.getex
+
+        async def subscribing_getex(*args, **kwargs):
+            value = await getex(*args, **kwargs)
+            store._tracking = True
+            return value
+
+        store._client.getex = subscribing_getex
+        await store.get(1)
+        return 1 in store._l1
+
+    assert asyncio.run(scenario()) is False
@@ -0,0 +1,56 @@
+from datetime import datetime
+
+from event_index import EventIndex, parse_query
+
+EVENTS = [
+    {"id": 1, "title": "Python на практике", "type": "семинар", "event_date": "2025-06-19T10:00:00+03:00",
+     "group": {"id": 3, "name": "ИСп-21"}},
+    {"id": 2, "title": "Олимпиада по Python", "type": "конкурс", "event_date": "2025-05-02T12:00:00",
+     "group": {"id": 4, "name": "ИСп-22"}},
+    {"id": 3, "title": "Экскурсия на завод", "type": "экскурсия", "event_date": "2025-06-01T09:00:00",
+     "group": 3},
+    {"id": 4, "title": "Семинар без даты", "type": "семинар", "event_date": None, "group": None},
+]
+
+
+def test_parse_query_splits_filters_and_words():
+    query = parse_query("Семинар #ИСп-21 2025-06 python")
+    assert (query.type, query.group, query.words) == ("семинар", "исп-21", ("python",))
+    assert (query.start, query.end) == (datetime(2025, 6, 1), datetime(2025, 7, 1))
+
+
+def test_parse_query_range_and_synonyms():
+    query = parse_query("seminar 2025-12-30..2026")
+    assert query.type == "семинар"
+    assert (query.start, query.end) == (datetime(2025, 12, 30), datetime(2027, 1, 1))
+    assert parse_query("2025-12").end == datetime(2026, 1, 1)
+    assert not parse_query("")
+
+
+def test_invalid_date_is_searched_as_words():
+    query = parse_query("2025-13")
+    assert query.start is None and query.words == ("2025", "13")
+
+
+def _ids(index, text, **kwargs):
+    events, total = index.search(parse_query(text), **kwargs)
+    return [event["id"] for event in events], total
+
+
+def test_search_orders_by_date_with_undated_last():
+    assert _ids(EventIndex(EVENTS), "") == ([2, 3, 1, 4], 4)
+
+
+def test_search_combines_filters():
+    index = EventIndex(EVENTS)
+    assert _ids(index, "семинар") == ([1, 4], 2)
+    assert _ids(index, "#3") == ([3, 1], 2)
+    assert _ids(index, "#исп-22") == ([2], 1)
+    assert _ids(index, "pyth") == ([2, 1], 2)
+    assert _ids(index, "python 2025-06") == ([1], 1)
+    assert _ids(index, "2025-06-01..2025-06-01") == ([3], 1)
+    assert _ids(index, "конференция") == ([], 0)
+
+
+def test_search_pages():
+    assert _ids(EventIndex(EVENTS), "", offset=1, limit=2) == ([3, 1], 4)
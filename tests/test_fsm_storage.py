@@ -0,0 +1,54 @@
+import asyncio
+import marshal
+
+import fakeredis.aioredis
+from aiogram.fsm.storage.base import StorageKey
+
+from fsm_storage import FSM_FORMAT, CompactRedisStorage, _batch, _decode, _encode
+
+KEY = StorageKey(bot_id=42, chat_id=1, user_id=1)
+
+
+def test_codec_roundtrip_is_versioned_json():
+    raw = _encode("EventState:title", {"flow_id": "abc", "group": 3, "title": "Олимпиада"})
+    assert raw[0] == FSM_FORMAT
+    assert _decode(raw) == ("EventState:title", {"flow_id": "abc", "group": 3, "title": "Олимпиада"})
+    assert _decode(None) == (None, {})
+
+
+def test_unreadable_record_starts_scenario_over():
+    async def scenario():
+        storage = CompactRedisStorage(fakeredis.aioredis.FakeRedis())
+        await storage.redis.set(storage.key_builder.build(KEY), marshal.dumps(("AuthState:login", {"a": 1})))
+        return await storage.get_state(KEY), await storage.get_data(KEY)
+
+    assert asyncio.run(scenario()) == (None, {})
+
+
+def test_unserializable_data_keeps_previous_record():
+    async def scenario():
+        storage = CompactRedisStorage(fakeredis.aioredis.FakeRedis())
+        await storage.set_data(KEY, {"title": "Олимпиада"})
+        await storage.set_data(KEY, {"title": object()})
+        return _decode(await storage.redis.get(storage.key_builder.build(KEY)))
+
+    assert asyncio.run(scenario()) == (None, {"title": "Олимпиада"})
+
+
+def test_batch_writes_once_on_flush():
+    async def scenario():
+        storage = CompactRedisStorage(fakeredis.aioredis.FakeRedis())
+        redis_key = storage.key_builder.build(KEY)
+        token = _batch.set({})
+        try:
+            await storage.set_state(KEY, "EventState:title")
+            await storage.update_data(KEY, {"title": "Олимпиада"})
+            before = await storage.redis.get(redis_key)
+            await storage.flush()
+        finally:
+            _batch.reset(token)
+        return before, _decode(await storage.redis.get(redis_key))
+
+    before, after = asyncio.run(scenario())
+    assert before is None
+    assert after == ("EventState:title", {"title": "Олимпиада"})
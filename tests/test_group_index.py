@@ -0,0 +1,36 @@
+from group_index import GroupIndex
+
+GROUPS = [
+    {"id": 21, "name": "ИСп-21"},
+    {"id": 3, "name": "Группа ИСп-22"},
+    {"id": 7, "name": "Бухгалтерия 3"},
+]
+
+
+def _ids(index, prefix, **kwargs):
+    groups, total = index.search(prefix, **kwargs)
+    return [group["id"] for group in groups], total
+
+
+def test_groups_sorted_by_name():
+    assert _ids(GroupIndex(GROUPS), "") == ([7, 3, 21], 3)
+
+
+def test_prefix_matches_start_of_any_word():
+    index = GroupIndex(GROUPS)
+    assert _ids(index, "исп") == ([3, 21], 2)
+    assert _ids(index, " ГРУП ") == ([3], 1)
+    assert _ids(index, "22") == ([3], 1)
+    assert _ids(index, "сп") == ([], 0)
+
+
+def test_exact_id_goes_first():
+    index = GroupIndex(GROUPS)
+    assert _ids(index, "21") == ([21], 1)
+    assert _ids(index, "3") == ([3, 7], 2)
+    assert index.get(7)["name"] == "Бухгалтерия 3"
+    assert index.get("404") is None
+
+
+def test_search_pages():
+    assert _ids(GroupIndex(GROUPS), "", offset=1, limit=1) == ([3], 3)
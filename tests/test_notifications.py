@@ -0,0 +1,36 @@
+import asyncio
+import logging
+
+import fakeredis.aioredis
+
+from notifications import GroupRoster, profile_group
+
+# Ответ /me/ в том виде, в каком его показывает format_profile и отдаёт фейковый DRF бенчмарка
+ME_PAYLOAD = {"username": "student", "email": "s@example.com", "first_name": "", "last_name": "",
+              "role": "student"}
+
+
+def test_profile_group_reads_id_and_object():
+    assert profile_group({**ME_PAYLOAD, "group": 7}) == "7"
+    assert profile_group({**ME_PAYLOAD, "group": {"id": 7, "name": "ИТ-1"}}) == "7"
+    assert profile_group({**ME_PAYLOAD, "group": None}) is None
+
+
+def test_me_payload_without_group_field_has_no_group():
+    assert profile_group(ME_PAYLOAD) is None
+    assert profile_group(None) is None
+
+
+def test_roster_warns_once_when_profile_has_no_group_field(caplog):
+    async def scenario():
+        client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+        roster = GroupRoster(client)
+        await roster.remember(1, ME_PAYLOAD)
+        await roster.remember(2, ME_PAYLOAD)
+        await roster.remember(3, {**ME_PAYLOAD, "group": {"id": 5}})
+        return await client.smembers(roster.key(5))
+
+    with caplog.at_level(logging.WARNING, logger="notifications"):
+        members = asyncio.run(scenario())
+    assert members == {"3"}
+    assert sum("has no 'group' field" in record.message for record in caplog.records) == 1
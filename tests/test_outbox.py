@@ -0,0 +1,56 @@
+import asyncio
+import json
+
+import fakeredis.aioredis
+
+from outbox import DUE_KEY, ITEM_KEY, OUTBOX_LEASE, OUTBOX_MAX_ATTEMPTS, EventOutbox
+
+EVENT = {"title": "Олимпиада", "event_date": "2026-11-01T10:00:00", "group": 3}
+
+
+def test_submit_is_idempotent_per_flow():
+    async def scenario():
+        client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+        outbox = EventOutbox(client)
+        first = await outbox.submit(1, 10, "flow", EVENT)
+        second = await outbox.submit(1, 10, "flow", {**EVENT, "title": "Другое"})
+        item = await client.hgetall(ITEM_KEY.format(key="1:flow"))
+        return first, second, item, await client.zcard(DUE_KEY)
+
+    first, second, item, queued = asyncio.run(scenario())
+    assert (first, second) == (True, False)
+    assert item["status"] == "pending" and item["attempts"] == "0"
+    assert json.loads(item["payload"]) == EVENT and queued == 1
+
+
+def test_claim_leases_due_records():
+    async def scenario():
+        client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+        outbox = EventOutbox(client)
+        await client.zadd(DUE_KEY, {"due": 100, "later": 500})
+        claimed = await outbox._claim(keys=[DUE_KEY], args=[200, 10, OUTBOX_LEASE])
+        again = await outbox._claim(keys=[DUE_KEY], args=[200, 10, OUTBOX_LEASE])
+        return claimed, again, await client.zscore(DUE_KEY, "due")
+
+    claimed, again, score = asyncio.run(scenario())
+    assert claimed == ["due"] and again == []
+    assert score == 200 + OUTBOX_LEASE
+
+
+def test_broken_record_gives_up_after_max_attempts():
+    async def scenario():
+        client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+        outbox = EventOutbox(client)
+        await outbox.submit(1, 10, "flow", EVENT)
+        item_key = ITEM_KEY.format(key="1:flow")
+        await client.hset(item_key, "payload", "{broken")
+        attempts = []
+        for _ in range(OUTBOX_MAX_ATTEMPTS):
+            await outbox._deliver("1:flow")
+            attempts.append(await client.hget(item_key, "attempts"))
+        return attempts, await client.hgetall(item_key), await client.zscore(DUE_KEY, "1:flow")
+
+    attempts, item, score = asyncio.run(scenario())
+    assert attempts == [str(n) for n in range(1, OUTBOX_MAX_ATTEMPTS + 1)]
+    assert item["status"] == "failed"
+    assert score is None
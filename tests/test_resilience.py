@@ -0,0 +1,54 @@
+import pytest
+
+import resilience
+from resilience import CircuitBreaker, backoff
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(resilience, "monotonic", lambda: now[0])
+    return now
+
+
+def test_backoff_is_capped_full_jitter():
+    assert all(0 <= backoff(attempt, 1, 8) <= min(8, 2 ** (attempt - 1)) for attempt in range(1, 10))
+
+
+def test_breaker_opens_after_threshold(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10)
+    breaker.failure(), breaker.failure()
+    assert breaker.closed and breaker.allow()
+    breaker.failure()
+    assert not breaker.closed and not breaker.allow()
+
+
+def test_breaker_lets_one_probe_after_timeout(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    breaker.failure()
+    clock[0] += 10
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.success()
+    assert breaker.closed and breaker.allow()
+
+
+def test_failed_probe_reopens(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    breaker.failure()
+    clock[0] += 10
+    assert breaker.allow()
+    breaker.failure()
+    clock[0] += 5
+    assert not breaker.allow()
+    clock[0] += 5
+    assert breaker.allow()
+
+
+def test_lost_probe_is_replaced_after_timeout(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    breaker.failure()
+    clock[0] += 10
+    assert breaker.allow()
+    clock[0] += 10
+    assert breaker.allow()
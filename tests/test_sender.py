@@ -0,0 +1,35 @@
+import pytest
+
+import sender
+from sender import TokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(sender, "monotonic", lambda: now[0])
+    return now
+
+
+def test_bucket_allows_burst_then_paces(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    assert [bucket.reserve() for _ in range(3)] == [0, 0, 0]
+    assert bucket.reserve() == pytest.approx(0.5)
+    assert bucket.reserve() == pytest.approx(1.0)
+
+
+def test_bucket_refills_up_to_capacity(clock):
+    bucket = TokenBucket(rate=1, capacity=2)
+    bucket.reserve(), bucket.reserve()
+    clock[0] += 60
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(1.0)
+
+
+def test_pause_delays_even_with_tokens_left(clock):
+    bucket = TokenBucket(rate=1, capacity=5)
+    bucket.pause(7)
+    assert bucket.reserve() == pytest.approx(7)
+    clock[0] += 7
+    assert bucket.reserve() == 0
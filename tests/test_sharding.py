@@ -0,0 +1,59 @@
+import asyncio
+import json
+
+import fakeredis.aioredis
+
+from sharding import LEASE_KEY, STREAM_KEY, HashRing, ShardRouter, ShardWorker, slot_for, update_chat_id
+
+
+def test_update_chat_id_prefers_chat_then_user():
+    assert update_chat_id({"update_id": 1, "message": {"chat": {"id": -5}, "from": {"id": 7}}}) == -5
+    assert update_chat_id({"update_id": 1, "callback_query": {"from": {"id": 7}, "message": {"chat": {"id": 9}}}}) == 9
+    assert update_chat_id({"update_id": 1, "inline_query": {"from": {"id": 7}}}) == 7
+    assert update_chat_id({"update_id": 1}) == 0
+
+
+def test_slot_is_stable_and_in_range():
+    slots = [slot_for(chat_id, 64) for chat_id in range(1_000)]
+    assert slots == [slot_for(chat_id, 64) for chat_id in range(1_000)]
+    assert set(slots) == set(range(64))
+
+
+def test_ring_moves_only_slots_of_changed_worker():
+    keys = [str(slot) for slot in range(256)]
+    before = HashRing(["a", "b", "c"])
+    after = HashRing(["a", "b", "c", "d"])
+    moved = [key for key in keys if before.owner(key) != after.owner(key)]
+    assert all(after.owner(key) == "d" for key in moved)
+    assert len(moved) < len(keys) / 2
+    assert HashRing([]).owner("1") is None
+
+
+def test_router_appends_to_slot_stream():
+    async def scenario():
+        client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+        update = {"update_id": 1, "message": {"chat": {"id": 42}, "text": "/start"}}
+        assert await ShardRouter(client, slots=8).route(update)
+        entries = await client.xrange(STREAM_KEY.format(slot=slot_for(42, 8)))
+        return [json.loads(fields["u"]) for _, fields in entries]
+
+    assert asyncio.run(scenario()) == [{"update_id": 1, "message": {"chat": {"id": 42}, "text": "/start"}}]
+
+
+def test_lease_belongs_to_one_worker():
+    async def scenario():
+        client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+        a = ShardWorker(client, None, None, "a")
+        b = ShardWorker(client, None, None, "b")
+        lease = [LEASE_KEY.format(slot=3)]
+        return [
+            await a._acquire(keys=lease, args=["a", 10_000]),
+            await b._acquire(keys=lease, args=["b", 10_000]),
+            await a._acquire(keys=lease, args=["a", 10_000]),  # перезапуск с тем же id
+            await b._renew(keys=lease, args=["b", 10_000]),
+            await b._release(keys=lease, args=["b"]),
+            await a._release(keys=lease, args=["a"]),
+            await b._acquire(keys=lease, args=["b", 10_000]),
+        ]
+
+    assert asyncio.run(scenario()) == [1, 0, 1, 0, 0, 1, 1]
@@ -0,0 +1,120 @@
+import asyncio
+import os
+import logging
+from collections import OrderedDict
+from time import time
+
+import jwt
+from redis.exceptions import LockError
+
+from api import refresh_access_token
+from cache import redis_client, save_tokens_redis, get_tokens_redis
+
+logger = logging.getLogger(__name__)
+
+# За сколько секунд до истечения access_token обновлять его в фоне
+TOKEN_REFRESH_AHEAD = int(os.getenv("TOKEN_REFRESH_AHEAD", 60))
+# Время жизни межпроцессной блокировки на обновление токена
+TOKEN_LOCK_TIMEOUT = int(os.getenv("TOKEN_LOCK_TIMEOUT", 15))
+TOKEN_EXP_CACHE_SIZE = 10_000
+
+
+class TokenManager:
+    """Выдаёт действующий access_token: обновление одно на tg_id, заранее и в фоне."""
+
+    def __init__(self, refresh_ahead: int = TOKEN_REFRESH_AHEAD,
+                 lock_timeout: int = TOKEN_LOCK_TIMEOUT,
+                 exp_cache_size: int = TOKEN_EXP_CACHE_SIZE):
+        self.refresh_ahead = refresh_ahead
+        self.lock_timeout = lock_timeout
+        self._exp_cache_size = exp_cache_size
+        self._exp: OrderedDict[str, float] = OrderedDict()
+        self._inflight: dict[int, asyncio.Task] = {}
+
+    def token_exp(self, access_token: str) -> float:
+        """Возвращает exp токена, декодируя JWT только при первом обращении."""
+        exp = self._exp.get(access_token)
+        if exp is not None:
+            self._exp.move_to_end(access_token)
+            return exp
+
+        decoded = jwt.decode(access_token, options={"verify_signature": False})
+        exp = float(decoded.get("exp", 0))
+        self._exp[access_token] = exp
+        if len(self._exp) > self._exp_cache_size:
+            self._exp.popitem(last=False)
+        return exp
+
+    async def get_access_token(self, tg_id: int, tokens: dict) -> str | None:
+        """Действующий access_token пользователя или None, если сессию не продлить."""
+        ttl = self.token_exp(tokens["access"]) - time()
+
+        if ttl <= 0:
+            # Токен уже истёк — ждём обновления (общего для всех апдейтов пользователя)
+            new_tokens = await self.refresh(tg_id, tokens)
+            return new_tokens["access"] if new_tokens else None
+
+        if ttl < self.refresh_ahead and tg_id not in self._inflight:
+            # Скоро истечёт — обновляем в фоне, а обработчик работает со старым токеном
+            self._start_refresh(tg_id, tokens)
+
+        return tokens["access"]
+
+    async def refresh(self, tg_id: int, tokens: dict) -> dict | None:
+        """Обновляет токены; параллельные вызовы для одного tg_id ждут один запрос."""
+        task = self._inflight.get(tg_id) or self._start_refresh(tg_id, tokens)
+        return await asyncio.shield(task)
+
+    def _start_refresh(self, tg_id: int, tokens: dict) -> asyncio.Task:
+        task = asyncio.create_task(self._refresh(tg_id, tokens))
+        self._inflight[tg_id] = task
+        task.add_done_callback(lambda t: self._on_refresh_done(tg_id, t))
+        return task
+
+    def _on_refresh_done(self, tg_id: int, task: asyncio.Task) -> None:
+        if self._inflight.get(tg_id) is task:
+            del self._inflight[tg_id]
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Token refresh Error for {tg_id}: {task.exception()}")
+
+    async def _refresh(self, tg_id: int, tokens: dict) -> dict | None:
+        lock = redis_client.lock(f"lock:refresh:{tg_id}",
+                                 timeout=self.lock_timeout,
+                                 blocking_timeout=self.lock_timeout)
+        try:
+            async with lock:
+                # Пока ждали блокировку, другой процесс мог уже обновить токен
+                current = await get_tokens_redis(tg_id)
+                if current and self._is_fresh(current, tokens):
+                    return current
+
+                new_tokens = await refresh_access_token(tokens["refresh"])
+                if not new_tokens:
+                    return None
+
+                saved = {
+                    'access': new_tokens["access"],
+                    'refresh': new_tokens.get("refresh", tokens["refresh"])
+                }
+                await save_tokens_redis(tg_id, saved)
+                return saved
+        except LockError:
+            logger.warning(f"Token refresh lock timeout for {tg_id}")
+            current = await get_tokens_redis(tg_id)
+            return current if current and self._is_fresh(current, tokens) else None
+
+    def _is_fresh(self, current: dict, stale: dict) -> bool:
+        if current["access"] == stale["access"]:
+            return False
+        try:
+            return self.token_exp(current["access"]) - time() > self.refresh_ahead
+        except jwt.DecodeError:
+            return False
+
+    async def close(self) -> None:
+        """Дожидается обновлений, начатых в фоне (хук на shutdown диспетчера)."""
+        if self._inflight:
+            await asyncio.gather(*self._inflight.values(), return_exceptions=True)
+
+
+token_manager = TokenManager()
@@ -0,0 +1,150 @@
+import asyncio
+import os
+import logging
+from collections import deque
+from time import monotonic
+from typing import Any, Callable, Dict
+
+from aiogram.types import Update
+
+from metrics import UPDATE_ACTIVE, UPDATE_QUEUE_DEPTH, UPDATE_WAIT, UPDATES_SHED
+
+logger = logging.getLogger(__name__)
+
+# Сколько апдейтов обрабатывается одновременно во всём процессе
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", 64))
+# Глубина очереди, после которой тяжёлые просмотры получают "занято"; остальные — после двойной
+UPDATE_QUEUE_LIMIT = int(os.getenv("UPDATE_QUEUE_LIMIT", 500))
+
+# Классы приоритета: шаги сценариев и нажатия кнопок, команды и меню, просмотр списков
+INTERACTIVE = 0
+MENU = 1
+BULK = 2
+PRIORITY_NAMES = ("interactive", "menu", "bulk")
+
+MENU_TEXTS = {'Профиль', 'Создать мероприятие', 'Выйти из акканута'}
+BULK_TEXTS = {'Просмотреть мероприятия'}
+BULK_COMMANDS = ('/find',)
+
+BUSY_TEXT = "⏳ Бот сейчас перегружен, повторите через минуту."
+
+
+def update_priority(event: Update) -> int:
+    if event.callback_query is not None:
+        return INTERACTIVE
+    if event.inline_query is not None:
+        return BULK
+    text = event.message.text if event.message is not None else None
+    if not text:
+        return INTERACTIVE
+    if text in BULK_TEXTS or text.startswith(BULK_COMMANDS):
+        return BULK
+    if text in MENU_TEXTS or text.startswith('/'):
+        return MENU
+    # Прочий текст — ответ на шаг сценария (логин, создание мероприятия)
+    return INTERACTIVE
+
+
+class UpdateScheduler:
+    """Допуск апдейтов к обработчикам: не больше ``concurrency`` одновременно.
+
+    Ожидающие апдейты стоят в очередях по классам приоритета и получают
+    освободившийся слот в порядке класса, внутри класса — по очереди.
+    Регистрируется после chat_serial_middleware: у каждого чата в очереди
+    не больше одного апдейта, поэтому очередь — это круговой обход чатов.
+    Апдейты, ждущие блокировку своего чата, до планировщика ещё не дошли,
+    но входят в предел очереди: chat_serial_middleware отклоняет их через
+    ``overloaded``/``reject`` и отмечает в ``chat_waiting``.
+    """
+
+    def __init__(self, concurrency: int = UPDATE_CONCURRENCY, queue_limit: int = UPDATE_QUEUE_LIMIT):
+        self.concurrency = concurrency
+        self.queue_limit = queue_limit
+        self.active = 0
+        self.chat_waiting = 0
+        self._queues: list[deque[asyncio.Future]] = [deque() for _ in PRIORITY_NAMES]
+
+    @property
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._queues)
+
+    def overloaded(self, priority: int) -> bool:
+        """Очередь (вместе с ждущими блокировку чата) полна для апдейта этого класса."""
+        limit = self.queue_limit if priority == BULK else 2 * self.queue_limit
+        return self.queued + self.chat_waiting >= limit
+
+    def wait_chat(self, delta: int) -> None:
+        self.chat_waiting += delta
+        UPDATE_QUEUE_DEPTH.set(self.chat_waiting, priority="chat_lock")
+
+    def _publish(self) -> None:
+        UPDATE_ACTIVE.set(self.active)
+        for name, queue in zip(PRIORITY_NAMES, self._queues):
+            UPDATE_QUEUE_DEPTH.set(len(queue), priority=name)
+
+    async def __call__(
+            self,
+            handler: Callable[[Update, Dict[str, Any]], Any],
+            event: Update,
+            data: Dict[str, Any]
+    ) -> Any:
+        priority = update_priority(event)
+        if self.active < self.concurrency and not self.queued:
+            self.active += 1
+            self._publish()
+        else:
+            if self.overloaded(priority):
+                await self.reject(event, priority)
+                return None
+            await self._wait(priority)
+
+        try:
+            return await handler(event, data)
+        finally:
+            self._release()
+
+    async def _wait(self, priority: int) -> None:
+        waiter = asyncio.get_running_loop().create_future()
+        queue = self._queues[priority]
+        queue.append(waiter)
+        self._publish()
+        start = monotonic()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Слот уже передан этому апдейту — отдаём его следующему
+                self._release()
+            else:
+                queue.remove(waiter)
+                self._publish()
+            raise
+        UPDATE_WAIT.observe(monotonic() - start, priority=PRIORITY_NAMES[priority])
+
+    def _release(self) -> None:
+        # Слот переходит первому ожидающему из самого приоритетного класса, active не меняется
+        for queue in self._queues:
+            while queue:
+                waiter = queue.popleft()
+                if not waiter.done():
+                    waiter.set_result(None)
+                    self._publish()
+                    return
+        self.active -= 1
+        self._publish()
+
+    async def reject(self, event: Update, priority: int) -> None:
+        """Отвечает "занято" вместо обработки."""
+        UPDATES_SHED.inc(priority=PRIORITY_NAMES[priority])
+        try:
+            if event.message is not None:
+                await event.message.answer(BUSY_TEXT)
+            elif event.callback_query is not None:
+                await event.callback_query.answer(BUSY_TEXT, show_alert=True)
+            elif event.inline_query is not None:
+                await event.inline_query.answer([], cache_time=0, is_personal=True)
+        except Exception as e:
+            logger.error(f"Busy reply Error: {e}")
+
+
+update_scheduler = UpdateScheduler()